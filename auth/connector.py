@@ -1,28 +1,106 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import os
 
-from trello import TrelloClient
+import requests
+from requests.adapters import HTTPAdapter
 
+import settings
+from stats.trelloboardindex import TrelloBoardIndex
+from stats.trellofetcher import TokenBucket, TrelloFetcher
 
+
+# Credentials and HTTP connections to Trello API.
+# The connector owns a pooled keep-alive HTTP session that is shared by all the fetchers it creates, so TCP and TLS
+# connections are reused across requests. Its fetchers share its rate limiter too, as Trello limits the requests of
+# each token.
 class TrelloConnector(object):
 
-    def __init__(self, api_key, api_secret, token, token_secret):
+    # Max number of connections kept open to Trello API
+    DEFAULT_POOL_SIZE = 10
+
+    # Timeouts in seconds to connect and to read each response
+    DEFAULT_TIMEOUT = (10.0, 60.0)
+
+    def __init__(self, api_key, api_secret, token, token_secret,
+                 pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, batch=False,
+                 rate_limit=TrelloFetcher.DEFAULT_RATE_LIMIT, rate_limit_period=TrelloFetcher.DEFAULT_RATE_LIMIT_PERIOD):
+        """
+        :param api_key: Trello API key.
+        :param api_secret: Trello API secret.
+        :param token: Trello token.
+        :param token_secret: Trello token secret.
+        :param pool_size: max number of connections kept open to Trello API.
+        :param timeout: tuple with the connection and read timeouts in seconds.
+        :param batch: if True, independent GET requests are grouped in requests to Trello /batch endpoint. Batches
+        are serial requests, so it is only worth enabling it when the rate limit matters more than the latency.
+        :param rate_limit: max number of requests of all the fetchers of this connector in rate_limit_period seconds.
+        Processes that use the same token at the same time must share the limit of the token.
+        :param rate_limit_period: time in seconds.
+        """
         self.api_key = api_key
         self.api_secret = api_secret
         self.token = token
         self.token_secret = token_secret
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.batch = batch
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.session = None
+        self.token_bucket = None
+        self.trello_client = None
+        self.board_index = None
+
+    # Shared HTTP session with a pool of keep-alive connections
+    def get_session(self):
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        return self.session
+
+    # Rate limiter shared by all the fetchers
+    def get_token_bucket(self):
+        if self.token_bucket is None:
+            self.token_bucket = TokenBucket(self.rate_limit, self.rate_limit_period)
+        return self.token_bucket
 
     def get_trello_client(self):
-        client = TrelloClient(
-            api_key=self.api_key,
-            api_secret=self.api_secret,
-            token=self.token,
-            token_secret=self.token_secret
+        if self.trello_client is None:
+            # py-trello is only loaded when its client is used
+            from trello import TrelloClient
+            from trello.configuration import Configuration
+            Configuration.TIMEZONE = settings.TIMEZONE_NAME
+            self.trello_client = TrelloClient(
+                api_key=self.api_key,
+                api_secret=self.api_secret,
+                token=self.token,
+                token_secret=self.token_secret
+            )
+        return self.trello_client
+
+    # Index of the boards of the user, shared by all the boards fetched with this connector.
+    # There is an index file for each token, as each token can see different boards.
+    def get_board_index(self):
+        if self.board_index is None:
+            token_hash = hashlib.sha1(u"{0}:{1}".format(self.api_key, self.token).encode("utf-8")).hexdigest()
+            self.board_index = TrelloBoardIndex(
+                os.path.join(settings.BOARD_INDEX_DIR, u"board_ids-{0}.json".format(token_hash[0:16]))
+            )
+        return self.board_index
+
+    def get_fetcher(self, concurrency=TrelloFetcher.DEFAULT_CONCURRENCY):
+        return TrelloFetcher(
+            api_key=self.api_key, token=self.token, concurrency=min(concurrency, self.pool_size),
+            session=self.get_session(), timeout=self.timeout, batch=self.batch, token_bucket=self.get_token_bucket()
         )
-        return client
 
     def test(self):
-        client = self.get_trello_client()
+        fetcher = self.get_fetcher()
         print(u"Listing all accesible boards")
-        boards = client.list_boards()
+        boards = fetcher.fetch_json(u"/members/me/boards", query_params={"fields": "name"})
         for board in boards:
-            print(u"{0}".format(board.name.decode("utf-8")))
+            print(u"{0}".format(board["name"]))
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Stats modules are imported in the functions that use them, so --import-times does not load them
+
+# Phases of the stats extraction that are measured
+PHASES = ["get_stats", "get_spent_estimated", "get_graphics", "summary_make"]
+
+# Modules whose import time is measured, from the lightest to the heaviest one
+IMPORT_TIME_MODULES = [
+    "stats_extractor", "stats.trelloboardconfiguration", "settings", "auth.connector", "stats.trellostatsextractor",
+    "stats.summary", "charts.trellochart"
+]
+
+# Directory of this script: modules are imported from it
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Redirects stdout to the null device, so the cards printed by the stats extractor are not measured
+@contextlib.contextmanager
+def silenced_stdout():
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def run_phase(phase, snapshot, configuration):
+    """
+    Runs a phase of the stats extraction.
+    :param phase: name of the phase.
+    :param snapshot: TrelloBoardSnapshot of the board.
+    :param configuration: TrelloBoardConfiguration of the board.
+    :return: time in seconds of the measured part of the phase.
+    """
+    from charts import trellochart
+    from stats import summary
+    from stats.trellostatsextractor import TrelloStatsExtractor
+
+    # The report is never printed, whatever the configuration says
+    configuration.report_quiet = True
+
+    if phase == "summary_make":
+        with silenced_stdout():
+            start_time = time.time()
+            summary.make(None, configuration, snapshot)
+            return time.time() - start_time
+
+    stat_extractor = TrelloStatsExtractor(trello_connector=None, configuration=configuration, snapshot=snapshot)
+
+    if phase == "get_stats":
+        with silenced_stdout():
+            start_time = time.time()
+            stat_extractor.get_stats()
+            return time.time() - start_time
+
+    if phase == "get_spent_estimated":
+        start_time = time.time()
+        stat_extractor._get_spent_estimated_by_card(
+            stat_extractor.cards, stat_extractor.snapshot.comment_timesheet_builder
+        )
+        return time.time() - start_time
+
+    if phase == "get_graphics":
+        with silenced_stdout():
+            stats = stat_extractor.get_stats()
+            start_time = time.time()
+            trellochart.get_graphics(stats, stat_extractor)
+            return time.time() - start_time
+
+    raise ValueError(u"Unknown phase {0}".format(phase))
+
+
+# Peak resident memory of this process in KiB
+def get_peak_memory():
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Mac OS X gives it in bytes, Linux in KiB
+    if sys.platform == "darwin":
+        return peak_memory // 1024
+    return peak_memory
+
+
+# Runs a phase with a new synthetic board in the current process and puts its measures in a queue.
+# It is the target of the process of each run of a phase.
+def _run_phase_in_process(phase, board_parameters, svg_charts, result_queue):
+    from benchmarks import syntheticboard
+    # Modules of the phases are imported before the memory is measured, so their memory is not part of the phase
+    importlib.import_module("charts.trellochart")
+    importlib.import_module("stats.summary")
+
+    start_time = time.time()
+    snapshot = syntheticboard.generate(**board_parameters)
+    generation_time = time.time() - start_time
+
+    output_dir = tempfile.mkdtemp(prefix=u"pystats-trello-benchmark-")
+    try:
+        configuration = syntheticboard.get_configuration(
+            output_dir, num_lists=board_parameters["num_lists"], svg_charts=svg_charts, report_quiet=True
+        )
+        peak_memory_before = get_peak_memory()
+        phase_time = run_phase(phase, snapshot, configuration)
+        result_queue.put({
+            "time": phase_time,
+            "generation_time": generation_time,
+            "num_actions": snapshot.num_actions,
+            "peak_memory_kib": get_peak_memory(),
+            "peak_memory_increase_kib": get_peak_memory() - peak_memory_before
+        })
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def measure_phase(phase, board_parameters, svg_charts):
+    """
+    Runs a phase in a new process with a new synthetic board, so its peak memory is not the one of the previous
+    phases nor the one of the previous runs, and no run reuses the objects (e.g. the cached cards) of another one.
+    :param phase: name of the phase.
+    :param board_parameters: parameters of syntheticboard.generate.
+    :param svg_charts: if True, charts are rendered as SVG (PNG rendering needs CairoSVG).
+    :return: dict with the time of the phase, the generation time and number of actions of the board and the peak
+    memory of the process.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run_phase_in_process, args=(phase, board_parameters, svg_charts, result_queue)
+    )
+    process.start()
+    # The result is small enough to be in the queue buffer, so the process can be joined before reading it
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(u"Phase {0} failed with exit code {1}".format(phase, process.exitcode))
+    return result_queue.get()
+
+
+def run_benchmark(board_parameters, phases, repeat, svg_charts):
+    """
+    Measures each phase of the stats extraction with a synthetic board.
+    Each run of each phase is made in a new process with a new board.
+    :param board_parameters: parameters of syntheticboard.generate.
+    :param phases: names of the phases to measure.
+    :param repeat: number of times each phase is run.
+    :param svg_charts: if True, charts are rendered as SVG (PNG rendering needs CairoSVG).
+    :return: dict with the results.
+    """
+    phase_results = {}
+    runs = []
+    for phase in phases:
+        phase_runs = [measure_phase(phase, board_parameters, svg_charts) for _repetition in range(repeat)]
+        times = [phase_run["time"] for phase_run in phase_runs]
+        phase_results[phase] = {
+            "times": times,
+            "min": min(times),
+            "mean": sum(times) / len(times),
+            "peak_memory_kib": max(phase_run["peak_memory_kib"] for phase_run in phase_runs),
+            "peak_memory_increase_kib": max(phase_run["peak_memory_increase_kib"] for phase_run in phase_runs)
+        }
+        runs += phase_runs
+
+    generation_times = [run["generation_time"] for run in runs]
+    return {
+        "datetime": datetime.datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "board": board_parameters,
+        "num_actions": runs[0]["num_actions"],
+        "generation_time": sum(generation_times) / len(generation_times),
+        "repeat": repeat,
+        "svg_charts": svg_charts,
+        "phases": phase_results
+    }
+
+
+# Time in seconds of the import of a module in a new Python process
+def measure_import_time(module_name):
+    code = (
+        "import sys, time\n"
+        "start_time = time.time()\n"
+        "import {0}\n"
+        "sys.stdout.write(repr(time.time() - start_time))\n"
+    ).format(module_name)
+    return float(subprocess.check_output([sys.executable, "-c", code], cwd=ROOT_DIR))
+
+
+# Wall time in seconds of a run of stats_extractor.py with some arguments, including the interpreter startup
+def measure_command_time(arguments):
+    with open(os.devnull, "wb") as devnull:
+        start_time = time.time()
+        subprocess.check_call([sys.executable, "stats_extractor.py"] + arguments, cwd=ROOT_DIR, stdout=devnull)
+        return time.time() - start_time
+
+
+def run_import_time_benchmark(repeat):
+    """
+    Measures the import time of the main modules and the time of the short runs of stats_extractor.py.
+    Each measure is made in a new Python process.
+    :param repeat: number of times each measure is made.
+    :return: dict with the min and mean times in seconds of each module and command.
+    """
+    def summarize(times):
+        return {"times": times, "min": min(times), "mean": sum(times) / len(times)}
+
+    commands = {
+        "help": ["--help"],
+        "validate_config": [os.path.join(ROOT_DIR, u"config-examples"), "--validate-config"]
+    }
+    return {
+        "datetime": datetime.datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "modules": {
+            module_name: summarize([measure_import_time(module_name) for _repetition in range(repeat)])
+            for module_name in IMPORT_TIME_MODULES
+        },
+        "commands": {
+            command_name: summarize([measure_command_time(arguments) for _repetition in range(repeat)])
+            for command_name, arguments in commands.items()
+        }
+    }
+
+
+def print_import_time_results(results):
+    for module_name in IMPORT_TIME_MODULES:
+        module_results = results["modules"][module_name]
+        print(u"- import {0}: min {1:.3f} s, mean {2:.3f} s".format(module_name, module_results["min"], module_results["mean"]))
+    for command_name in sorted(results["commands"].keys()):
+        command_results = results["commands"][command_name]
+        print(u"- stats_extractor.py {0}: min {1:.3f} s, mean {2:.3f} s".format(
+            command_name, command_results["min"], command_results["mean"]
+        ))
+
+
+def print_results(results):
+    print(u"Board: {0} cards, {1} actions".format(results["board"]["num_cards"], results["num_actions"]))
+    for phase in PHASES:
+        if phase in results["phases"]:
+            phase_results = results["phases"][phase]
+            print(u"- {0}: min {1:.3f} s, mean {2:.3f} s, peak memory {3} KiB (+{4} KiB)".format(
+                phase, phase_results["min"], phase_results["mean"],
+                phase_results["peak_memory_kib"], phase_results["peak_memory_increase_kib"]
+            ))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=u"Benchmark of the stats extraction with a synthetic board")
+    parser.add_argument("--cards", type=int, default=1000, help=u"number of cards")
+    parser.add_argument("--lists", type=int, default=5, help=u"number of lists")
+    parser.add_argument("--members", type=int, default=5, help=u"number of members")
+    parser.add_argument("--labels", type=int, default=5, help=u"number of labels")
+    parser.add_argument("--movements", type=int, default=4, help=u"average number of movements of each card")
+    parser.add_argument("--comments", type=int, default=2, help=u"average number of comments of each card")
+    parser.add_argument("--seed", type=int, default=0, help=u"seed of the synthetic board generator")
+    parser.add_argument("--repeat", type=int, default=3, help=u"number of times each phase is run")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES, help=u"phases to measure")
+    parser.add_argument("--png", action="store_true", help=u"render PNG charts instead of SVG (needs CairoSVG)")
+    parser.add_argument("--import-times", dest="import_times", action="store_true",
+                        help=u"measure the import time of the main modules and the startup of stats_extractor.py "
+                             u"instead of the phases")
+    parser.add_argument("--output", help=u"JSON file where the results are written")
+    args = parser.parse_args()
+
+    if args.import_times:
+        benchmark_results = run_import_time_benchmark(args.repeat)
+        print_import_time_results(benchmark_results)
+        if args.output:
+            with io.open(args.output, "wb") as output_file:
+                output_file.write(json.dumps(benchmark_results, indent=4, sort_keys=True).encode("utf-8"))
+        sys.exit(0)
+
+    if args.lists < 2:
+        parser.error(u"--lists must be at least 2 (development and done lists)")
+
+    benchmark_results = run_benchmark(
+        {
+            "num_cards": args.cards,
+            "num_lists": args.lists,
+            "num_members": args.members,
+            "num_labels": args.labels,
+            "movements_per_card": args.movements,
+            "comments_per_card": args.comments,
+            "seed": args.seed
+        },
+        args.phases, args.repeat, svg_charts=not args.png
+    )
+
+    print_results(benchmark_results)
+
+    if args.output:
+        with io.open(args.output, "wb") as output_file:
+            output_file.write(json.dumps(benchmark_results, indent=4, sort_keys=True).encode("utf-8"))
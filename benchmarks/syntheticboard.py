@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import calendar
+import datetime
+import random
+
+from stats.trelloboardconfiguration import TrelloBoardConfiguration
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+
+
+# Synthetic boards with the same structure as the ones returned by Trello API.
+# Boards are generated from a seed, so two boards generated with the same parameters are equal.
+
+# Date of the first card of the synthetic boards
+START_DATETIME = datetime.datetime(2016, 1, 1)
+
+
+# Generates a synthetic board snapshot
+def generate(num_cards=1000, num_lists=5, num_members=5, num_labels=5, movements_per_card=4, comments_per_card=2,
+             seed=0):
+    """
+    Generates a board with random cards, list movements and spent/estimated time comments.
+    :param num_cards: number of cards.
+    :param num_lists: number of lists. The first one is the backlog, the second one the development list and the
+    last one the done list.
+    :param num_members: number of members.
+    :param num_labels: number of labels.
+    :param movements_per_card: average number of movements between lists of each card.
+    :param comments_per_card: average number of spent/estimated time comments of each card.
+    :param seed: seed of the random number generator.
+    :return: TrelloBoardSnapshot.
+    """
+    random_ = random.Random(seed)
+    board_id = _make_id(START_DATETIME, 0)
+
+    lists = [{"id": _make_id(START_DATETIME, list_index + 1), "name": get_list_name(list_index), "closed": False}
+             for list_index in range(num_lists)]
+    members = [{"id": _make_id(START_DATETIME, num_lists + member_index + 1),
+                "username": u"member{0}".format(member_index),
+                "fullName": u"Member {0}".format(member_index)}
+               for member_index in range(num_members)]
+    labels = [{"id": _make_id(START_DATETIME, num_lists + num_members + label_index + 1),
+               "name": u"Label {0}".format(label_index),
+               "color": u"green"}
+              for label_index in range(num_labels)]
+
+    cards = []
+    actions = []
+    for card_index in range(num_cards):
+        card, card_actions = _generate_card(
+            random_, card_index, lists, members, labels, movements_per_card, comments_per_card
+        )
+        cards.append(card)
+        actions += card_actions
+
+    # Trello API returns the actions from the newest to the oldest one
+    actions.sort(key=lambda action: (action["date"], action["id"]), reverse=True)
+
+    board_json = {
+        "id": board_id,
+        "name": u"Synthetic board",
+        "lists": lists,
+        "members": members,
+        "labels": labels,
+        "cards": cards
+    }
+    return TrelloBoardSnapshot(board_json, actions)
+
+
+# Configuration that computes the stats of a synthetic board
+def get_configuration(output_dir, num_lists=5, **kwargs):
+    """
+    :param output_dir: directory where the report and the charts are written.
+    :param num_lists: number of lists of the synthetic board.
+    :param kwargs: other parameters of TrelloBoardConfiguration.
+    :return: TrelloBoardConfiguration.
+    """
+    return TrelloBoardConfiguration(
+        board_name=u"Synthetic board",
+        card_is_active_function=u"not card.closed",
+        development_list_name=get_list_name(1),
+        done_list_name=get_list_name(num_lists - 1),
+        spent_estimated_time_comment_regex="PLUS_FOR_TRELLO_REGEX",
+        output_dir=output_dir,
+        custom_workflows=[],
+        **kwargs
+    )
+
+
+def get_list_name(list_index):
+    return u"List {0}".format(list_index)
+
+
+def _generate_card(random_, card_index, lists, members, labels, movements_per_card, comments_per_card):
+    num_lists = len(lists)
+    creation_datetime = START_DATETIME + datetime.timedelta(minutes=random_.randint(0, 365 * 24 * 60))
+    card_id = _make_id(creation_datetime, card_index)
+    card_reference = {"id": card_id, "name": u"Card {0}".format(card_index), "idShort": card_index + 1}
+    card_member_ids = [member["id"] for member in random_.sample(members, min(len(members), random_.randint(0, 2)))]
+    card_label_ids = [label["id"] for label in random_.sample(labels, min(len(labels), random_.randint(0, 2)))]
+
+    actions = [
+        _make_action(u"createCard", creation_datetime, card_index, 0, random_.choice(members),
+                     {"card": card_reference, "list": lists[0]})
+    ]
+
+    # Cards usually move forward, one list each time, but sometimes go back
+    list_index = 0
+    action_datetime = creation_datetime
+    for movement_index in range(random_.randint(0, 2 * movements_per_card)):
+        action_datetime += datetime.timedelta(minutes=random_.randint(1, 7 * 24 * 60))
+        if list_index == num_lists - 1 or (list_index > 0 and random_.random() < 0.2):
+            new_list_index = list_index - 1
+        else:
+            new_list_index = list_index + 1
+        actions.append(
+            _make_action(u"updateCard", action_datetime, card_index, len(actions), random_.choice(members), {
+                "card": card_reference,
+                "listBefore": {"id": lists[list_index]["id"], "name": lists[list_index]["name"]},
+                "listAfter": {"id": lists[new_list_index]["id"], "name": lists[new_list_index]["name"]},
+                "old": {"idList": lists[list_index]["id"]}
+            })
+        )
+        list_index = new_list_index
+
+    for comment_index in range(random_.randint(0, 2 * comments_per_card)):
+        comment_datetime = creation_datetime + datetime.timedelta(minutes=random_.randint(1, 60 * 24 * 60))
+        comment_text = u"plus! {0}/{1}".format(random_.randint(0, 8), random_.randint(0, 8))
+        actions.append(
+            _make_action(u"commentCard", comment_datetime, card_index, len(actions), random_.choice(members), {
+                "card": card_reference,
+                "text": comment_text
+            })
+        )
+
+    card = {
+        "id": card_id,
+        "name": card_reference["name"],
+        "closed": random_.random() < 0.1,
+        "idList": lists[list_index]["id"],
+        "idMembers": card_member_ids,
+        "idLabels": card_label_ids,
+        "dateLastActivity": max(action["date"] for action in actions)
+    }
+    return card, actions
+
+
+def _make_action(action_type, action_datetime, card_index, action_index, member, data):
+    return {
+        "id": _make_id(action_datetime, card_index * 1000 + action_index),
+        "type": action_type,
+        "date": _to_iso_date(action_datetime),
+        "idMemberCreator": member["id"],
+        "data": data
+    }
+
+
+# Trello ids are 24 hexadecimal digits whose first 8 digits are the creation timestamp
+def _make_id(creation_datetime, counter):
+    return u"{0:08x}{1:016x}".format(calendar.timegm(creation_datetime.utctimetuple()), counter)
+
+
+def _to_iso_date(datetime_):
+    return datetime_.strftime("%Y-%m-%dT%H:%M:%S.") + u"{0:03d}Z".format(datetime_.microsecond // 1000)
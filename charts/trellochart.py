@@ -1,17 +1,66 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import datetime
+import multiprocessing
+import time
 import pygal
 import settings
 from slugify import slugify
 
+from charts.trellochartcache import TrelloChartCache
+from stats import instrumentation
+
 
 def get_graphics(stats, stat_extractor):
     """
     Prints a chart with the average time a card is in each column.
+    Charts are defined as chart specs first and then rendered, concurrently if the configuration has several chart jobs.
     :param stats: statistics generated with trellostats
     :param configuration: configuration of the board
-    :return:
+    :return: dict with the spec, the path and the rendering time in seconds of the main charts, the rendering
+    results of all the charts ("rendering_results") and the path of each chart ("chart_paths").
+    """
+    configuration = stat_extractor.configuration
+    with instrumentation.timer("charts.specs"):
+        chart_specs = get_chart_specs(stats, stat_extractor)
+    chart_cache = None
+    if configuration.chart_cache:
+        chart_cache = TrelloChartCache(configuration.cache_dir)
+    with instrumentation.timer("charts.render"):
+        rendering_results = render_charts(
+            chart_specs, jobs=configuration.chart_jobs, svg_only=configuration.svg_charts, chart_cache=chart_cache
+        )
+    instrumentation.count("charts.rendered", len([result for result in rendering_results.values() if not result["cached"]]))
+    instrumentation.count("charts.cached", len([result for result in rendering_results.values() if result["cached"]]))
+
+    main_charts = {
+        "time": u"time_by_list",
+        "forward": u"forward_movements_by_list",
+        "backward": u"backward_movements_by_list",
+        "forward_movements_by_user": u"forward_movements_by_user",
+        "backward_movements_by_user": u"backward_movements_by_user",
+        "difference_movements_by_user": u"diff_movements_by_user"
+    }
+    chart_specs_dict = {chart_spec["name"]: chart_spec for chart_spec in chart_specs}
+    graphics = {
+        key: {
+            "spec": chart_specs_dict[chart_name],
+            "path": chart_specs_dict[chart_name]["file_path"],
+            "rendering_time": rendering_results[chart_name]["time"]
+        }
+        for key, chart_name in main_charts.items()
+    }
+    graphics["rendering_results"] = [(chart_spec["name"], rendering_results[chart_spec["name"]]) for chart_spec in chart_specs]
+    graphics["chart_paths"] = {chart_spec["name"]: chart_spec["file_path"] for chart_spec in chart_specs}
+    return graphics
+
+
+def get_chart_specs(stats, stat_extractor):
+    """
+    Defines the charts of the stats of a board without rendering them.
+    :param stats: statistics generated with trellostats
+    :param stat_extractor: TrelloStatsExtractor that has generated the stats
+    :return: list of chart specs (dicts that can be sent to other processes)
     """
 
     lists = stats["lists"]
@@ -21,107 +70,259 @@ def get_graphics(stats, stat_extractor):
     if configuration.censored:
         board_name = stat_extractor.board.id
 
+    extension = u"svg" if configuration.svg_charts else u"png"
+
+    chart_specs = []
+
     # Time by list
     chart_title = u"Average time for all board cards by list for {0}".format(board_name)
-    time_by_list_chart_ = avg_by_list_chart(chart_title, lists, stats, "time_by_list")
-    time_chart_file_path = _get_chart_path(u"time_by_list", configuration)
-    time_by_list_chart_.render_to_png(time_chart_file_path)
+    chart_specs.append(avg_by_list_chart(u"time_by_list", chart_title, lists, stats, "time_by_list"))
 
     # Time by list in custom workflow context
     if stat_extractor.has_custom_workflows():
         for custom_workflow in stat_extractor.get_custom_workflows():
             chart_title = u"Average time for all board cards by list for custom workflow {0} of {1}".format(custom_workflow.name, board_name)
             wf_i_lists = custom_workflow.lists
-            wf_i_time_by_list_chart_ = avg_by_list_chart(chart_title, wf_i_lists, stats, "time_by_list")
-            wf_i_time_chart_file_path = _get_chart_path(u"wf_time_by_list_{0}".format(custom_workflow.name), configuration)
-            wf_i_time_by_list_chart_.render_to_png(wf_i_time_chart_file_path)
+            chart_specs.append(avg_by_list_chart(u"wf_time_by_list_{0}".format(custom_workflow.name), chart_title, wf_i_lists, stats, "time_by_list"))
+
+    # Percentiles of the time by list
+    chart_title = u"Percentiles of the time of all board cards by list for {0}".format(board_name)
+    chart_specs.append(percentiles_by_list_chart(u"time_percentiles_by_list", chart_title, lists, stats, "time_by_list"))
+
+    # Percentiles of the cycle and lead times
+    chart_title = u"Percentiles of the cycle and lead times for {0}".format(board_name)
+    chart_specs.append(percentiles_chart(
+        u"cycle_lead_time_percentiles", chart_title,
+        [(u"Cycle", stats["cycle_time"]["percentiles"]), (u"Lead", stats["lead_time"]["percentiles"])]
+    ))
 
+    # Cumulative flow diagram
+    chart_title = u"Cumulative flow of the active cards by list for {0}".format(board_name)
+    chart_specs.append(cumulative_flow_chart(u"cumulative_flow", chart_title, stats["cumulative_flow"]))
+
+    # Throughput by week
+    chart_title = u"Number of cards that reached the done list by week in {0}".format(board_name)
+    chart_specs.append(throughput_chart(u"throughput_by_week", chart_title, stats["throughput"]))
+
+    # Forecast of the done cards in the next weeks
+    if stats["delivery_forecast"] is not None:
+        chart_title = u"Forecast of the number of cards done in the next weeks in {0}".format(board_name)
+        chart_specs.append(delivery_forecast_chart(u"delivery_forecast", chart_title, stats["delivery_forecast"]))
 
     # Forward by list
     chart_title = u"Number of times a list is the source of a card forward movement in {0}".format(board_name)
-    forward_by_list_chart_ = number_by_list_chart(chart_title, lists, stats, "forward_movements_by_list")
-    forward_file_path = _get_chart_path(u"forward_movements_by_list", configuration)
-    forward_by_list_chart_.render_to_png(forward_file_path)
+    chart_specs.append(number_by_list_chart(u"forward_movements_by_list", chart_title, lists, stats, "forward_movements_by_list"))
 
     # Backwards by list
     chart_title = u"Number of times a list is the source of a card movement to backwards in {0}".format(board_name)
-    backward_by_list_chart_ = number_by_list_chart(chart_title, lists, stats, "backward_movements_by_list")
-    backward_file_path = _get_chart_path(u"backward_movements_by_list", configuration)
-    backward_by_list_chart_.render_to_png(backward_file_path)
+    chart_specs.append(number_by_list_chart(u"backward_movements_by_list", chart_title, lists, stats, "backward_movements_by_list"))
 
     # Forwards - Backwards per user
     chart_title = u"Forwarded - Pushed back tasks per user {0}".format(board_name)
-    mov_difference_by_user_file_path = _get_chart_path(u"diff_movements_by_user", configuration)
-    mov_difference_by_user_chart = member_chart(chart_title, stat_extractor, mov_difference_by_user_file_path, stats["movements_by_user"], stat_extractor.members, key="difference")
+    chart_specs.append(member_chart(u"diff_movements_by_user", chart_title, stat_extractor, stats["movements_by_user"], stat_extractor.members, key="difference"))
 
     # Forwards per user
     chart_title = u"Forward movement on tasks per user {0}".format(board_name)
-    forwarded_by_user_file_path = _get_chart_path(u"forward_movements_by_user", configuration)
-    forwarded_by_user_chart = member_chart(chart_title, stat_extractor, forwarded_by_user_file_path, stats["movements_by_user"], stat_extractor.members,
-                 key="forward")
+    chart_specs.append(member_chart(u"forward_movements_by_user", chart_title, stat_extractor, stats["movements_by_user"], stat_extractor.members, key="forward"))
 
     # Backwards per user
     chart_title = u"Backward movements on tasks per user {0}".format(board_name)
-    backwarded_by_user_file_path = _get_chart_path(u"backward_movements_by_user", configuration)
-    backwarded_by_user_file_chart = member_chart(chart_title, stat_extractor, backwarded_by_user_file_path, stats["movements_by_user"], stat_extractor.members,
-                 key="backward")
+    chart_specs.append(member_chart(u"backward_movements_by_user", chart_title, stat_extractor, stats["movements_by_user"], stat_extractor.members, key="backward"))
 
     # Spent/Estimated time per user per month
     monthly_chart_title = u"Spent time per month per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(monthly_chart_title, stat_extractor, file_path=_get_chart_path("monthly_spent_times_by_user", configuration), period="month", measure="spent")
+    chart_specs.append(spent_estimated_time_chart_by_user(u"monthly_spent_times_by_user", monthly_chart_title, stat_extractor, period="month", measure="spent"))
     monthly_chart_title = u"Estimated time per month per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(monthly_chart_title, stat_extractor,
-                                       file_path=_get_chart_path("monthly_estimated_times_by_user",
-                                                                 configuration), period="month", measure="estimated")
+    chart_specs.append(spent_estimated_time_chart_by_user(u"monthly_estimated_times_by_user", monthly_chart_title, stat_extractor, period="month", measure="estimated"))
     monthly_chart_title = u"Estimated - Spent time per month per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(monthly_chart_title, stat_extractor,
-                                       file_path=_get_chart_path("monthly_diff_times_by_user",
-                                                                 configuration), period="month", measure="diff")
+    chart_specs.append(spent_estimated_time_chart_by_user(u"monthly_diff_times_by_user", monthly_chart_title, stat_extractor, period="month", measure="diff"))
 
     # Spent/Estimated time per user per week
     weekly_chart_title = u"Spent time per week per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(weekly_chart_title, stat_extractor, file_path=_get_chart_path("weekly_spent_times_by_user", configuration), period="week", measure="spent")
+    chart_specs.append(spent_estimated_time_chart_by_user(u"weekly_spent_times_by_user", weekly_chart_title, stat_extractor, period="week", measure="spent"))
     weekly_chart_title = u"Estimated time per week per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(weekly_chart_title, stat_extractor, file_path=_get_chart_path("weekly_estimated_times_by_user", configuration), period="week", measure="estimated")
+    chart_specs.append(spent_estimated_time_chart_by_user(u"weekly_estimated_times_by_user", weekly_chart_title, stat_extractor, period="week", measure="estimated"))
     weekly_chart_title = u"Estimated - Spent time per week per user {0}".format(board_name)
-    spent_estimated_time_chart_by_user(weekly_chart_title, stat_extractor,
-                                       file_path=_get_chart_path("weekly_diff_times_by_user", configuration),
-                                       period="week", measure="diff")
-
-    return {
-        "time": {"object":time_by_list_chart_,"path": time_chart_file_path},
-        "forward": {"object": forward_by_list_chart_, "path": forward_file_path},
-        "backward": {"object": backward_by_list_chart_, "path": backward_file_path},
-        "forward_movements_by_user": {"object": forwarded_by_user_chart, "path": forwarded_by_user_file_path},
-        "backward_movements_by_user": {"object": backwarded_by_user_file_chart, "path": backwarded_by_user_file_path},
-        "difference_movements_by_user": {"object": mov_difference_by_user_chart, "path": mov_difference_by_user_file_path}
-    }
+    chart_specs.append(spent_estimated_time_chart_by_user(u"weekly_diff_times_by_user", weekly_chart_title, stat_extractor, period="week", measure="diff"))
+
+    for chart_spec in chart_specs:
+        chart_spec["file_path"] = _get_chart_path(chart_spec["name"], configuration, extension)
+
+    return chart_specs
+
+
+def render_charts(chart_specs, jobs=1, svg_only=False, chart_cache=None):
+    """
+    Renders charts in their files.
+    :param chart_specs: list of chart specs.
+    :param jobs: number of processes that render the charts. Processes that are already workers of a pool
+    (e.g. when several boards are processed concurrently) render them sequentially.
+    :param svg_only: if True, charts are rendered as SVG, without the PNG rasterization.
+    :param chart_cache: optional TrelloChartCache. Charts that are in it are not rendered again.
+    :return: dict indexed by chart name with the rendering time in seconds ("time") of each chart and
+    if it was taken from the cache ("cached").
+    """
+    rendering_jobs = [(chart_spec, svg_only, chart_cache) for chart_spec in chart_specs]
+
+    # Daemonic processes (workers of multiprocessing pools) are not allowed to have children
+    if jobs <= 1 or len(chart_specs) <= 1 or multiprocessing.current_process().daemon:
+        return dict(_render_chart_job(rendering_job) for rendering_job in rendering_jobs)
+
+    pool = multiprocessing.Pool(processes=min(jobs, len(chart_specs)))
+    try:
+        return dict(pool.map(_render_chart_job, rendering_jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _render_chart_job(rendering_job):
+    chart_spec, svg_only, chart_cache = rendering_job
+    if chart_cache is None:
+        return chart_spec["name"], {"time": render_chart(chart_spec, svg_only), "cached": False}
 
+    start_time = time.time()
+    extension = u"svg" if svg_only else u"png"
+    chart_key = chart_cache.get_key(chart_spec, extension)
+    if chart_cache.get(chart_key, extension, chart_spec["file_path"]):
+        return chart_spec["name"], {"time": time.time() - start_time, "cached": True}
+    render_chart(chart_spec, svg_only)
+    chart_cache.put(chart_key, extension, chart_spec["file_path"])
+    return chart_spec["name"], {"time": time.time() - start_time, "cached": False}
 
-def avg_by_list_chart(chart_title, lists, stats, measurement):
-    line_chart = pygal.HorizontalBar(title=chart_title, legend_at_bottom=True)
+
+def render_chart(chart_spec, svg_only=False):
+    """
+    Renders a chart spec in its file.
+    :param chart_spec: chart spec.
+    :param svg_only: if True, the chart is rendered as SVG, without the PNG rasterization.
+    :return: rendering time in seconds.
+    """
+    start_time = time.time()
+    chart_class = {
+        "HorizontalBar": pygal.HorizontalBar, "Line": pygal.Line, "StackedLine": pygal.StackedLine
+    }[chart_spec["type"]]
+    chart_ = chart_class(title=chart_spec["title"], **chart_spec["options"])
+    for serie_name, serie_values in chart_spec["series"]:
+        chart_.add(serie_name, serie_values)
+    if chart_spec.get("x_labels") is not None:
+        chart_.x_labels = chart_spec["x_labels"]
+        chart_.show_x_labels = True
+    if svg_only:
+        chart_.render_to_file(chart_spec["file_path"])
+    else:
+        chart_.render_to_png(chart_spec["file_path"])
+    return time.time() - start_time
+
+
+def avg_by_list_chart(chart_name, chart_title, lists, stats, measurement):
+    line_chart = _chart_spec(chart_name, "HorizontalBar", chart_title, legend_at_bottom=True)
 
     i = 1
     for list_ in lists:
         list_name = list_.name.decode("utf-8")
-        line_chart.add(list_name, stats[measurement][list_.id]["avg"])
+        line_chart["series"].append((list_name, stats[measurement][list_.id]["avg"]))
         i += 1
     return line_chart
 
 
-def number_by_list_chart(chart_title, lists, stats, measurement):
-    line_chart = pygal.HorizontalBar(title=chart_title, legend_at_bottom=True)
+def percentiles_by_list_chart(chart_name, chart_title, lists, stats, measurement):
+    return percentiles_chart(
+        chart_name, chart_title,
+        [(list_.name.decode("utf-8"), stats[measurement][list_.id]["percentiles"]) for list_ in lists]
+    )
+
+
+def percentiles_chart(chart_name, chart_title, percentiles_by_label):
+    """
+    Creates a chart spec with a serie for each percentile.
+    :param chart_name:
+    :param chart_title:
+    :param percentiles_by_label: list of tuples (label, dict with the value of each percentile).
+    :return: chart spec
+    """
+    percentiles_chart_ = _chart_spec(chart_name, "HorizontalBar", chart_title, legend_at_bottom=True)
+    percentiles = sorted(percentiles_by_label[0][1].keys()) if percentiles_by_label else []
+    for percentile in percentiles:
+        # NaN percentiles (no values) are not drawn
+        values = [label_percentiles[percentile] for _label, label_percentiles in percentiles_by_label]
+        percentiles_chart_["series"].append((u"p{0}".format(percentile), [value if value == value else None for value in values]))
+    percentiles_chart_["x_labels"] = [label for label, _label_percentiles in percentiles_by_label]
+    return percentiles_chart_
+
+
+def cumulative_flow_chart(chart_name, chart_title, cumulative_flow, max_days=180):
+    """
+    Creates a chart spec with the number of cards in each list at the end of each day, stacked.
+    Lists are stacked in reverse order, so the done list is at the bottom.
+    :param chart_name:
+    :param chart_title:
+    :param cumulative_flow: CumulativeFlow of the board.
+    :param max_days: max number of days shown. Days of older boards are sampled.
+    :return: chart spec
+    """
+    cumulative_flow_chart_ = _chart_spec(
+        chart_name, "StackedLine", chart_title, legend_at_bottom=True, fill=True, show_dots=False, x_label_rotation=45,
+        show_minor_x_labels=False, x_labels_major_count=12
+    )
+    days, wip = cumulative_flow.get_sampled_days(max_days)
+    for list_index in reversed(range(len(cumulative_flow.lists))):
+        list_name = cumulative_flow.lists[list_index].name.decode("utf-8")
+        cumulative_flow_chart_["series"].append((list_name, [int(value) for value in wip[:, list_index]]))
+    cumulative_flow_chart_["x_labels"] = days
+    return cumulative_flow_chart_
+
+
+def throughput_chart(chart_name, chart_title, throughput, max_weeks=104):
+    """
+    Creates a chart spec with the number of done cards of each one of the last weeks.
+    :param chart_name:
+    :param chart_title:
+    :param throughput: Throughput of the board.
+    :param max_weeks: max number of weeks shown.
+    :return: chart spec
+    """
+    throughput_chart_ = _chart_spec(
+        chart_name, "Line", chart_title, legend_at_bottom=True, x_label_rotation=45, show_minor_x_labels=False,
+        x_labels_major_count=12
+    )
+    week_indices = range(max(0, throughput.num_weeks - max_weeks), throughput.num_weeks)
+    throughput_chart_["series"].append((u"Done cards", [int(throughput.done_by_week[week_index]) for week_index in week_indices]))
+    throughput_chart_["x_labels"] = [throughput.get_week(week_index) for week_index in week_indices]
+    return throughput_chart_
+
+
+def delivery_forecast_chart(chart_name, chart_title, delivery_forecast):
+    """
+    Creates a chart spec with a serie for each likelihood of the number of cards done in the next weeks.
+    :param chart_name:
+    :param chart_title:
+    :param delivery_forecast: summary of the DeliveryForecast of the board.
+    :return: chart spec
+    """
+    delivery_forecast_chart_ = _chart_spec(chart_name, "HorizontalBar", chart_title, legend_at_bottom=True)
+    cards_by_weeks = delivery_forecast["cards_by_weeks"]
+    weeks = sorted(cards_by_weeks.keys())
+    likelihoods = sorted(cards_by_weeks[weeks[0]].keys()) if weeks else []
+    for likelihood in likelihoods:
+        delivery_forecast_chart_["series"].append((u"{0}%".format(likelihood), [cards_by_weeks[num_weeks][likelihood] for num_weeks in weeks]))
+    delivery_forecast_chart_["x_labels"] = [u"{0} weeks".format(num_weeks) for num_weeks in weeks]
+    return delivery_forecast_chart_
+
+
+def number_by_list_chart(chart_name, chart_title, lists, stats, measurement):
+    line_chart = _chart_spec(chart_name, "HorizontalBar", chart_title, legend_at_bottom=True)
 
     i = 1
     for list_ in lists:
         list_name = list_.name.decode("utf-8")
-        line_chart.add(list_name, stats[measurement][list_.id])
+        line_chart["series"].append((list_name, stats[measurement][list_.id]))
         i += 1
     return line_chart
 
 
-def member_chart(chart_title, stat_extractor, file_path, stats_by_member, members, key="forward"):
-    by_user_chart_ = pygal.HorizontalBar(title=chart_title, legend_at_bottom=True)
+def member_chart(chart_name, chart_title, stat_extractor, stats_by_member, members, key="forward"):
+    by_user_chart_ = _chart_spec(chart_name, "HorizontalBar", chart_title, legend_at_bottom=True)
     for member in members:
         member_name = member.username.decode("utf-8")
         if not member.id in stats_by_member:
@@ -137,21 +338,20 @@ def member_chart(chart_title, stat_extractor, file_path, stats_by_member, member
         if stat_extractor.configuration.censored:
             member_chart_name = member.id
 
-        by_user_chart_.add(u"{0}".format(member_chart_name), value)
+        by_user_chart_["series"].append((u"{0}".format(member_chart_name), value))
 
-    by_user_chart_.render_to_png(file_path)
     return by_user_chart_
 
 
-def spent_estimated_time_chart_by_user(chart_title, stat_extractor, file_path, period="month", measure="spent"):
+def spent_estimated_time_chart_by_user(chart_name, chart_title, stat_extractor, period="month", measure="spent"):
     """
-    Creates a chart that shows spent and estimated (in that order) times by user.
+    Creates a chart spec that shows spent and estimated (in that order) times by user.
+    :param chart_name:
     :param chart_title:
     :param stat_extractor:
-    :param file_path:
     :param period:
     :param measure:
-    :return:
+    :return: chart spec
     """
     spent_time_by_user = None
     estimated_time_by_user = None
@@ -170,16 +370,16 @@ def spent_estimated_time_chart_by_user(chart_title, stat_extractor, file_path, p
     periods = periods.keys()
     periods.sort()
 
-    s_e_by_user_chart_ = pygal.Line(title=chart_title, legend_at_bottom=False)
+    s_e_by_user_chart_ = _chart_spec(chart_name, "Line", chart_title, legend_at_bottom=False)
     for member in stat_extractor.members:
         member_name = member.username.decode("utf-8")
         if stat_extractor.configuration.censored:
             member_name = member.id
         if periods:
             if measure == "spent":
-                s_e_by_user_chart_.add(u"{0}".format(member_name), [spent_time_by_user[member.id].get(time) for time in periods])
+                s_e_by_user_chart_["series"].append((u"{0}".format(member_name), [spent_time_by_user[member.id].get(time) for time in periods]))
             elif measure == "estimated":
-                s_e_by_user_chart_.add(u"{0}".format(member_name),[estimated_time_by_user[member.id].get(time) for time in periods])
+                s_e_by_user_chart_["series"].append((u"{0}".format(member_name), [estimated_time_by_user[member.id].get(time) for time in periods]))
             elif measure == "diff":
                 diff_values = []
                 for time in periods:
@@ -189,15 +389,19 @@ def spent_estimated_time_chart_by_user(chart_title, stat_extractor, file_path, p
                         diff_values.append(estimated_time - spent_time)
                     else:
                         diff_values.append(None)
-                s_e_by_user_chart_.add(u"{0}".format(member_name), diff_values)
+                s_e_by_user_chart_["series"].append((u"{0}".format(member_name), diff_values))
+
+    s_e_by_user_chart_["x_labels"] = periods
+    return s_e_by_user_chart_
+
 
-    s_e_by_user_chart_.x_labels = periods
-    s_e_by_user_chart_.show_x_labels = True
-    s_e_by_user_chart_.render_to_png(file_path)
+# Chart spec: all that is needed to render a chart in other process
+def _chart_spec(chart_name, chart_type, chart_title, **options):
+    return {"name": chart_name, "type": chart_type, "title": chart_title, "options": options, "series": [], "x_labels": None}
 
 
-def _get_chart_path(chart_type, configuration):
+def _get_chart_path(chart_type, configuration, extension=u"png"):
     board_name = configuration.board_name
     now_str = datetime.datetime.now(settings.TIMEZONE).strftime("%Y_%m_%d_%H_%M_%S")
-    file_path = u"{0}/{1}-{2}-{3}.png".format(configuration.output_dir, slugify(board_name), slugify(chart_type), slugify(now_str))
+    file_path = u"{0}/{1}-{2}-{3}.{4}".format(configuration.output_dir, slugify(board_name), slugify(chart_type), slugify(now_str), extension)
     return file_path
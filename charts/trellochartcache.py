@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import shutil
+
+import pygal
+
+
+# Local cache of rendered charts.
+# Each chart is stored with the hash of its content (type, title, style options, series and x labels) as name, so
+# charts whose data have not changed since a previous run are not rendered again: the cached image is linked to
+# the new output file path.
+class TrelloChartCache(object):
+
+    def __init__(self, cache_dir):
+        self.charts_cache_dir = os.path.join(cache_dir, u"charts")
+
+    # Key of a chart: hash of all that changes its image
+    @staticmethod
+    def get_key(chart_spec, extension):
+        """
+        Computes the key of a chart.
+        :param chart_spec: chart spec. Its name and its file path are not part of the key.
+        :param extension: format of the image (svg or png).
+        :return: hexadecimal SHA-1 digest.
+        """
+        chart_content = {
+            "type": chart_spec["type"],
+            "title": chart_spec["title"],
+            "options": chart_spec["options"],
+            "series": chart_spec["series"],
+            "x_labels": chart_spec["x_labels"],
+            "extension": extension,
+            "pygal_version": pygal.__version__
+        }
+        # NumPy numbers are converted to their string representation
+        serialized_chart_content = json.dumps(chart_content, sort_keys=True, default=repr)
+        return hashlib.sha1(serialized_chart_content.encode("utf-8")).hexdigest()
+
+    # Links the cached chart to a file path
+    def get(self, key, extension, file_path):
+        """
+        Writes a cached chart in a file path.
+        :return: True if the chart was in the cache, False otherwise.
+        """
+        cached_file_path = self._get_cached_file_path(key, extension)
+        if not os.path.exists(cached_file_path):
+            return False
+        _link(cached_file_path, file_path)
+        return True
+
+    # Stores a rendered chart in the cache
+    def put(self, key, extension, file_path):
+        if not os.path.exists(self.charts_cache_dir):
+            try:
+                os.makedirs(self.charts_cache_dir)
+            except OSError:
+                # Other process could have created it
+                if not os.path.isdir(self.charts_cache_dir):
+                    raise
+        cached_file_path = self._get_cached_file_path(key, extension)
+        # The chart is linked with a temporary name and then renamed, so other processes never see a partial file
+        temporary_file_path = u"{0}.{1}.tmp".format(cached_file_path, os.getpid())
+        _link(file_path, temporary_file_path)
+        os.rename(temporary_file_path, cached_file_path)
+
+    def _get_cached_file_path(self, key, extension):
+        return os.path.join(self.charts_cache_dir, u"{0}.{1}".format(key, extension))
+
+
+# Links a file in other path: with a hard link if it is possible, with a symbolic link or a copy otherwise
+def _link(source_file_path, destination_file_path):
+    if os.path.lexists(destination_file_path):
+        os.remove(destination_file_path)
+    try:
+        os.link(source_file_path, destination_file_path)
+    except (OSError, AttributeError):
+        try:
+            os.symlink(os.path.abspath(source_file_path), destination_file_path)
+        except (OSError, AttributeError):
+            shutil.copyfile(source_file_path, destination_file_path)
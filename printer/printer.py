@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import gzip
+import io
 import os
 
 from slugify import slugify
@@ -6,28 +8,83 @@ import datetime
 import settings
 
 
-# Small utility class that prints in stdio and
+# Small utility class that prints in stdio and writes each line in the output file as soon as it is printed.
+# Lines are written in a temporary file that only gets the name of the report when it is flushed, so a report that
+# failed is never taken for a complete one. Used as a context manager, it is flushed if the report was complete and
+# discarded otherwise.
 class Printer(object):
 
-    def __init__(self, filename, configuration, print_in_stdio=True):
+    # Size in bytes of the buffer of the output file
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, filename, configuration, print_in_stdio=True, gzip_output=False):
+        """
+        Opens the temporary output file. Lines are streamed to it, so the report is never kept in memory.
+        :param filename: name of the report. It is slugified and suffixed with the current datetime.
+        :param configuration: TrelloBoardConfiguration. The report is written in its output directory.
+        :param print_in_stdio: if True, each line is printed in stdout too.
+        :param gzip_output: if True, the output file is compressed with gzip (.txt.gz).
+        """
         self.filename = filename
         self.configuration = configuration
-        self.string = u""
         self.print_in_stdio = print_in_stdio
+        self.gzip_output = gzip_output
+        self.output_filename = self._get_output_filename()
+        self.temporary_output_filename = self.output_filename + u".tmp"
+        self.raw_output_file = None
+        self.output_file = self._open_output_file()
+
+    def _get_output_filename(self):
+        now_str = datetime.datetime.now(settings.TIMEZONE).strftime("%Y_%m_%d_%H_%M_%S")
+        extension = u"txt.gz" if self.gzip_output else u"txt"
+        return u"{0}/{1}-{2}.{3}".format(self.configuration.output_dir, slugify(self.filename), now_str, extension)
+
+    def _open_output_file(self):
+        output_directory = self.configuration.output_dir
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        self.raw_output_file = io.open(self.temporary_output_filename, "wb", buffering=Printer.BUFFER_SIZE)
+        if self.gzip_output:
+            return gzip.GzipFile(fileobj=self.raw_output_file, mode="wb")
+        return self.raw_output_file
 
     def p(self, text):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
         if self.print_in_stdio:
             print(text)
-        self.string += text + u"\n"
+        self.output_file.write((text + u"\n").encode("utf-8"))
 
     def newline(self):
         self.p(u"\n")
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+        return False
+
+    # Writes the pending lines, closes the output file and gives it the name of the report
     def flush(self):
-        now_str = datetime.datetime.now(settings.TIMEZONE).strftime("%Y_%m_%d_%H_%M_%S")
-        output_directory = self.configuration.output_dir
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-        output_filename = u"{0}/{1}-{2}.txt".format(output_directory, slugify(self.filename), now_str)
-        with open(output_filename, "w") as output_file:
-            output_file.write(self.string.encode('utf8'))
\ No newline at end of file
+        if self.output_file.closed:
+            return
+        self._close()
+        os.rename(self.temporary_output_filename, self.output_filename)
+
+    # Closes and removes the output file of a report that could not be completed
+    def discard(self):
+        if self.output_file.closed:
+            return
+        self._close()
+        os.remove(self.temporary_output_filename)
+
+    def _close(self):
+        try:
+            self.output_file.close()
+        finally:
+            # GzipFile does not close the file object it wraps
+            self.raw_output_file.close()
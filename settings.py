@@ -1,21 +1,34 @@
 # -*- coding: utf-8 -*-
 
 import importlib
+import os
 import pytz
-from trello.configuration import Configuration
 
-TIMEZONE = pytz.timezone('Europe/Madrid')
-Configuration.TIMEZONE = 'Europe/Madrid'
+TIMEZONE_NAME = 'Europe/Madrid'
+TIMEZONE = pytz.timezone(TIMEZONE_NAME)
 
+# Credentials are not required when the stats are computed from a board dump,
+# so a missing settings_local is only an error when Trello API is used (see assert_credentials)
 try:
     settings_local = importlib.import_module('settings_local')
 except ImportError:
-    print("Please, create a local_settings.py with authentication data and other preferences")
-    exit(-1)
+    settings_local = None
 
-TRELLO_API_KEY = settings_local.TRELLO_API_KEY
-TRELLO_API_SECRET = settings_local.TRELLO_API_SECRET
+TRELLO_API_KEY = getattr(settings_local, "TRELLO_API_KEY", None)
+TRELLO_API_SECRET = getattr(settings_local, "TRELLO_API_SECRET", None)
 
-TRELLO_TOKEN = settings_local.TRELLO_TOKEN
-TRELLO_TOKEN_SECRET = settings_local.TRELLO_TOKEN_SECRET
+TRELLO_TOKEN = getattr(settings_local, "TRELLO_TOKEN", None)
+TRELLO_TOKEN_SECRET = getattr(settings_local, "TRELLO_TOKEN_SECRET", None)
+
+# Directory where the index of the boards of each user (board name -> board id) is stored between runs
+BOARD_INDEX_DIR = getattr(
+    settings_local, "BOARD_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".pystats-trello")
+)
+
+
+# Exits if there are no credentials to connect to Trello API
+def assert_credentials():
+    if settings_local is None:
+        print("Please, create a local_settings.py with authentication data and other preferences")
+        exit(-1)
 
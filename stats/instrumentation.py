@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import bisect
+import io
+import json
+import os
+import threading
+import time
+
+
+# Instrumentation of a stats run: timers of each phase, counters and HTTP request stats.
+# It is disabled by default. While it is disabled, timer() returns a shared object that does nothing and the rest of
+# functions return at once, so instrumented code has almost no overhead.
+
+# Upper bounds (in seconds) of the buckets of the HTTP latency histogram. The last bucket has no upper bound.
+HTTP_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Current recorder. None if instrumentation is disabled.
+_recorder = None
+
+
+# Records timers, counters and HTTP requests
+class Recorder(object):
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.events = []
+        self.counters = {}
+        self.http = {
+            "requests": 0,
+            "bytes": 0,
+            "time": 0.0,
+            "by_status": {},
+            "latency_histogram": [0] * (len(HTTP_LATENCY_BUCKETS) + 1)
+        }
+
+    def add_event(self, name, start_time, duration, args):
+        event = {
+            "name": name,
+            "start": start_time - self.start_time,
+            "duration": duration,
+            "thread": threading.current_thread().name
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_http_request(self, status_code, num_bytes, latency):
+        with self.lock:
+            self.http["requests"] += 1
+            self.http["bytes"] += num_bytes
+            self.http["time"] += latency
+            status_code_key = str(status_code)
+            self.http["by_status"][status_code_key] = self.http["by_status"].get(status_code_key, 0) + 1
+            self.http["latency_histogram"][bisect.bisect_left(HTTP_LATENCY_BUCKETS, latency)] += 1
+
+    # Total time, number of calls, min and max time of each timer
+    def get_phases(self):
+        phases = {}
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            if event["name"] not in phases:
+                phases[event["name"]] = {"calls": 0, "time": 0.0, "min": event["duration"], "max": event["duration"]}
+            phase = phases[event["name"]]
+            phase["calls"] += 1
+            phase["time"] += event["duration"]
+            phase["min"] = min(phase["min"], event["duration"])
+            phase["max"] = max(phase["max"], event["duration"])
+        return phases
+
+    def get_trace(self):
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+            http = json.loads(json.dumps(self.http))
+        latency_bucket_names = [u"<={0}".format(bucket) for bucket in HTTP_LATENCY_BUCKETS] + \
+            [u">{0}".format(HTTP_LATENCY_BUCKETS[-1])]
+        http["latency_histogram"] = dict(zip(latency_bucket_names, http["latency_histogram"]))
+        return {
+            "total_time": time.time() - self.start_time,
+            "phases": self.get_phases(),
+            "counters": counters,
+            "http": http,
+            "events": events
+        }
+
+
+# Context manager that measures the time of a block of code
+class _Timer(object):
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.recorder.add_event(self.name, self.start_time, time.time() - self.start_time, self.args)
+        return False
+
+
+# Timer used when instrumentation is disabled
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable():
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+# Measures the time of a block of code (with instrumentation.timer("phase"): ...)
+def timer(name, **args):
+    if _recorder is None:
+        return _NULL_TIMER
+    return _Timer(_recorder, name, args)
+
+
+# Adds a value to a counter
+def count(name, value=1):
+    if _recorder is None:
+        return
+    _recorder.count(name, value)
+
+
+# Records an HTTP request
+def record_http_request(status_code, num_bytes, latency):
+    """
+    :param status_code: HTTP status code of the response.
+    :param num_bytes: size of the body of the response.
+    :param latency: time in seconds since the request was sent until its response was read.
+    """
+    if _recorder is None:
+        return
+    _recorder.add_http_request(status_code, num_bytes, latency)
+
+
+# Current trace: phases, counters, HTTP stats and timer events. None if instrumentation is disabled.
+def get_trace():
+    if _recorder is None:
+        return None
+    return _recorder.get_trace()
+
+
+# Writes the current trace as JSON
+def write_trace(file_path):
+    _write_json(file_path, get_trace())
+
+
+# Writes the timer events in Chrome trace event format (it can be opened in chrome://tracing or Perfetto)
+def write_chrome_trace(file_path):
+    trace = get_trace()
+    thread_ids = {}
+    trace_events = []
+    for event in trace["events"]:
+        thread_id = thread_ids.setdefault(event["thread"], len(thread_ids) + 1)
+        trace_events.append({
+            "name": event["name"],
+            "ph": "X",
+            "ts": int(event["start"] * 1000000),
+            "dur": int(event["duration"] * 1000000),
+            "pid": os.getpid(),
+            "tid": thread_id,
+            "args": event.get("args", {})
+        })
+    for thread_name, thread_id in thread_ids.items():
+        trace_events.append({
+            "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}
+        })
+    for counter_name, counter_value in trace["counters"].items():
+        trace_events.append({
+            "name": counter_name, "ph": "C", "ts": int(trace["total_time"] * 1000000), "pid": os.getpid(),
+            "args": {"value": counter_value}
+        })
+    _write_json(file_path, {"traceEvents": trace_events, "displayTimeUnit": "ms"})
+
+
+# Prints the time of each phase, the counters and the HTTP stats
+def print_report():
+    trace = get_trace()
+    if trace is None:
+        return
+    print(u"Total time: {0:.3f} s".format(trace["total_time"]))
+    for phase_name in sorted(trace["phases"].keys()):
+        phase = trace["phases"][phase_name]
+        print(u"- {0}: {1:.3f} s ({2} calls)".format(phase_name, phase["time"], phase["calls"]))
+    for counter_name in sorted(trace["counters"].keys()):
+        print(u"- {0}: {1}".format(counter_name, trace["counters"][counter_name]))
+    http = trace["http"]
+    print(u"- HTTP: {0} requests, {1} bytes, {2:.3f} s".format(http["requests"], http["bytes"], http["time"]))
+
+
+def _write_json(file_path, data):
+    with io.open(file_path, "wb") as json_file:
+        json_file.write(json.dumps(data, indent=2, sort_keys=True).encode("utf-8"))
@@ -1,28 +1,35 @@
 # -*- coding: utf-8 -*-
+import datetime
 import numpy
 import os
 
-from charts import trellochart
+from slugify import slugify
+
 from printer.printer import Printer
+from stats import instrumentation
 from stats import trellostatsextractor
 import settings
 import inspect
 
 
 # Utility function for keeping compatibility
-def make(trello_connector, configuration):
-    summary_creator = SummaryCreator(trello_connector, configuration)
-    summary_creator.make()
+def make(trello_connector, configuration, snapshot=None):
+    summary_creator = SummaryCreator(trello_connector, configuration, snapshot)
+    with instrumentation.timer("summary.make"):
+        summary_creator.make()
+    return summary_creator
 
 
 # Class that embed output data generation
 class SummaryCreator(object):
 
-    def __init__(self, trello_connector, configuration):
+    def __init__(self, trello_connector, configuration, snapshot=None):
         self.trello_connector = trello_connector
         self.configuration = configuration
+        self.snapshot = snapshot
         self.board_name = configuration.board_name
         self.stat_extractor = None
+        self.stats = None
 
     def make(self):
         """
@@ -35,7 +42,8 @@ class SummaryCreator(object):
         # First thing, create output directory if it is needed
         self._create_output_directory_if_needed()
 
-        self.stat_extractor = trellostatsextractor.TrelloStatsExtractor(trello_connector=self.trello_connector, configuration=self.configuration)
+        with instrumentation.timer("summary.init_board"):
+            self.stat_extractor = trellostatsextractor.TrelloStatsExtractor(trello_connector=self.trello_connector, configuration=self.configuration, snapshot=self.snapshot)
         done_list = self.stat_extractor.done_list
 
         # Setting the function that tests if a card is active
@@ -54,10 +62,23 @@ class SummaryCreator(object):
             elif card_action_filter[1]:
                 in_date_interval_text = u" before {0}".format(card_action_filter[1])
 
-        stats = self.stat_extractor.get_stats()
+        with instrumentation.timer("summary.get_stats"):
+            stats = self.stat_extractor.get_stats()
+        self.stats = stats
+
+        if self.configuration.export_stats:
+            with instrumentation.timer("summary.export_stats"):
+                self._export_stats(stats)
 
-        printer = Printer(u"results_for_{0}_board".format(self._get_board_name()), self.configuration)
+        # The report file is removed if the report can not be completed
+        with Printer(
+            u"results_for_{0}_board".format(self._get_board_name()), self.configuration,
+            print_in_stdio=not self.configuration.report_quiet, gzip_output=self.configuration.report_gzip
+        ) as printer:
+            self._print_report(printer, stats, done_list, in_date_interval_text)
 
+    # Writes the report of the stats of the board
+    def _print_report(self, printer, stats, done_list, in_date_interval_text):
         printer.newline()
 
         printer.p(u"# Measurements for {0}".format(self._get_board_name()))
@@ -84,7 +105,9 @@ class SummaryCreator(object):
             list_name = list_.name.decode("utf-8")
             avg_list_time = stats["time_by_list"][list_id]["avg"]
             std_dev_list_time = stats["time_by_list"][list_id]["std_dev"]
-            printer.p(u"- {0}: {1:.2f} h (std. dev. {2:.2f})".format(list_name, avg_list_time, std_dev_list_time))
+            printer.p(u"- {0}: {1:.2f} h (std. dev. {2:.2f}, {3})".format(
+                list_name, avg_list_time, std_dev_list_time, self._percentiles_text(stats["time_by_list"][list_id]["percentiles"])
+            ))
 
         printer.newline()
 
@@ -101,6 +124,20 @@ class SummaryCreator(object):
 
         printer.newline()
 
+        # Number of cards in each column by day
+        cumulative_flow = stats["cumulative_flow"]
+        printer.p(u"## Work in progress by column for all the board cards{0}".format(in_date_interval_text))
+        printer.p(u"Number of cards in each column at the end of each day from {0} to {1}".format(
+            cumulative_flow.get_day(0), cumulative_flow.get_day(cumulative_flow.num_days - 1)
+        ))
+        for list_ in stats["lists"]:
+            list_wip = stats["wip_by_list"][list_.id]
+            printer.p(u"- {0}: {1} now (avg. {2:.2f}, max. {3} on {4})".format(
+                list_.name.decode("utf-8"), list_wip["current"], list_wip["avg"], list_wip["max"], list_wip["max_day"]
+            ))
+
+        printer.newline()
+
         # Backward and Forward movements of tasks assigned to a user
         printer.p(u"## Forward/backward movements movements by username in this board{0}".format(in_date_interval_text))
         for member_id, member in self.stat_extractor.members_dict.items():
@@ -117,6 +154,7 @@ class SummaryCreator(object):
         for card in stats["done_cards"]:
             printer.p(u"- {0} {1}: {2:.2f}".format(card.id, self._short_card_name(card), stats["cycle_time"]["values"][card.id]))
         printer.p(u"- avg: {0:.2f} h, std_dev: {1:.2f}".format(stats["cycle_time"]["avg"], stats["cycle_time"]["std_dev"]))
+        printer.p(u"- {0}".format(self._percentiles_text(stats["cycle_time"]["percentiles"])))
 
         printer.newline()
 
@@ -126,9 +164,18 @@ class SummaryCreator(object):
         for card in stats["done_cards"]:
             printer.p(u"- {0} {1}: {2:.2f}".format(card.id, self._short_card_name(card), stats["lead_time"]["values"][card.id]))
         printer.p(u"- avg: {0:.2f} h, std_dev: {1:.2f}".format(stats["lead_time"]["avg"], stats["lead_time"]["std_dev"]))
+        printer.p(u"- {0}".format(self._percentiles_text(stats["lead_time"]["percentiles"])))
+
+        printer.newline()
 
-        # Chart with times for all cards in each column
-        file_paths = trellochart.get_graphics(stats, self.stat_extractor)
+        # Throughput and forecast of the next done cards
+        self._show_throughput(stats, printer)
+
+        # Chart with times for all cards in each column.
+        # Chart module (and pygal) is only loaded when the charts are rendered.
+        from charts import trellochart
+        with instrumentation.timer("summary.charts"):
+            file_paths = trellochart.get_graphics(stats, self.stat_extractor)
 
         printer.newline()
 
@@ -137,16 +184,15 @@ class SummaryCreator(object):
             for custom_workflow in self.stat_extractor.get_custom_workflows():
                 custom_workflow_id = custom_workflow.name
                 printer.p(u" ## Custom workflow {0}".format(custom_workflow.name))
-                workflow_times = []
-                for card in stats["cards"]:
-                    if hasattr(card, "custom_workflow_times") and\
-                            custom_workflow_id in card.custom_workflow_times and\
-                            not card.custom_workflow_times[custom_workflow_id] is None:
-                        workflow_times.append(card.custom_workflow_times[custom_workflow_id])
-                        card_line = u"{0:.2f}".format(card.custom_workflow_times[custom_workflow_id])
+                workflow_times = self.stat_extractor.custom_workflow_times[custom_workflow_id]
+                for card in stats["active_cards"]:
+                    if card.id in workflow_times:
+                        card_line = u"{0:.2f}".format(workflow_times[card.id])
                         printer.p(u"- {0} '{1}': {2}".format(card.id, self._short_card_name(card), card_line))
-                if len(workflow_times) > 0:
-                    printer.p(u"- avg: {0:.2f} h, std_dev: {1:.2f}".format(numpy.mean(workflow_times), numpy.std(workflow_times, axis=0)))
+                workflow_sketch = self.stat_extractor.custom_workflow_sketches[custom_workflow_id]
+                if len(workflow_sketch) > 0:
+                    printer.p(u"- avg: {0:.2f} h, std_dev: {1:.2f}".format(workflow_sketch.mean(), workflow_sketch.std()))
+                    printer.p(u"- {0}".format(self._percentiles_text(workflow_sketch.percentiles())))
                 printer.newline()
 
         # Time each card has been in each column
@@ -174,11 +220,57 @@ class SummaryCreator(object):
 
         printer.p(u"Charts done")
 
+        self._show_chart_rendering_times(file_paths["rendering_results"], printer)
+
         printer.newline()
 
         printer.p(u"--- END OF FILE ---")
 
-        printer.flush()
+    # Show the done cards of the last weeks and the forecast of the next ones
+    def _show_throughput(self, stats, printer, num_weeks=8):
+        throughput = stats["throughput"]
+        printer.p(u"## Throughput")
+        printer.p(u"Number of tasks (active, inactive or archived) that reached 'Done' state in each one of the last {0} weeks".format(num_weeks))
+        for week_index in range(max(0, throughput.num_weeks - num_weeks), throughput.num_weeks):
+            printer.p(u"- Week of {0}: {1}{2}".format(
+                throughput.get_week(week_index), throughput.done_by_week[week_index],
+                u" (current week)" if week_index == throughput.num_weeks - 1 else u""
+            ))
+
+        printer.newline()
+
+        forecast = stats["delivery_forecast"]
+        printer.p(u"## Forecast")
+        if forecast is None:
+            printer.p(u"- There are no complete weeks to make a forecast")
+            printer.newline()
+            return
+        printer.p(u"Monte Carlo simulation of {0} trials based on the throughput of the last {1} complete weeks (avg. {2:.2f} tasks per week)".format(
+            forecast["num_trials"], forecast["history_weeks"], forecast["avg_weekly_throughput"]
+        ))
+        for num_weeks_ahead in sorted(forecast["cards_by_weeks"].keys()):
+            cards_by_likelihood = forecast["cards_by_weeks"][num_weeks_ahead]
+            printer.p(u"- Tasks done in the next {0} weeks: {1}".format(num_weeks_ahead, u", ".join([
+                u"{0} or more ({1}%)".format(cards_by_likelihood[likelihood], likelihood)
+                for likelihood in sorted(cards_by_likelihood.keys())
+            ])))
+
+        today = datetime.datetime.now(settings.TIMEZONE).date()
+        weeks_by_likelihood = forecast["weeks_to_finish"]
+        weeks_texts = []
+        for likelihood in sorted(weeks_by_likelihood.keys()):
+            weeks = weeks_by_likelihood[likelihood]
+            if weeks is None:
+                weeks_texts.append(u"never at this pace ({0}%)".format(likelihood))
+            else:
+                weeks_texts.append(u"{0} weeks, by {1} ({2}%)".format(
+                    weeks, (today + datetime.timedelta(weeks=weeks)).isoformat(), likelihood
+                ))
+        printer.p(u"- The {0} active tasks that are not in 'done' will be done in: {1}".format(
+            forecast["remaining_cards"], u", ".join(weeks_texts)
+        ))
+
+        printer.newline()
 
     # Show total spent time and estimated stats
     def _show_total_spent_estimated_information(self, stats, printer):
@@ -292,6 +384,31 @@ class SummaryCreator(object):
 
         printer.newline()
 
+    # Show the time that the rendering of each chart has taken
+    def _show_chart_rendering_times(self, rendering_results, printer):
+        printer.p(u"## Chart rendering times")
+        for chart_name, rendering_result in rendering_results:
+            cached_text = u" (cached)" if rendering_result["cached"] else u""
+            printer.p(u"- {0}: {1:.3f} s{2}".format(chart_name, rendering_result["time"], cached_text))
+        printer.p(u"- total: {0:.3f} s".format(sum([rendering_result["time"] for chart_name, rendering_result in rendering_results])))
+
+    # Exports the stats in machine-readable files (JSON Lines and NumPy archive)
+    def _export_stats(self, stats):
+        from stats import trellostatsexport
+
+        now_str = datetime.datetime.now(settings.TIMEZONE).strftime("%Y_%m_%d_%H_%M_%S")
+        file_path_prefix = u"{0}/{1}-stats-{2}".format(
+            self.configuration.output_dir, slugify(self._get_board_name()), slugify(now_str)
+        )
+        return trellostatsexport.export(self.stat_extractor, stats, file_path_prefix, self.configuration.censored)
+
+    # Returns the text with the values of some percentiles (e.g. p50: 1.00 h, p85: 2.00 h, p95: 3.00 h)
+    @staticmethod
+    def _percentiles_text(percentiles):
+        return u", ".join(
+            [u"p{0}: {1:.2f} h".format(percentile, percentiles[percentile]) for percentile in sorted(percentiles.keys())]
+        )
+
     # Returns the name of the board
     def _get_board_name(self):
         # If private data is censored, take the id as
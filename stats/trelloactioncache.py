@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+
+
+# Local cache of the card actions of a board.
+# Card actions are stored in an append-only JSON Lines file and only the actions newer than the last cached ones
+# need to be fetched from Trello API. Actions never change once they have been made, except comments, that can be
+# edited or deleted. Their edits and deletions are actions too (updateComment and deleteComment), so they are cached
+# as the rest of the actions and TrelloBoardSnapshot applies them to the cached comments.
+# Each type of action (action filter) is fetched in its own requests, that are not made at the same moment, so each
+# type has its own high-water mark: the newest cached action of that type.
+class TrelloActionCache(object):
+
+    ACTIONS_FILE_NAME = u"actions.jsonl"
+    STATE_FILE_NAME = u"state.json"
+
+    def __init__(self, cache_dir, board_id, date_interval=None):
+        """
+        :param cache_dir: directory where the caches of all boards are.
+        :param board_id: identifier of the board.
+        :param date_interval: list with two dates [since, before] (YYYY-MM-DD) that filter the fetched actions.
+        If the cache was filled with other date interval, it is emptied.
+        """
+        self.board_id = board_id
+        self.date_interval = date_interval
+        self.board_cache_dir = os.path.join(cache_dir, board_id)
+        self.actions_file_path = os.path.join(self.board_cache_dir, self.__class__.ACTIONS_FILE_NAME)
+        self.state_file_path = os.path.join(self.board_cache_dir, self.__class__.STATE_FILE_NAME)
+        self.state = self._load_state()
+        # Caches with only one high-water mark for all the types of actions may have missed some actions
+        if self.state and (self.state.get("date_interval") != date_interval or "last_actions" not in self.state):
+            self._clear()
+
+    # Newest cached action of a type (its "id" and "date"). None if there is no cached action of that type.
+    def get_last_action(self, action_filter):
+        return self.state.get("last_actions", {}).get(action_filter)
+
+    # Returns all cached actions, from the newest to the oldest one (as Trello API returns them)
+    def load(self):
+        if not os.path.exists(self.actions_file_path):
+            return []
+        actions = []
+        with io.open(self.actions_file_path, "r", encoding="utf-8") as actions_file:
+            for line in actions_file:
+                if line.strip():
+                    actions.append(json.loads(line))
+        actions.reverse()
+        return actions
+
+    # Adds new actions to the cache and moves the high-water mark of each type of action to its newest one
+    def append(self, new_actions, last_actions):
+        """
+        Appends actions to the cache.
+        :param new_actions: actions newer than the last cached ones of their type, from the newest to the oldest one.
+        :param last_actions: dict with the newest fetched action of each type (action filter) with new actions.
+        """
+        if not new_actions:
+            return
+        if not os.path.exists(self.board_cache_dir):
+            os.makedirs(self.board_cache_dir)
+
+        # New actions are appended from the oldest to the newest one
+        with io.open(self.actions_file_path, "a", encoding="utf-8") as actions_file:
+            for action in reversed(new_actions):
+                actions_file.write(json.dumps(action, ensure_ascii=False) + u"\n")
+
+        state_last_actions = dict(self.state.get("last_actions", {}))
+        for action_filter, last_action in last_actions.items():
+            state_last_actions[action_filter] = {"id": last_action["id"], "date": last_action["date"]}
+        self.state = {"last_actions": state_last_actions, "date_interval": self.date_interval}
+        with io.open(self.state_file_path, "w", encoding="utf-8") as state_file:
+            state_file.write(json.dumps(self.state) + u"\n")
+
+    # Removes all cached actions
+    def _clear(self):
+        for file_path in (self.actions_file_path, self.state_file_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self.state = {}
+
+    # Loads the high-water marks of the cache
+    def _load_state(self):
+        if not os.path.exists(self.state_file_path):
+            return {}
+        with io.open(self.state_file_path, "r", encoding="utf-8") as state_file:
+            return json.loads(state_file.read())
@@ -1,40 +1,127 @@
 # -*- coding: utf-8 -*-
 
+import requests
+
 import settings
+from stats import instrumentation
+from stats.trelloactioncache import TrelloActionCache
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+from stats.trelloboardstream import StreamedBoardSnapshot
+
+
+# Fetches the snapshot of the board of a configuration
+def fetch_board_snapshot(trello_connector, fetcher, configuration):
+    """
+    Fetches the board with the BOARD_ID of the configuration or, if there is no BOARD_ID, with the identifier of its
+    BOARD_NAME in the board index of the connector.
+    :param trello_connector: TrelloConnector whose board index is used.
+    :param fetcher: TrelloFetcher used to make the requests.
+    :param configuration: TrelloBoardConfiguration of the board.
+    :return: TrelloBoardSnapshot of the board.
+    """
+    if configuration.board_id:
+        return fetch_snapshot(fetcher, configuration, configuration.board_id)
+
+    board_name = configuration.board_name
+    unicode_board_name = board_name.decode("utf-8") if isinstance(board_name, bytes) else board_name
+    board_index = trello_connector.get_board_index()
+    # Boards that are not in the index are looked up listing the boards of the user, so their identifier is right
+    is_indexed = unicode_board_name in board_index.board_ids_by_name
+    board_id = board_index.get_board_id(fetcher, unicode_board_name)
+    if is_indexed and not _board_has_name(fetcher, board_id, unicode_board_name):
+        # The indexed board has been renamed or deleted, so the boards of the user are listed again
+        board_id = board_index.get_board_id(fetcher, unicode_board_name, refresh=True)
+    return fetch_snapshot(fetcher, configuration, board_id)
+
+
+# Informs if a board exists and has a name. Only the name of the board is fetched, so a stale board index does not
+# cost the fetch of all the card actions of a wrong board.
+def _board_has_name(fetcher, board_id, board_name):
+    try:
+        board_json = fetcher.fetch_json(u"/boards/{0}".format(board_id), query_params={"fields": "name"})
+    except requests.HTTPError as error:
+        # Only a board that is not found means that the index is stale. The rest of errors (e.g. wrong credentials or
+        # server errors) are not solved listing the boards again.
+        if error.response is None or error.response.status_code not in (400, 404):
+            raise
+        return False
+    return board_json["name"] == board_name
+
+
+# Fetches the snapshot of a board, using its action cache if it has been enabled in the configuration.
+# If streaming stats are enabled, the board is streamed instead.
+def fetch_snapshot(fetcher, configuration, board_id):
+    if configuration.streaming_stats:
+        with instrumentation.timer("board.stream_snapshot"):
+            return StreamedBoardSnapshot.fetch(fetcher, board_id, configuration)
+    action_cache = None
+    if configuration.action_cache:
+        action_cache = TrelloActionCache(configuration.cache_dir, board_id, configuration.card_action_filter)
+    with instrumentation.timer("board.fetch_snapshot"):
+        return TrelloBoardSnapshot.fetch(fetcher, board_id, action_cache, configuration.card_action_filter)
 
 
 # Abstraction of a Trello Board with all the fields needed for the stats initialized
 class TrelloBoard(object):
 
-        # Constructor based on credentials and a board name of the board it will compute the stats
-        def __init__(self, trello_connector, configuration):
-            self.client = trello_connector.get_trello_client()
-            self._fetch_board(configuration.board_name)
+        # Constructor based on credentials and a board name of the board it will compute the stats.
+        # If a snapshot of the board is passed, no request is made to Trello API.
+        def __init__(self, trello_connector, configuration, snapshot=None):
+            self.configuration = configuration
+            if snapshot is None:
+                self.trello_connector = trello_connector
+                self.fetcher = trello_connector.get_fetcher()
+                with instrumentation.timer("board.fetch"):
+                    self._fetch_board(configuration.board_name)
+            else:
+                with instrumentation.timer("board.load"):
+                    self._load_board(configuration.board_name, snapshot)
             # Check that configuration (that lists name are right)
-            self._init_configuration(configuration)
+            with instrumentation.timer("board.init_configuration"):
+                self._init_configuration(configuration)
 
         # Fetches the board from Trello API
         # It also fetches and initializes its lists and its cards.
         def _fetch_board(self, board_name):
             """
-            Connects to Trello and sets the board (py-trello Board object).
-            :return: True if board with self.board_name was found, raise and exception otherwise.
+            Connects to Trello and sets the board (TrelloBoardSnapshot object).
+            All board data is fetched at once in a TrelloBoardSnapshot.
+            :return: True if the board was found, raise and exception otherwise.
             """
-            boards = self.client.list_boards()
-            for board in boards:
-                if board.name.decode("utf-8") == board_name:
-                    self.board_name = board_name
-                    self.board = board
-                    self._fetch_members()
-                    self._fetch_lists()
-                    self._fetch_labels()
-                    self._init_cards()
-                    return True
-            raise RuntimeWarning(u"Board {0} was not found. Are your credentials correct?".format(self.board_name))
+            self.board_name = board_name
+            self.snapshot = fetch_board_snapshot(self.trello_connector, self.fetcher, self.configuration)
+            self._reduce_card_actions()
+            self.board = self.snapshot
+            self._fetch_members()
+            self._fetch_lists()
+            self._fetch_labels()
+            self._init_cards()
+            return True
+
+        # Loads the board from a snapshot (e.g. a board dump) instead of fetching it from Trello API
+        def _load_board(self, board_name, snapshot):
+            self.board_name = board_name
+            self.board = snapshot
+            self.snapshot = snapshot
+            self._reduce_card_actions()
+            self._fetch_members()
+            self._fetch_lists()
+            self._fetch_labels()
+            self._init_cards()
+            return True
+
+        # Filters the card actions and, unless their raw JSON is needed (incremental stats or a dump of the board),
+        # reduces them to the movements and comment times the stats need, so the JSON is released before the stats
+        # are computed
+        def _reduce_card_actions(self):
+            if self.configuration.incremental_stats or self.configuration.keep_board_json:
+                self.snapshot.filter_card_actions(self.configuration.card_action_filter)
+            else:
+                self.snapshot.reduce_card_actions(self.configuration)
 
         # Fetching the members of this board
         def _fetch_members(self):
-            self.members = self.board.all_members()
+            self.members = self.snapshot.members
             self.members_dict = {member.id: member for member in self.members}
 
         # Fetching of the board lists from Trello API
@@ -44,7 +131,7 @@ class TrelloBoard(object):
             These attributes contain a list of the board lists and a dict for fast access to a list given its id.
             """
             # List of the board
-            self.lists = self.board.all_lists()
+            self.lists = self.snapshot.lists
 
             # Compute list orders
             i = 1
@@ -57,7 +144,7 @@ class TrelloBoard(object):
             self.lists_dict_by_name = {list_.name.decode("utf-8"): list_ for list_ in self.lists}
 
             # Comparison function used to compute forward and backward movements
-            # when computing card.stats_by_list
+            # when computing the stats of each card by list
             def list_cmp(list_a_id, list_b_id):
                 if self.lists_dict[list_b_id].order > self.lists_dict[list_a_id].order:
                     return 1
@@ -113,12 +200,12 @@ class TrelloBoard(object):
 
         # Fetch and initializes board card labels
         def _fetch_labels(self):
-            self.labels = self.board.get_labels()
+            self.labels = self.snapshot.labels
             self.labels_dict = {label.id: label for label in self.labels}
 
         # Initializes the cards
         def _init_cards(self):
-            self.cards = self.board.all_cards()
+            self.cards = self.snapshot.cards
 
         def _init_configuration(self, configuration):
             """
@@ -1,4 +1,5 @@
 import importlib
+import os
 import re
 
 from stats.trelloboardworkflow import TrelloBoardWorkflow
@@ -8,14 +9,41 @@ class TrelloBoardConfiguration(object):
 
     PLUS_FOR_TRELLO_SPENT_ESTIMATED_TIME_COMMENT_REGEX = r"^plus!\s(?P<spent>(\-)?\d+(\.\d+)?)/(?P<estimated>(\-)?\d+(\.\d+)?)"
 
+    # Boolean options of the configuration file (enabled with "<OPTION>: TRUE") and their parameters
+    BOOLEAN_OPTIONS = {
+        u"CENSORED": "censored",
+        u"ACTION_CACHE": "action_cache",
+        u"INCREMENTAL_STATS": "incremental_stats",
+        u"REPORT_GZIP": "report_gzip",
+        u"REPORT_QUIET": "report_quiet",
+        u"EXPORT_STATS": "export_stats",
+        u"SVG_CHARTS": "svg_charts",
+        u"CHART_CACHE": "chart_cache",
+        u"STREAMING_STATS": "streaming_stats"
+    }
+
     def __init__(self, board_name, card_is_active_function,
                  development_list_name, done_list_name,
                  spent_estimated_time_comment_regex,
                  output_dir, censored=False,
                  card_action_filter=None,
-                 custom_workflows=None):
+                 custom_workflows=None,
+                 action_cache=False,
+                 incremental_stats=False,
+                 report_gzip=False,
+                 report_quiet=False,
+                 export_stats=False,
+                 svg_charts=False,
+                 chart_jobs=1,
+                 chart_cache=False,
+                 board_id=None,
+                 streaming_stats=False,
+                 keep_board_json=False):
 
         self.board_name = board_name
+
+        # If the board identifier is known, the board is not looked up by its name
+        self.board_id = board_id
         self.card_is_active_function = card_is_active_function
         self.card_is_active_function_code = card_is_active_function
 
@@ -35,6 +63,34 @@ class TrelloBoardConfiguration(object):
         self.censored = censored
         self.custom_workflows = custom_workflows
 
+        # Card actions are cached in a local directory inside the output directory
+        self.action_cache = action_cache
+        self.cache_dir = os.path.join(output_dir, u".cache")
+
+        # Stats are updated from the stored state applying only new card actions
+        self.incremental_stats = incremental_stats
+
+        # Report file is compressed with gzip and/or not printed in stdout
+        self.report_gzip = report_gzip
+        self.report_quiet = report_quiet
+
+        # Stats are exported in machine-readable files too
+        self.export_stats = export_stats
+
+        # Charts are rendered as SVG (without PNG rasterization) by chart_jobs processes
+        self.svg_charts = svg_charts
+        self.chart_jobs = chart_jobs
+
+        # Rendered charts are cached in the cache directory and reused while their data does not change
+        self.chart_cache = chart_cache
+
+        # Cards and card actions are streamed page by page and only the active cards are kept in memory
+        self.streaming_stats = streaming_stats
+
+        # Raw JSON of the board and its card actions is kept after the board is loaded (e.g. to record a dump of it).
+        # Otherwise, card actions are reduced to the numbers the stats need and the JSON is released.
+        self.keep_board_json = keep_board_json
+
     # Loads the configuration file from a file to a TrelloBoardConfiguration
     @staticmethod
     def load_from_file(file_path):
@@ -42,8 +98,9 @@ class TrelloBoardConfiguration(object):
         lines = conf_file.readlines()
         num_lines = len(lines)
 
-        censored = False
+        boolean_options = {parameter_name: False for parameter_name in TrelloBoardConfiguration.BOOLEAN_OPTIONS.values()}
         board_name = None
+        board_id = None
         development_list = None
         done_list = None
         card_action_filter = None
@@ -61,6 +118,12 @@ class TrelloBoardConfiguration(object):
                     board_name = param
                     param = None
 
+                # Board identifier (optional)
+                param = TrelloBoardConfiguration._get_single_parameter_from_line(u"BOARD_ID", lines[i])
+                if param:
+                    board_id = param.strip()
+                    param = None
+
                 # Development list
                 param = TrelloBoardConfiguration._get_single_parameter_from_line(u"DEVELOPMENT_LIST", lines[i])
                 if param:
@@ -93,47 +156,42 @@ class TrelloBoardConfiguration(object):
                                                                    [list_.decode("utf-8") for list_ in workflow_lists],
                                                                    [list_.decode("utf-8") for list_ in workflow_done_lists])
                                     workflows.append(workflow)
-                                    matches = re.match("^\-\s*(.+)$", lines[i])
+                                    matches = re.match("^\-\s*(.+)$", lines[i]) if i < num_lines else None
                                 else:
                                     ValueError(u"DONE_LISTS was expected")
                             else:
                                 ValueError(u"LISTS was expected")
+                    # The line after the workflows can be any other parameter
+                    continue
 
-                # Card is active function
+                # Card action filter
                 matches = re.match(r"^CARD_ACTION_FILTER:\s*\[(\d{4}\-\d{2}\-\d{2}),\s*(\d{4}\-\d{2}\-\d{2})\]\s*$", lines[i])
                 if matches:
                     card_action_filter = [matches.group(1), matches.group(2)]
-                    i += 1
                     matches = None
 
                 # Card is active function
                 param = TrelloBoardConfiguration._get_single_parameter_from_line(u"CARD_IS_ACTIVE_FUNCTION", lines[i])
                 if param:
                     card_is_active_function = param
-                    i += 1
                     param = None
 
                 # Comment spent estimated time regex
                 param = TrelloBoardConfiguration._get_single_parameter_from_line(u"COMMENT_SPENT_ESTIMATED_TIME_REGEX", lines[i])
                 if param:
                     comment_spent_estimated_time_regex = param
-                    i += 1
                     param = None
 
-                # Card is active function
+                # Output directory
                 param = TrelloBoardConfiguration._get_single_parameter_from_line(u"OUTPUT_DIR", lines[i])
                 if param:
                     output_dir = param
-                    i += 1
                     param = None
 
-                # Output must be censored
-                if i < len(lines):
-                    matches = re.match(r"^CENSORED:\s*TRUE$",lines[i])
-                    if matches:
-                        censored = True
-                        i += 1
-                        matches = None
+                # Boolean options (e.g. CENSORED: TRUE), in any order
+                for option_name, parameter_name in TrelloBoardConfiguration.BOOLEAN_OPTIONS.items():
+                    if re.match(r"^{0}:\s*TRUE$".format(option_name), lines[i]):
+                        boolean_options[parameter_name] = True
 
             i += 1
 
@@ -146,14 +204,19 @@ class TrelloBoardConfiguration(object):
         TrelloBoardConfiguration._assert_value(comment_spent_estimated_time_regex, "COMMENT_SPENT_ESTIMATED_TIME_REGEX")
         TrelloBoardConfiguration._assert_value(output_dir, "OUTPUT_DIR")
 
+        # Streamed boards do not keep their card actions, that action cache and incremental stats need
+        if boolean_options["streaming_stats"] and \
+                (boolean_options["action_cache"] or boolean_options["incremental_stats"]):
+            raise ValueError(u"STREAMING_STATS can not be used with ACTION_CACHE or INCREMENTAL_STATS")
+
         return TrelloBoardConfiguration(
-            censored=censored,
-            board_name=board_name, card_action_filter=card_action_filter,
+            board_name=board_name, board_id=board_id, card_action_filter=card_action_filter,
             card_is_active_function=card_is_active_function,
             development_list_name=development_list, done_list_name=done_list,
             spent_estimated_time_comment_regex=comment_spent_estimated_time_regex,
             output_dir=output_dir,
-            custom_workflows=workflows)
+            custom_workflows=workflows,
+            **boolean_options)
 
     @staticmethod
     def _get_single_parameter_from_line(parameter_name, line):
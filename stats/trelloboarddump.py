@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import json
+
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+
+
+# Dumps of board snapshots.
+# A dump is a JSON file (gzipped if its name ends with .gz) with the raw data of the board (lists, members,
+# labels and cards) and all its card actions (movements, creations and comments). Dumps allow running the stats
+# computation without connecting to Trello API.
+
+# Saves a snapshot in a dump file
+def save(snapshot, file_path):
+    """
+    Writes a board snapshot in a file.
+    :param snapshot: TrelloBoardSnapshot to save.
+    :param file_path: path of the dump file. If it ends with .gz, it will be compressed with gzip.
+    """
+    if snapshot.actions_json is None:
+        raise ValueError(u"Card actions of board {0} have been reduced, so it can not be dumped".format(snapshot.id))
+    dump = {"board": snapshot.board_json, "actions": snapshot.actions_json}
+    with _open(file_path, "wb") as dump_file:
+        dump_file.write(json.dumps(dump).encode("utf-8"))
+
+
+# Loads a snapshot from a dump file
+def load(file_path):
+    """
+    Reads a board snapshot from a file.
+    :param file_path: path of the dump file. If it ends with .gz, it will be decompressed with gzip.
+    :return: TrelloBoardSnapshot with the data of the dump.
+    """
+    with _open(file_path, "rb") as dump_file:
+        dump = json.loads(dump_file.read().decode("utf-8"))
+    return TrelloBoardSnapshot(dump["board"], dump["actions"])
+
+
+def _open(file_path, mode):
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, mode)
+    return io.open(file_path, mode)
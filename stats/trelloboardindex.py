@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import time
+
+from stats import instrumentation
+
+
+# Index of the identifiers of the boards of a Trello user by board name.
+# It is stored in a JSON file and shared by all the boards of a run, so the boards of the user are only listed
+# (one request that returns all of them) when a board is not in the index or its indexed identifier is not right.
+class TrelloBoardIndex(object):
+
+    def __init__(self, file_path):
+        """
+        :param file_path: path of the JSON file of the index. Its directory is created if it does not exist.
+        """
+        self.file_path = file_path
+        self.board_ids_by_name = self._load()
+
+    # Identifier of a board
+    def get_board_id(self, fetcher, board_name, refresh=False):
+        """
+        :param fetcher: TrelloFetcher used to list the boards of the user.
+        :param board_name: name of the board (unicode).
+        :param refresh: if True, the boards of the user are listed again even if the board is in the index.
+        :return: identifier of the board. Raises RuntimeWarning if the user has no board with that name.
+        """
+        if refresh or board_name not in self.board_ids_by_name:
+            self.board_ids_by_name = self._fetch(fetcher)
+            self._save()
+        if board_name not in self.board_ids_by_name:
+            raise RuntimeWarning(u"Board {0} was not found. Are your credentials correct?".format(board_name))
+        return self.board_ids_by_name[board_name]
+
+    # Lists the boards of the user
+    @staticmethod
+    def _fetch(fetcher):
+        with instrumentation.timer("board.list_boards"):
+            boards = fetcher.fetch_json(u"/members/me/boards", query_params={"fields": "name"})
+        board_ids_by_name = {}
+        for board in boards:
+            # If there are several boards with the same name, the first one is taken
+            board_ids_by_name.setdefault(board["name"], board["id"])
+        return board_ids_by_name
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return {}
+        try:
+            with io.open(self.file_path, "r", encoding="utf-8") as index_file:
+                return json.loads(index_file.read())["board_ids_by_name"]
+        except (ValueError, KeyError):
+            # A damaged index is fetched again
+            return {}
+
+    # Writes the index in a temporary file that replaces the index file, so other processes never read half of it
+    def _save(self):
+        index_directory = os.path.dirname(self.file_path)
+        if index_directory and not os.path.isdir(index_directory):
+            try:
+                os.makedirs(index_directory)
+            except OSError:
+                # Other process can have created it at the same time
+                if not os.path.isdir(index_directory):
+                    raise
+        temporary_file_path = u"{0}.{1}.tmp".format(self.file_path, os.getpid())
+        with io.open(temporary_file_path, "wb") as index_file:
+            index_file.write(json.dumps(
+                {"board_ids_by_name": self.board_ids_by_name, "updated_at": time.time()}, sort_keys=True
+            ).encode("utf-8"))
+        os.rename(temporary_file_path, self.file_path)
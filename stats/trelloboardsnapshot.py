@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+import datetime
+import functools
+import dateutil.parser
+
+import settings
+from stats import instrumentation
+from stats.trellocommenttimesheet import CommentTimesheetBuilder, CommentTimesheetParser
+from stats.trellolisttransitions import TransitionsBuilder
+
+
+# In-memory model of a Trello board: lists, members, labels, cards and the card actions that are needed to
+# compute the stats. All of it is fetched in a few bulk requests, so computing the stats of the cards
+# does not make any other request to Trello API.
+class TrelloBoardSnapshot(object):
+
+    # Card actions needed to compute the stats: list movements, creation and comments, and the edits and deletions
+    # of the comments (Plus for Trello users fix their spent/estimated comments), that cached comments do not have
+    ACTION_FILTERS = [u"updateCard:idList", u"createCard", u"commentCard", u"updateComment", u"deleteComment"]
+
+    # Card actions that are only fetched if they are in the date interval of the card action filter.
+    # There is only one creation action per card and it is needed to know when each card was created, so creation
+    # actions are always fetched. A comment of the interval can be edited or deleted after it, so edits and deletions
+    # of comments are always fetched too.
+    DATE_FILTERED_ACTION_FILTERS = [u"updateCard:idList", u"commentCard"]
+
+    # Max number of actions Trello returns in each request
+    ACTIONS_PAGE_SIZE = 1000
+
+    def __init__(self, board_json, actions_json):
+        self.board_json = board_json
+        self.actions_json = actions_json
+        self.num_actions = len(actions_json)
+
+        # Movements and comment times of the cards once their actions have been reduced (see reduce_card_actions)
+        self.transitions_builder = None
+        self.comment_timesheet_builder = None
+
+        self.id = board_json["id"]
+        self.name = board_json["name"].encode("utf-8")
+
+        self.lists = [SnapshotList(list_json) for list_json in board_json["lists"]]
+        self.members = [SnapshotMember(member_json) for member_json in board_json["members"]]
+        self.labels = [SnapshotLabel(label_json) for label_json in board_json["labels"]]
+        self.cards = [SnapshotCard(card_json) for card_json in board_json["cards"]]
+
+        self._assign_actions_to_cards()
+
+    # Fetches the board and all its card actions from Trello API
+    @staticmethod
+    def fetch(fetcher, board_id, action_cache=None, date_interval=None):
+        """
+        Fetches a board snapshot using a constant number of requests (one for the board entities and one for each
+        page of card actions). The board and the first page of each type of card action are fetched together
+        (in one request to Trello /batch endpoint if the fetcher has batching enabled). Next pages of each type of
+        card action are fetched concurrently.
+        :param fetcher: TrelloFetcher used to make the requests.
+        :param board_id: identifier of the board.
+        :param action_cache: optional TrelloActionCache. If present, only actions newer than the cached ones are
+        fetched.
+        :param date_interval: optional list with two dates [since, before] (YYYY-MM-DD). If present, only the list
+        movements and comments made between these dates are fetched.
+        :return: TrelloBoardSnapshot with the board data.
+        """
+        windows = {
+            action_filter: TrelloBoardSnapshot._get_actions_window(action_filter, action_cache, date_interval)
+            for action_filter in TrelloBoardSnapshot.ACTION_FILTERS
+        }
+
+        board_request = (
+            u"/boards/{0}".format(board_id),
+            {
+                # Identifier is always returned
+                "fields": "name",
+                "lists": "all",
+                "members": "all",
+                "labels": "all", "labels_limit": 1000,
+                "cards": "all"
+            }
+        )
+        first_page_requests = [
+            TrelloBoardSnapshot._get_actions_request(board_id, action_filter, *windows[action_filter])
+            for action_filter in TrelloBoardSnapshot.ACTION_FILTERS
+        ]
+        responses = fetcher.fetch_batch([board_request] + first_page_requests)
+        board_json = responses[0]
+        first_pages = {
+            action_filter: TrelloBoardSnapshot._cut_actions(first_page, windows[action_filter][0])
+            for action_filter, first_page in zip(TrelloBoardSnapshot.ACTION_FILTERS, responses[1:])
+        }
+
+        # Types of actions that have more pages
+        jobs = {
+            action_filter: functools.partial(
+                TrelloBoardSnapshot._fetch_actions, fetcher, board_id, action_filter, windows[action_filter][0],
+                first_page[-1]["id"]
+            )
+            for action_filter, first_page in first_pages.items()
+            if len(first_page) == TrelloBoardSnapshot.ACTIONS_PAGE_SIZE
+        }
+
+        new_actions_json = []
+        for first_page in first_pages.values():
+            new_actions_json += first_page
+        for _action_filter, next_pages in fetcher.fetch_all(jobs):
+            new_actions_json += next_pages
+
+        instrumentation.count("actions.fetched", len(new_actions_json))
+
+        # Each type of action comes in its own pages, so they must be sorted from the newest to the oldest one
+        new_actions_json.sort(key=lambda action: (action["date"], action["id"]), reverse=True)
+
+        if action_cache is None:
+            actions_json = new_actions_json
+        else:
+            cached_actions_json = action_cache.load()
+            # The newest action of each type is the first one of its first page
+            last_actions = {
+                action_filter: first_page[0] for action_filter, first_page in first_pages.items() if first_page
+            }
+            action_cache.append(new_actions_json, last_actions)
+            actions_json = TrelloBoardSnapshot._merge_actions(new_actions_json, cached_actions_json)
+
+        with instrumentation.timer("snapshot.init"):
+            return TrelloBoardSnapshot(board_json, actions_json)
+
+    # Lower and upper bounds (since and before) of the card actions of a type that must be fetched
+    @staticmethod
+    def _get_actions_window(action_filter, action_cache=None, date_interval=None):
+        """
+        :param action_filter: type of the actions.
+        :param action_cache: optional TrelloActionCache with the actions that have already been fetched.
+        :param date_interval: optional list with two dates [since, before] (YYYY-MM-DD).
+        :return: tuple (since, before). Each bound is an action id, a date or None.
+        """
+        last_action = action_cache.get_last_action(action_filter) if action_cache else None
+        since = last_action["id"] if last_action else None
+        before = None
+        if date_interval and action_filter in TrelloBoardSnapshot.DATE_FILTERED_ACTION_FILTERS:
+            since_date, before_date = date_interval
+            # Cached actions are older than the start of the date interval, no need to fetch anything before it
+            if since_date and (since is None or last_action["date"][0:10] < since_date):
+                since = since_date
+            # Trello before parameter is exclusive, while the last date of the interval is included in it
+            if before_date:
+                next_date = datetime.datetime.strptime(before_date, "%Y-%m-%d") + datetime.timedelta(days=1)
+                before = next_date.strftime("%Y-%m-%d")
+        return since, before
+
+    # Request (path and query parameters) of a page of card actions of the board
+    @staticmethod
+    def _get_actions_request(board_id, action_filter, since=None, before=None):
+        query_params = {"filter": action_filter, "limit": TrelloBoardSnapshot.ACTIONS_PAGE_SIZE}
+        if since:
+            query_params["since"] = since
+        if before:
+            query_params["before"] = before
+        return u"/boards/{0}/actions".format(board_id), query_params
+
+    # Fetches the card actions of the board, page by page, from the newest to the oldest one
+    @staticmethod
+    def _fetch_actions(fetcher, board_id, action_filter, since=None, before=None):
+        """
+        Fetches the card actions of a type of the board.
+        :param action_filter: type of the actions.
+        :param since: if present, only the actions newer than this action id (or date) are fetched.
+        :param before: if present, only the actions older than this action id (or date) are fetched.
+        :return: list of actions from the newest to the oldest one.
+        """
+        actions = []
+        for page in TrelloBoardSnapshot.iter_action_pages(fetcher, board_id, action_filter, since, before):
+            actions += page
+        return actions
+
+    # Pages of card actions of a type of the board, from the newest to the oldest one
+    @staticmethod
+    def iter_action_pages(fetcher, board_id, action_filter, since=None, before=None):
+        """
+        Generator of the pages of card actions of a type of the board. Each page is fetched when the previous one
+        has been consumed.
+        :param action_filter: type of the actions.
+        :param since: if present, only the actions newer than this action id (or date) are fetched.
+        :param before: if present, only the actions older than this action id (or date) are fetched.
+        :return: generator of lists of actions.
+        """
+        while True:
+            uri_path, query_params = TrelloBoardSnapshot._get_actions_request(board_id, action_filter, since, before)
+            page = fetcher.fetch_json(uri_path, query_params=query_params)
+            cut_page = TrelloBoardSnapshot._cut_actions(page, since)
+            yield cut_page
+            # Stop as soon as the start of the date interval has been reached
+            if len(page) < TrelloBoardSnapshot.ACTIONS_PAGE_SIZE or len(cut_page) < len(page):
+                return
+            before = page[-1]["id"]
+
+    # Discards the actions of a page (sorted from the newest to the oldest one) that are older than a since date
+    @staticmethod
+    def _cut_actions(page, since):
+        if not since or not _is_date(since):
+            return page
+        for action_index, action in enumerate(page):
+            if action["date"][0:10] < since:
+                return page[0:action_index]
+        return page
+
+    # Merges new actions with cached ones, discarding duplicates. Both lists are sorted from the newest to the oldest.
+    # A new action of a type can be older than a cached action of other type, so the merged actions are sorted again.
+    @staticmethod
+    def _merge_actions(new_actions, old_actions):
+        new_action_ids = {action["id"] for action in new_actions}
+        actions = new_actions + [action for action in old_actions if action["id"] not in new_action_ids]
+        actions.sort(key=lambda action: (action["date"], action["id"]), reverse=True)
+        return actions
+
+    # Discards the list movements and comments of the cards that are not in a date interval
+    def filter_card_actions(self, date_interval):
+        """
+        Keeps only the card list movements and comments made in a date interval. Cards whose last activity is before
+        the start of the interval lose all their list movements and comments without checking them.
+        Raw actions (actions_json) are kept untouched, so the snapshot can still be dumped with all its actions.
+        :param date_interval: list with two dates [since, before] (YYYY-MM-DD). If None, nothing is filtered.
+        """
+        if not date_interval:
+            return
+        since = date_interval[0]
+        for card in self.cards:
+            if since and card.date_last_activity.strftime("%Y-%m-%d") < since:
+                card.movement_actions = []
+                card.comment_actions = []
+                continue
+            card.movement_actions = [action for action in card.movement_actions
+                                     if _action_is_in_date_interval(action, date_interval)]
+            card.comment_actions = [action for action in card.comment_actions
+                                    if _action_is_in_date_interval(action, date_interval)]
+
+    # Reduces the card actions to the numbers the stats need and discards the raw data of the board
+    def reduce_card_actions(self, configuration):
+        """
+        Reduces the list movements and the comments of the cards to a TransitionsBuilder and a CommentTimesheetBuilder
+        (comments are discarded if the configuration has no comment regex), as StreamedBoardSnapshot does while the
+        board is streamed. Card index of each movement and comment is the position of its card in self.cards.
+        Card actions are filtered by the card action filter of the configuration before they are reduced, and the
+        creation action of each card is reduced to its date.
+        Raw JSON of the board and its actions (board_json and actions_json) is discarded, so the snapshot can not be
+        dumped nor used by the incremental stats any longer.
+        :param configuration: TrelloBoardConfiguration of the board.
+        """
+        if self.actions_json is None:
+            return
+        self.filter_card_actions(configuration.card_action_filter)
+        list_indices = {list_.id: list_index for list_index, list_ in enumerate(self.lists)}
+        self.transitions_builder = TransitionsBuilder(list_indices)
+        if configuration.spent_estimated_time_card_comment_regex:
+            self.comment_timesheet_builder = CommentTimesheetBuilder(
+                CommentTimesheetParser(configuration.spent_estimated_time_card_comment_regex)
+            )
+        for card_index, card in enumerate(self.cards):
+            for action in card.movement_actions:
+                self.transitions_builder.add(card_index, action)
+            if self.comment_timesheet_builder is not None:
+                for comment in card.comment_actions:
+                    self.comment_timesheet_builder.add(card_index, comment)
+            card.movement_actions = []
+            card.comment_actions = []
+            if card.creation_action:
+                card.creation_action = {
+                    "id": card.creation_action["id"], "type": card.creation_action["type"],
+                    "date": card.creation_action["date"]
+                }
+        self.board_json = None
+        self.actions_json = None
+
+    # Gives each card its own actions. Comments have the text of their last edit and deleted ones are discarded.
+    def _assign_actions_to_cards(self):
+        cards_dict = {card.id: card for card in self.cards}
+        comment_texts, deleted_comment_ids = self._get_comment_edits()
+        # Actions are returned from the newest to the oldest, we want them in chronological order
+        for action in reversed(self.actions_json):
+            card_data = action["data"].get("card")
+            if card_data is None or card_data["id"] not in cards_dict:
+                continue
+            if action["type"] == "commentCard":
+                if action["id"] in deleted_comment_ids:
+                    continue
+                if action["id"] in comment_texts:
+                    action = dict(action, data=dict(action["data"], text=comment_texts[action["id"]]))
+            cards_dict[card_data["id"]].add_action(action)
+
+    # Last text of each edited comment and ids of the deleted comments
+    def _get_comment_edits(self):
+        comment_texts = {}
+        deleted_comment_ids = set()
+        # Actions are sorted from the newest to the oldest one, so the first edit of a comment is its last one
+        for action in self.actions_json:
+            if action["type"] == "updateComment":
+                comment_texts.setdefault(action["data"]["action"]["id"], action["data"]["action"]["text"])
+            elif action["type"] == "deleteComment":
+                deleted_comment_ids.add(action["data"]["action"]["id"])
+        return comment_texts, deleted_comment_ids
+
+
+# Board list
+class SnapshotList(object):
+
+    # Position of the list in the board is set by TrelloBoard
+    __slots__ = ("id", "name", "closed", "order")
+
+    def __init__(self, list_json):
+        self.id = list_json["id"]
+        self.name = list_json["name"].encode("utf-8")
+        self.closed = list_json["closed"]
+
+
+# Board member
+class SnapshotMember(object):
+
+    __slots__ = ("id", "username", "full_name")
+
+    def __init__(self, member_json):
+        self.id = member_json["id"]
+        self.username = member_json["username"].encode("utf-8")
+        self.full_name = member_json.get("fullName", u"").encode("utf-8")
+
+
+# Board label
+class SnapshotLabel(object):
+
+    __slots__ = ("id", "name", "color")
+
+    def __init__(self, label_json):
+        self.id = label_json["id"]
+        self.name = label_json["name"].encode("utf-8")
+        self.color = label_json["color"]
+
+
+# Board card with its actions.
+# It offers the same interface than the py-trello Card objects used by TrelloStatsExtractor but without making any
+# request to Trello API.
+# Boards can have tens of thousands of cards, so cards have no __dict__. Stats of the cards are not stored in them
+# but in the arrays of TrelloStatsExtractor.
+class SnapshotCard(object):
+
+    __slots__ = (
+        "id", "name", "closed", "idList", "member_ids", "label_ids", "date_last_activity",
+        "movement_actions", "comment_actions", "creation_action"
+    )
+
+    def __init__(self, card_json):
+        self.id = card_json["id"]
+        self.name = card_json["name"].encode("utf-8")
+        self.closed = card_json["closed"]
+        self.idList = card_json["idList"]
+        self.member_ids = card_json["idMembers"]
+        self.label_ids = card_json["idLabels"]
+        self.date_last_activity = dateutil.parser.parse(card_json["dateLastActivity"])
+
+        # Card actions in chronological order
+        self.movement_actions = []
+        self.comment_actions = []
+        self.creation_action = None
+
+    # Adds an action to this card. Actions must be added in chronological order.
+    def add_action(self, action):
+        if action["type"] == "updateCard":
+            self.movement_actions.append(action)
+        elif action["type"] == "commentCard":
+            self.comment_actions.append(action)
+        elif action["type"] == "createCard":
+            self.creation_action = action
+
+    @property
+    def create_date(self):
+        """
+        Creation datetime of this card.
+        If the createCard action is not available (e.g. the card was copied or converted from a checklist item), the
+        creation datetime is extracted from the card id, as its first 8 hexadecimal digits are a timestamp.
+        """
+        if self.creation_action:
+            return dateutil.parser.parse(self.creation_action["date"])
+        return datetime.datetime.fromtimestamp(int(self.id[0:8], 16), settings.TIMEZONE)
+
+    # Comments of this card in chronological order
+    def get_comments(self):
+        return self.comment_actions
+
+    # Movements of this card between lists in chronological order
+    def list_movements(self, list_cmp=None, filter_by_date_interval=None):
+        """
+        Returns the movements of this card between lists.
+        :param list_cmp: comparison function between two list ids. Returns a positive number if the second list is
+        after the first one.
+        :param filter_by_date_interval: list with two dates [since, before] (YYYY-MM-DD) that filter the movements.
+        :return: list of dicts with the source, the destination and the datetime of each movement.
+        """
+        movements = []
+        for action in self.movement_actions:
+            if filter_by_date_interval and not _action_is_in_date_interval(action, filter_by_date_interval):
+                continue
+            source_list = action["data"]["listBefore"]
+            destination_list = action["data"]["listAfter"]
+            movement = {
+                "source": {"id": source_list["id"], "name": source_list["name"]},
+                "destination": {"id": destination_list["id"], "name": destination_list["name"]},
+                "datetime": dateutil.parser.parse(action["date"])
+            }
+            if list_cmp:
+                movement["moved_forward"] = list_cmp(source_list["id"], destination_list["id"]) > 0
+            movements.append(movement)
+        return movements
+
+    # Time and movements of this card in each list
+    def get_stats_by_list(self, lists, list_cmp=None, done_list=None, time_unit="seconds", card_movements_filter=None):
+        """
+        Computes the time this card has been in each list and how many forward and backward movements
+        have each list as source.
+        Time in the done list is not taken in account.
+        :param lists: board lists.
+        :param list_cmp: comparison function between two list ids.
+        :param done_list: list that is considered the "done" list.
+        :param time_unit: seconds, minutes, hours or days.
+        :param card_movements_filter: list with two dates [since, before] (YYYY-MM-DD) that filter the movements.
+        :return: dict indexed by list id with the "time", "forward_moves" and "backward_moves" of this card.
+        """
+        stats_by_list = {list_.id: {"time": 0, "forward_moves": 0, "backward_moves": 0} for list_ in lists}
+        done_list_id = done_list.id if done_list else None
+
+        now = datetime.datetime.now(settings.TIMEZONE)
+
+        movements = self.list_movements(list_cmp, card_movements_filter)
+
+        # If there are no movements, all the life of this card has been in its current list
+        if len(movements) == 0:
+            if self.idList in stats_by_list and self.idList != done_list_id:
+                stats_by_list[self.idList]["time"] += (now - self.create_date).total_seconds()
+
+        else:
+            last_datetime = self.create_date
+            for movement in movements:
+                source_list_id = movement["source"]["id"]
+                if source_list_id in stats_by_list:
+                    stats_by_list[source_list_id]["time"] += (movement["datetime"] - last_datetime).total_seconds()
+                    if list_cmp:
+                        if movement["moved_forward"]:
+                            stats_by_list[source_list_id]["forward_moves"] += 1
+                        else:
+                            stats_by_list[source_list_id]["backward_moves"] += 1
+                last_datetime = movement["datetime"]
+
+            # Time in the current list
+            last_list_id = movements[-1]["destination"]["id"]
+            if last_list_id in stats_by_list and last_list_id != done_list_id:
+                stats_by_list[last_list_id]["time"] += (now - last_datetime).total_seconds()
+
+        seconds_by_time_unit = {"seconds": 1.0, "minutes": 60.0, "hours": 3600.0, "days": 86400.0}[time_unit]
+        for list_id in stats_by_list:
+            stats_by_list[list_id]["time"] /= seconds_by_time_unit
+
+        return stats_by_list
+
+
+# Checks if an action date is in a date interval [since, before]
+def _action_is_in_date_interval(action, date_interval):
+    action_date = action["date"][0:10]
+    since, before = date_interval
+    if since and action_date < since:
+        return False
+    if before and action_date > before:
+        return False
+    return True
+
+
+# Checks if a since/before bound is a date (YYYY-MM-DD) instead of an action id
+def _is_date(bound):
+    return len(bound) == 10 and bound[4] == u"-" and bound[7] == u"-"
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import functools
+
+import numpy
+
+from stats import instrumentation
+from stats.trelloboardsnapshot import TrelloBoardSnapshot, SnapshotCard, SnapshotLabel, SnapshotList, SnapshotMember
+from stats.trelloboardsnapshot import _action_is_in_date_interval
+from stats.trellocommenttimesheet import CommentTimesheetBuilder, CommentTimesheetParser
+from stats.trellolisttransitions import TransitionsBuilder, UNKNOWN_LIST, iso_dates_to_timestamps
+
+
+# Snapshot of a board fetched as a stream of pages of cards and pages of card actions, for boards with so many
+# (usually archived) cards that they do not fit in memory.
+# Each page is reduced as soon as it arrives and then discarded:
+# - Active cards are kept without their actions, as the per-card sections of the report need them. The rest of the
+# cards are reduced to their id, their list, whether they are closed and when they entered their list (the
+# throughput counts the cards in the done list, active or not).
+# - Movements between lists and spent/estimated times of the comments of the active cards are stored as numbers in
+# a TransitionsBuilder and a CommentTimesheetBuilder. The rest of the actions are discarded.
+# It offers the interface of TrelloBoardSnapshot that TrelloBoard needs, but its cards are only the active ones.
+class StreamedBoardSnapshot(object):
+
+    # Max number of cards Trello returns in each request
+    CARDS_PAGE_SIZE = 1000
+
+    # Card fields used by the stats. The rest of them (descriptions, badges...) are not fetched.
+    CARD_FIELDS = u"name,closed,idList,idMembers,idLabels,dateLastActivity"
+
+    def __init__(self, board_json, configuration):
+        """
+        :param board_json: board with its lists, members and labels, but without its cards.
+        :param configuration: TrelloBoardConfiguration of the board. Its card is active function decides which cards
+        are kept and its card action filter which actions are taken in account.
+        """
+        self.id = board_json["id"]
+        self.name = board_json["name"].encode("utf-8")
+
+        self.lists = [SnapshotList(list_json) for list_json in board_json["lists"]]
+        self.members = [SnapshotMember(member_json) for member_json in board_json["members"]]
+        self.labels = [SnapshotLabel(label_json) for label_json in board_json["labels"]]
+
+        self.card_is_active_function = configuration.card_is_active_function
+        self.card_action_filter = configuration.card_action_filter
+        self.list_indices = {list_.id: list_index for list_index, list_ in enumerate(self.lists)}
+
+        # Active cards, sorted by id (that is, by creation time) once all of them have been streamed.
+        # The position of each card in this list is its card index in the transitions and the timesheet.
+        self.cards = []
+        self.card_positions = {}
+
+        # Number of cards of the board, including the dropped ones
+        self.num_cards = 0
+
+        # Number of fetched card actions
+        self.num_actions = 0
+
+        # Id, list position (UNKNOWN_LIST if the list is not in the board) and closed flag of each dropped card,
+        # sorted by id, and the UNIX timestamp of its last movement to its list (its creation if it has none)
+        self.dropped_card_ids = numpy.zeros(0, dtype="S24")
+        self.dropped_card_list_indices = numpy.zeros(0, dtype=numpy.int32)
+        self.dropped_card_is_closed = numpy.zeros(0, dtype=bool)
+        self.dropped_card_entry_timestamps = numpy.zeros(0, dtype=numpy.float64)
+        self._dropped_card_pages = []
+
+        # Movements of the active cards between lists
+        self.transitions_builder = TransitionsBuilder(self.list_indices)
+
+        # Spent and estimated times of the comments of the active cards. Comments are not fetched if there is no
+        # comment regex.
+        self.comment_timesheet_builder = None
+        if configuration.spent_estimated_time_card_comment_regex:
+            self.comment_timesheet_builder = CommentTimesheetBuilder(
+                CommentTimesheetParser(configuration.spent_estimated_time_card_comment_regex)
+            )
+
+    # Fetches the board streaming its cards and card actions from Trello API
+    @staticmethod
+    def fetch(fetcher, board_id, configuration):
+        """
+        Fetches a board keeping in memory only one page of cards or card actions of each type at a time.
+        :param fetcher: TrelloFetcher used to make the requests.
+        :param board_id: identifier of the board.
+        :param configuration: TrelloBoardConfiguration of the board.
+        :return: StreamedBoardSnapshot with the board data.
+        """
+        board_json = fetcher.fetch_json(
+            u"/boards/{0}".format(board_id),
+            query_params={"fields": "name", "lists": "all", "members": "all", "labels": "all", "labels_limit": 1000}
+        )
+        snapshot = StreamedBoardSnapshot(board_json, configuration)
+
+        with instrumentation.timer("stream.cards"):
+            for cards_page in StreamedBoardSnapshot.iter_card_pages(fetcher, board_id):
+                snapshot.add_cards(cards_page)
+            snapshot.end_cards()
+
+        # Each type of action is streamed by its own job and is reduced in its own builder
+        action_filters = [u"createCard", u"updateCard:idList"]
+        if snapshot.comment_timesheet_builder is not None:
+            action_filters.append(u"commentCard")
+        jobs = {
+            action_filter: functools.partial(snapshot._stream_actions, fetcher, board_id, action_filter)
+            for action_filter in action_filters
+        }
+        with instrumentation.timer("stream.actions"):
+            for _action_filter, num_actions in fetcher.fetch_all(jobs):
+                instrumentation.count("actions.fetched", num_actions)
+                snapshot.num_actions += num_actions
+
+        instrumentation.count("cards.dropped", len(snapshot.dropped_card_list_indices))
+        return snapshot
+
+    # Pages of cards of the board (open and closed ones), from the newest to the oldest one
+    @staticmethod
+    def iter_card_pages(fetcher, board_id):
+        before = None
+        while True:
+            query_params = {
+                "filter": "all", "fields": StreamedBoardSnapshot.CARD_FIELDS,
+                "limit": StreamedBoardSnapshot.CARDS_PAGE_SIZE
+            }
+            if before:
+                query_params["before"] = before
+            page = fetcher.fetch_json(u"/boards/{0}/cards".format(board_id), query_params=query_params)
+            yield page
+            if len(page) < StreamedBoardSnapshot.CARDS_PAGE_SIZE:
+                return
+            # Card ids start with their creation timestamp, so the next page has the cards older than this one
+            next_before = min(card_json["id"] for card_json in page)
+            if before is not None and next_before >= before:
+                raise RuntimeError(u"Cards of board {0} can not be paginated".format(board_id))
+            before = next_before
+
+    # Keeps the active cards of a page and reduces the rest of them to their id, list and closed flag
+    def add_cards(self, cards_json):
+        dropped_card_ids = []
+        dropped_card_list_indices = []
+        dropped_card_is_closed = []
+        for card_json in cards_json:
+            card = SnapshotCard(card_json)
+            if self.card_is_active_function(card):
+                self.cards.append(card)
+            else:
+                dropped_card_ids.append(card.id.encode("ascii"))
+                dropped_card_list_indices.append(self.list_indices.get(card.idList, UNKNOWN_LIST))
+                dropped_card_is_closed.append(bool(card.closed))
+        self._dropped_card_pages.append((
+            numpy.array(dropped_card_ids, dtype="S24"),
+            numpy.array(dropped_card_list_indices, dtype=numpy.int32),
+            numpy.array(dropped_card_is_closed, dtype=bool)
+        ))
+        self.num_cards += len(cards_json)
+
+    # Sorts the active cards and indexes them once all the cards have been streamed
+    def end_cards(self):
+        self.cards.sort(key=lambda card: card.id)
+        self.card_positions = {card.id: card_position for card_position, card in enumerate(self.cards)}
+        if self._dropped_card_pages:
+            dropped_card_ids = numpy.concatenate([page[0] for page in self._dropped_card_pages])
+            order = numpy.argsort(dropped_card_ids)
+            self.dropped_card_ids = dropped_card_ids[order]
+            self.dropped_card_list_indices = numpy.concatenate([page[1] for page in self._dropped_card_pages])[order]
+            self.dropped_card_is_closed = numpy.concatenate([page[2] for page in self._dropped_card_pages])[order]
+            # The first 8 hexadecimal digits of the card id are its creation timestamp
+            self.dropped_card_entry_timestamps = numpy.array(
+                [float(int(card_id[0:8], 16)) for card_id in self.dropped_card_ids], dtype=numpy.float64
+            )
+        self._dropped_card_pages = []
+
+    # Streams the card actions of a type and reduces them page by page
+    def _stream_actions(self, fetcher, board_id, action_filter):
+        """
+        :return: number of fetched actions.
+        """
+        since, before = TrelloBoardSnapshot._get_actions_window(action_filter, None, self.card_action_filter)
+        num_actions = 0
+        for page in TrelloBoardSnapshot.iter_action_pages(fetcher, board_id, action_filter, since, before):
+            for action in page:
+                self.add_action(action)
+            if action_filter == u"updateCard:idList":
+                self.add_dropped_card_movements(page)
+            num_actions += len(page)
+        return num_actions
+
+    # Reduces a card action. Actions of cards that are not active are discarded.
+    def add_action(self, action):
+        card_data = action["data"].get("card")
+        if card_data is None:
+            return
+        card_position = self.card_positions.get(card_data["id"])
+        if card_position is None:
+            return
+        card = self.cards[card_position]
+
+        if action["type"] == "createCard":
+            # Only the date of the creation action is used
+            card.creation_action = {"id": action["id"], "type": action["type"], "date": action["date"]}
+            return
+
+        # Same filter than TrelloBoardSnapshot.filter_card_actions
+        if self.card_action_filter:
+            since = self.card_action_filter[0]
+            if since and card.date_last_activity.strftime("%Y-%m-%d") < since:
+                return
+            if not _action_is_in_date_interval(action, self.card_action_filter):
+                return
+
+        if action["type"] == "updateCard":
+            self.transitions_builder.add(card_position, action)
+        elif action["type"] == "commentCard" and self.comment_timesheet_builder is not None:
+            self.comment_timesheet_builder.add(card_position, action)
+
+    # Updates the time the dropped cards entered their list with a page of movements. Movements of other cards and
+    # the ones that are not in the date interval of the card action filter are discarded.
+    def add_dropped_card_movements(self, movements):
+        movements = [
+            movement for movement in movements
+            if movement["data"]["card"]["id"] not in self.card_positions and
+            (not self.card_action_filter or _action_is_in_date_interval(movement, self.card_action_filter))
+        ]
+        if not movements or len(self.dropped_card_ids) == 0:
+            return
+        card_ids = numpy.array([movement["data"]["card"]["id"].encode("ascii") for movement in movements], dtype="S24")
+        positions = numpy.minimum(numpy.searchsorted(self.dropped_card_ids, card_ids), len(self.dropped_card_ids) - 1)
+        to_list_indices = numpy.array(
+            [self.list_indices.get(movement["data"]["listAfter"]["id"], UNKNOWN_LIST) for movement in movements],
+            dtype=numpy.int32
+        )
+        is_entry = (self.dropped_card_ids[positions] == card_ids) & \
+            (to_list_indices == self.dropped_card_list_indices[positions])
+        numpy.maximum.at(
+            self.dropped_card_entry_timestamps, positions[is_entry],
+            iso_dates_to_timestamps([movement["date"] for movement in movements])[is_entry]
+        )
+
+    # UNIX timestamps of the last time each dropped card in a list entered it
+    def get_dropped_card_entry_timestamps(self, list_index):
+        return self.dropped_card_entry_timestamps[self.dropped_card_list_indices == list_index]
+
+    # Card actions have already been filtered while they were streamed
+    def filter_card_actions(self, date_interval):
+        pass
+
+    # Card actions have already been reduced while they were streamed
+    def reduce_card_actions(self, configuration):
+        pass
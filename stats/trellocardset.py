@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+
+# Set of cards of a board.
+# Only the positions of its cards in the board cards are stored, so a card that belongs to several sets (active,
+# done, created in a month with a label...) is not referenced once for each one of them.
+class CardSet(object):
+
+    __slots__ = ("cards", "indices")
+
+    def __init__(self, cards, indices):
+        """
+        :param cards: all the cards of the board.
+        :param indices: positions in cards of the cards of this set, in ascending order.
+        """
+        self.cards = cards
+        self.indices = numpy.asarray(indices, dtype=numpy.int32)
+
+    # Set of the cards whose position in the board cards is True in a boolean mask
+    @staticmethod
+    def from_mask(cards, mask):
+        return CardSet(cards, numpy.flatnonzero(mask))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        cards = self.cards
+        for card_index in self.indices:
+            yield cards[card_index]
+
+    def __getitem__(self, position):
+        return self.cards[self.indices[position]]
+
+
+# Set of cards of which only the size is known, because its cards were dropped while the board was streamed
+# (see StreamedBoardSnapshot). It can not be iterated.
+class CountedCardSet(object):
+
+    __slots__ = ("size",)
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+# Numeric value of each card of a set of cards, indexed by card id.
+# Values are stored in a preallocated array with one position for each card. Cards without value have NaN in it
+# and are not in the mapping.
+class CardValues(object):
+
+    __slots__ = ("card_positions", "array")
+
+    def __init__(self, card_positions, array):
+        """
+        :param card_positions: dict with the position of each card id in array.
+        :param array: float array with the value of each card.
+        """
+        self.card_positions = card_positions
+        self.array = array
+
+    def __getitem__(self, card_id):
+        value = self.array[self.card_positions[card_id]]
+        if numpy.isnan(value):
+            raise KeyError(card_id)
+        return float(value)
+
+    def __contains__(self, card_id):
+        card_position = self.card_positions.get(card_id)
+        return card_position is not None and not numpy.isnan(self.array[card_position])
+
+    def __len__(self):
+        return int(numpy.count_nonzero(~numpy.isnan(self.array)))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, card_id, default=None):
+        if card_id in self:
+            return self[card_id]
+        return default
+
+    def keys(self):
+        return [card_id for card_id, card_position in sorted(self.card_positions.items(), key=lambda item: item[1])
+                if not numpy.isnan(self.array[card_position])]
+
+    # Array with the values of the cards that have one
+    def values(self):
+        return self.array[~numpy.isnan(self.array)]
+
+    def items(self):
+        return [(card_id, self[card_id]) for card_id in self.keys()]
+
+
+# Stats of each card of a set of cards, indexed by card id.
+# Stats are not stored but built from the position of the card each time they are read.
+class CardStats(object):
+
+    __slots__ = ("card_positions", "get_card_stats")
+
+    def __init__(self, card_positions, get_card_stats):
+        """
+        :param card_positions: dict with the position of each card id.
+        :param get_card_stats: function that returns the stats of a card given its position.
+        """
+        self.card_positions = card_positions
+        self.get_card_stats = get_card_stats
+
+    def __getitem__(self, card_id):
+        return self.get_card_stats(self.card_positions[card_id])
+
+    def __contains__(self, card_id):
+        return card_id in self.card_positions
+
+    def __len__(self):
+        return len(self.card_positions)
+
+    def __iter__(self):
+        return iter(self.card_positions)
+
+
+# Position of each one of some card indices in an ascending array of card indices (-1 for the ones that are not in it)
+def get_card_positions(indices, card_indices):
+    """
+    :param indices: ascending array with the card indices of a set of cards (e.g. CardSet.indices).
+    :param card_indices: array of card indices.
+    :return: int64 array with the position in indices of each one of card_indices, or -1 if it is not in indices.
+    """
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    card_indices = numpy.asarray(card_indices, dtype=numpy.int64)
+    if len(indices) == 0:
+        return numpy.full(len(card_indices), -1, dtype=numpy.int64)
+    positions = numpy.searchsorted(indices, card_indices)
+    is_in_indices = indices[numpy.minimum(positions, len(indices) - 1)] == card_indices
+    return numpy.where(is_in_indices, positions, -1)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+import array
+import datetime
+import re
+
+import numpy
+
+from stats.trellocardset import get_card_positions
+
+
+# Parser of the spent and estimated times that plugins like Plus for Trello write in card comments
+# (e.g. "plus! 2/3"). The comment regex is compiled once and the month and week of each day are only computed the
+# first time the day is seen.
+class CommentTimesheetParser(object):
+
+    def __init__(self, comment_regex):
+        """
+        :param comment_regex: regular expression with the named groups "spent" and "estimated".
+        """
+        self.comment_regex = re.compile(comment_regex)
+        self._day_keys = {}
+
+    # Spent and estimated times of a comment
+    def parse_comment(self, comment):
+        """
+        :param comment: commentCard action.
+        :return: tuple (comment creator id, day, spent, estimated) if the comment has spent and estimated times,
+        None otherwise. Day has the format YYYY-MM-DD.
+        """
+        matches = self.comment_regex.match(comment["data"]["text"])
+        if not matches:
+            return None
+        return (
+            comment["idMemberCreator"], _iso_date_to_day(comment["date"]),
+            float(matches.group("spent")), float(matches.group("estimated"))
+        )
+
+    # Month, week and first day of the week of a day
+    def get_day_keys(self, day):
+        """
+        :param day: date with the format YYYY-MM-DD.
+        :return: tuple (month, week, week start). E.g. ("2016-M03", "2016-W9", "2016-02-28").
+        """
+        day_keys = self._day_keys.get(day)
+        if day_keys is None:
+            date = datetime.date(int(day[0:4]), int(day[5:7]), int(day[8:10]))
+            month = "{0}-M{1}".format(day[0:4], day[5:7])
+            week = "{0}-W{1}".format(date.year, date.isocalendar()[1])
+            week_start = datetime.datetime.strptime(week + "-0", "%Y-W%W-%w").strftime("%Y-%m-%d")
+            day_keys = (month, week, week_start)
+            self._day_keys[day] = day_keys
+        return day_keys
+
+    # Parses the comments of a set of cards at once
+    def parse(self, cards):
+        """
+        :param cards: cards (SnapshotCard objects) whose comments are parsed.
+        :return: CommentTimesheet with the times of all the comments that match the comment regex.
+        """
+        timesheet_builder = CommentTimesheetBuilder(self)
+        for card_index, card in enumerate(cards):
+            for comment in card.get_comments():
+                timesheet_builder.add(card_index, comment)
+        return timesheet_builder.build(cards)
+
+
+# Spent and estimated times of comments, added one by one. Only the times of each comment are stored, so comments
+# can be discarded as soon as they are added (e.g. while the board is streamed).
+class CommentTimesheetBuilder(object):
+
+    def __init__(self, parser):
+        """
+        :param parser: CommentTimesheetParser used to parse the comments.
+        """
+        self.parser = parser
+        self.num_comments = 0
+        self.member_ids = {}
+        self.days = {}
+        self.card_indices = array.array("l")
+        self.member_indices = array.array("l")
+        self.day_indices = array.array("l")
+        self.spent_times = array.array("d")
+        self.estimated_times = array.array("d")
+
+    # Adds a comment (commentCard action) of the card with position card_index
+    def add(self, card_index, comment):
+        self.num_comments += 1
+        comment_times = self.parser.parse_comment(comment)
+        if comment_times is None:
+            return
+        member_id, day, spent, estimated = comment_times
+        self.card_indices.append(card_index)
+        self.member_indices.append(self.member_ids.setdefault(member_id, len(self.member_ids)))
+        self.day_indices.append(self.days.setdefault(day, len(self.days)))
+        self.spent_times.append(spent)
+        self.estimated_times.append(estimated)
+
+    # Timesheet of the added comments
+    def build(self, cards, card_indices=None):
+        """
+        :param cards: cards of the timesheet. Position of each card must be its card_index or, if card_indices is
+        present, the position of its card_index in card_indices.
+        :param card_indices: optional ascending array of card indices. If present, only the comments of these cards
+        are kept.
+        :return: CommentTimesheet.
+        """
+        comment_card_indices = numpy.array(self.card_indices, dtype=numpy.int64)
+        is_kept = numpy.ones(len(comment_card_indices), dtype=bool)
+        if card_indices is not None:
+            card_positions = get_card_positions(card_indices, comment_card_indices)
+            is_kept = card_positions >= 0
+            comment_card_indices = card_positions[is_kept]
+        return CommentTimesheet(
+            self.parser, cards, self.num_comments,
+            _sorted_by_index(self.member_ids), _sorted_by_index(self.days),
+            comment_card_indices,
+            numpy.array(self.member_indices, dtype=numpy.int64)[is_kept],
+            numpy.array(self.day_indices, dtype=numpy.int64)[is_kept],
+            numpy.array(self.spent_times, dtype=numpy.float64)[is_kept],
+            numpy.array(self.estimated_times, dtype=numpy.float64)[is_kept]
+        )
+
+
+# Spent and estimated times of the comments of a set of cards, stored as arrays of
+# (card, member, day, spent, estimated) in chronological order for each card.
+# Times by card, member and period of time are grouped sums over these arrays.
+class CommentTimesheet(object):
+
+    # Periods of time of the times of each member. The first day of each week is stored with the week times.
+    PERIODS = ["month", "week", "day"]
+
+    def __init__(self, parser, cards, num_comments, member_ids, days, card_indices, member_indices, day_indices,
+                 spent_times, estimated_times):
+        self.cards = cards
+        self.num_comments = num_comments
+        self.member_ids = member_ids
+        self.days = days
+        self.card_indices = card_indices
+        self.member_indices = member_indices
+        self.day_indices = day_indices
+        self.spent_times = spent_times
+        self.estimated_times = estimated_times
+
+        # Month and week of each day
+        day_keys = [parser.get_day_keys(day) for day in days]
+        self.week_starts = {week: week_start for _month, week, week_start in day_keys}
+        self.period_keys = {"day": days}
+        self.period_indices = {"day": day_indices}
+        for period_position, period in ((0, "month"), (1, "week")):
+            period_keys = {}
+            period_index_by_day = numpy.array(
+                [period_keys.setdefault(keys[period_position], len(period_keys)) for keys in day_keys],
+                dtype=numpy.int64
+            )
+            self.period_keys[period] = _sorted_by_index(period_keys)
+            self.period_indices[period] = period_index_by_day[day_indices]
+
+    # Spent and estimated times of each member by period of time
+    def get_times_by_member(self, period):
+        """
+        :param period: month or week.
+        :return: tuple of two dicts (spent and estimated times), both indexed by member id and period.
+        """
+        num_periods = len(self.period_keys[period])
+        groups, (spent_sums, estimated_sums) = _group_sums(
+            self.member_indices * num_periods + self.period_indices[period],
+            self.spent_times, self.estimated_times
+        )
+        spent_times_by_member = {}
+        estimated_times_by_member = {}
+        for group, spent, estimated in zip(groups, spent_sums, estimated_sums):
+            member_id = self.member_ids[group // num_periods]
+            period_key = self.period_keys[period][group % num_periods]
+            spent_times_by_member.setdefault(member_id, {})[period_key] = float(spent)
+            estimated_times_by_member.setdefault(member_id, {})[period_key] = float(estimated)
+        return spent_times_by_member, estimated_times_by_member
+
+    # Spent and estimated times of each card, in the format of TrelloStatsExtractor._get_spent_estimated_by_card
+    def get_times_by_card(self):
+        """
+        :return: list with the times of each card: dict with the "total" spent and estimated times (None if the
+        card has no comments with times) and the times of each member "by_user" by month, week and day.
+        """
+        num_cards = len(self.cards)
+        times_by_card = [{"total": {"spent": None, "estimated": None}, "by_user": {}} for _card in self.cards]
+
+        card_spent_times = numpy.bincount(self.card_indices, weights=self.spent_times, minlength=num_cards)
+        card_estimated_times = numpy.bincount(self.card_indices, weights=self.estimated_times, minlength=num_cards)
+        for card_index in numpy.unique(self.card_indices):
+            times_by_card[card_index]["total"] = {
+                "spent": float(card_spent_times[card_index]), "estimated": float(card_estimated_times[card_index])
+            }
+
+        num_members = len(self.member_ids)
+        for period in self.__class__.PERIODS:
+            num_periods = len(self.period_keys[period])
+            groups, (spent_sums, estimated_sums) = _group_sums(
+                (self.card_indices * num_members + self.member_indices) * num_periods + self.period_indices[period],
+                self.spent_times, self.estimated_times
+            )
+            for group, spent, estimated in zip(groups, spent_sums, estimated_sums):
+                card_member, period_index = divmod(int(group), num_periods)
+                card_index, member_index = divmod(card_member, num_members)
+                user_times = _get_user_times(times_by_card[card_index], self.member_ids[member_index])
+                period_key = self.period_keys[period][period_index]
+                period_times = {"spent": float(spent), "estimated": float(estimated)}
+                if period == "week":
+                    period_times["week_starts_at"] = self.week_starts[period_key]
+                user_times["by_{0}".format(period)][period_key] = period_times
+
+        return times_by_card
+
+
+# Trello dates are always in UTC with the format 2016-03-01T10:00:00.000Z, so the day is its first 10 characters
+def _iso_date_to_day(iso_date):
+    return iso_date[0:10]
+
+
+# Times of a member in the times of a card
+def _get_user_times(card_times, member_id):
+    if member_id not in card_times["by_user"]:
+        card_times["by_user"][member_id] = {
+            "total": {"spent": 0, "estimated": 0},
+            "by_month": {},
+            "by_week": {},
+            "by_day": {}
+        }
+    return card_times["by_user"][member_id]
+
+
+# Sums of several arrays of values grouped by a key
+def _group_sums(keys, *values_arrays):
+    """
+    :param keys: integer array with the group of each value.
+    :param values_arrays: arrays of values with the same length than keys.
+    :return: tuple (sorted distinct groups, list with the sums of each array of values by group).
+    """
+    groups, group_indices = numpy.unique(keys, return_inverse=True)
+    return groups, [
+        numpy.bincount(group_indices, weights=values, minlength=len(groups)) for values in values_arrays
+    ]
+
+
+# Keys of a dict whose values are consecutive indices, sorted by their index
+def _sorted_by_index(indices_by_key):
+    keys = [None] * len(indices_by_key)
+    for key, index in indices_by_key.items():
+        keys[index] = key
+    return keys
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy
+
+from stats.trellolisttransitions import UNKNOWN_LIST
+
+SECONDS_PER_DAY = 86400.0
+
+
+# Number of cards in each list at the end of each day of the life of the board (work in progress by list), the data
+# of a cumulative flow diagram.
+# It is computed with a sweep line instead of checking each interval a card has been in a list against each day:
+# each interval is an entry event and an exit event (unless the card is still in the list), events are counted by
+# day and list at once and the number of cards in each list at the end of each day is the cumulative sum of its
+# events until that day. Time is linear in the number of events plus the number of days x lists.
+# Incremental stats keep the events of each day instead, so it can also be built from them.
+# Days are UTC days, as the dates of Trello actions.
+class CumulativeFlow(object):
+
+    def __init__(self, lists, first_day, events):
+        """
+        :param lists: board lists.
+        :param first_day: first day (days since 1970-01-01).
+        :param events: matrix (days x lists) with the number of cards that entered each list minus the number of
+        cards that left it each day since first_day. Its last row is the current day.
+        """
+        self.lists = lists
+        self.first_day = first_day
+        self.num_days = events.shape[0]
+
+        # Cards in each list at the end of each day (days x lists)
+        self.wip = numpy.cumsum(events, axis=0)
+
+    # Cumulative flow of the intervals of some cards in each list
+    @staticmethod
+    def from_list_transitions(list_transitions, now_timestamp):
+        """
+        :param list_transitions: ListTransitions with the movements of the cards. It does not need to be computed.
+        :param now_timestamp: current UNIX timestamp. It is in the last day.
+        :return: CumulativeFlow.
+        """
+        num_lists = len(list_transitions.lists)
+
+        _card_indices, list_indices, entry_timestamps, exit_timestamps = list_transitions.get_list_intervals()
+        is_known_list = list_indices != UNKNOWN_LIST
+        list_indices = list_indices[is_known_list]
+        entry_timestamps = entry_timestamps[is_known_list]
+        exit_timestamps = exit_timestamps[is_known_list]
+
+        # Days are counted since the day the first card entered in a list
+        last_day = get_day(now_timestamp)
+        first_day = last_day
+        if len(entry_timestamps) > 0:
+            first_day = min(first_day, get_day(entry_timestamps.min()))
+        num_days = last_day - first_day + 1
+
+        entry_days = numpy.floor(entry_timestamps / SECONDS_PER_DAY).astype(numpy.int64) - first_day
+        is_closed = ~numpy.isnan(exit_timestamps)
+        exit_days = numpy.floor(exit_timestamps[is_closed] / SECONDS_PER_DAY).astype(numpy.int64) - first_day
+        # A card can not leave a list before entering in it (e.g. its creation action was dated after its first move)
+        exit_days = numpy.maximum(exit_days, entry_days[is_closed])
+
+        num_cells = num_days * num_lists
+        events = numpy.bincount(entry_days * num_lists + list_indices, minlength=num_cells) - \
+            numpy.bincount(exit_days * num_lists + list_indices[is_closed], minlength=num_cells)
+        return CumulativeFlow(list_transitions.lists, first_day, events.reshape(num_days, num_lists))
+
+    # Cumulative flow of the list entries and exits of each day (e.g. the ones kept by incremental stats)
+    @staticmethod
+    def from_events_by_day(lists, events_by_day, now_timestamp):
+        """
+        :param lists: board lists.
+        :param events_by_day: dict with the number of cards that entered each list minus the number of cards that
+        left it (a list with a number for each list) for each day (days since 1970-01-01) with events.
+        :param now_timestamp: current UNIX timestamp. It is in the last day.
+        :return: CumulativeFlow.
+        """
+        last_day = get_day(now_timestamp)
+        first_day = min([last_day] + list(events_by_day.keys()))
+        events = numpy.zeros((last_day - first_day + 1, len(lists)), dtype=numpy.int64)
+        for day, day_events in events_by_day.items():
+            events[day - first_day] += day_events
+        return CumulativeFlow(lists, first_day, events)
+
+    # Day of a row of self.wip (YYYY-MM-DD)
+    def get_day(self, day_index):
+        return str(numpy.datetime64(self.first_day + day_index, "D"))
+
+    # Current, average and max number of cards of each list
+    def get_wip_summary(self):
+        """
+        :return: dict with a dict for each list id with its "current", "avg" and "max" number of cards and the
+        "max_day" (YYYY-MM-DD) when it reached its max number of cards for the first time.
+        """
+        max_day_indices = numpy.argmax(self.wip, axis=0)
+        return {
+            list_.id: {
+                "current": int(self.wip[-1, list_index]),
+                "avg": float(self.wip[:, list_index].mean()),
+                "max": int(self.wip[max_day_indices[list_index], list_index]),
+                "max_day": self.get_day(int(max_day_indices[list_index]))
+            }
+            for list_index, list_ in enumerate(self.lists)
+        }
+
+    # Some days of the board life, evenly spaced and always with the last one, so a chart of a board several years
+    # old has a readable number of points
+    def get_sampled_days(self, max_days):
+        """
+        :param max_days: max number of days.
+        :return: tuple with a list of days (YYYY-MM-DD) and their rows of self.wip (sampled days x lists).
+        """
+        step = max(1, int(math.ceil(self.num_days / float(max_days))))
+        day_indices = numpy.arange(self.num_days - 1, -1, -step)[::-1]
+        return [self.get_day(int(day_index)) for day_index in day_indices], self.wip[day_indices]
+
+
+# Day of a UNIX timestamp (days since 1970-01-01)
+def get_day(timestamp):
+    return int(math.floor(timestamp / SECONDS_PER_DAY))
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import functools
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+import requests
+
+from stats import instrumentation
+
+
+# Token bucket rate limiter shared by all the threads of a fetcher (or by all the fetchers of a connector)
+class TokenBucket(object):
+
+    def __init__(self, capacity, period):
+        """
+        Allows bursts of capacity requests and a sustained rate of capacity requests for each period.
+        :param capacity: max number of requests in period.
+        :param period: time in seconds.
+        """
+        self.capacity = float(capacity)
+        self.rate = capacity / float(period)
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    # Waits until a request can be done
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+# Makes concurrent requests to Trello API with a bounded number of simultaneous requests,
+# rate limiting and retries with exponential backoff on rate limit (429) and server (5xx) errors.
+class TrelloFetcher(object):
+
+    API_URL = u"https://api.trello.com/1"
+
+    DEFAULT_CONCURRENCY = 8
+
+    # Trello API allows 100 requests each 10 seconds for each token
+    DEFAULT_RATE_LIMIT = 100
+    DEFAULT_RATE_LIMIT_PERIOD = 10.0
+
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_BACKOFF = 0.5
+
+    # Max number of requests Trello /batch endpoint accepts
+    BATCH_SIZE = 10
+
+    def __init__(self, api_key, token, api_url=API_URL,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 rate_limit=DEFAULT_RATE_LIMIT, rate_limit_period=DEFAULT_RATE_LIMIT_PERIOD,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 session=None, timeout=None, batch=False, token_bucket=None):
+        """
+        :param api_key: Trello API key.
+        :param token: Trello token.
+        :param api_url: base URL of the API. It can be changed to point to a local server.
+        :param concurrency: max number of simultaneous requests.
+        :param rate_limit: max number of requests in rate_limit_period seconds.
+        :param rate_limit_period: time in seconds.
+        :param max_retries: max number of retries of a failed request.
+        :param backoff: seconds to wait before the first retry. This time is doubled in each retry.
+        :param session: requests.Session used to make the requests. If it is not present, a new one is created.
+        :param timeout: timeout of the requests (seconds or a tuple with the connection and read timeouts).
+        :param batch: if True, fetch_batch groups the requests in requests to Trello /batch endpoint.
+        :param token_bucket: TokenBucket shared with other fetchers. If it is not present, a TokenBucket of
+        rate_limit requests each rate_limit_period seconds is created for this fetcher.
+        """
+        self.api_key = api_key
+        self.token = token
+        self.api_url = api_url.rstrip(u"/")
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.token_bucket = token_bucket if token_bucket is not None else TokenBucket(rate_limit, rate_limit_period)
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self.batch = batch
+
+    # Fetches some JSON from Trello API
+    def fetch_json(self, uri_path, query_params=None):
+        """
+        Makes a GET request to Trello API, retrying it on rate limit and server errors.
+        :param uri_path: path of the resource (e.g. /boards/<board_id>).
+        :param query_params: dict with the query parameters.
+        :return: decoded JSON response.
+        """
+        params = {"key": self.api_key, "token": self.token}
+        if query_params:
+            params.update(query_params)
+        url = u"{0}/{1}".format(self.api_url, uri_path.lstrip(u"/"))
+        return self._get(url, params)
+
+    # Fetches several resources from Trello API
+    def fetch_batch(self, requests_):
+        """
+        Fetches several resources. If batching is enabled, they are fetched with requests to Trello /batch
+        endpoint (each one of them with up to BATCH_SIZE resources) and the resources whose response in the batch
+        is a rate limit or server error are fetched again one by one, with retries. Otherwise, they are fetched
+        concurrently.
+        :param requests_: list of tuples with the path of each resource and its query parameters (dict).
+        :return: list with the decoded JSON response of each resource, in the same order as requests_.
+        """
+        if not self.batch:
+            jobs = {
+                request_index: functools.partial(self.fetch_json, uri_path, query_params)
+                for request_index, (uri_path, query_params) in enumerate(requests_)
+            }
+            responses = dict(self.fetch_all(jobs))
+            return [responses[request_index] for request_index in range(len(requests_))]
+
+        responses = []
+        for first_request_index in range(0, len(requests_), TrelloFetcher.BATCH_SIZE):
+            batch_requests = requests_[first_request_index:first_request_index + TrelloFetcher.BATCH_SIZE]
+            urls = [
+                u"/{0}?{1}".format(uri_path.lstrip(u"/"), urlencode(sorted((query_params or {}).items())))
+                for uri_path, query_params in batch_requests
+            ]
+            # Each request of the batch counts for the rate limit
+            for _url in urls[1:]:
+                self.token_bucket.acquire()
+            batch_responses = self._get(
+                u"{0}/batch".format(self.api_url), {"key": self.api_key, "token": self.token, "urls": u",".join(urls)}
+            )
+            for (uri_path, query_params), url, batch_response in zip(batch_requests, urls, batch_responses):
+                if "200" in batch_response:
+                    responses.append(batch_response["200"])
+                    continue
+                status_code = self._get_batch_response_status_code(batch_response)
+                if status_code is None or not (status_code == 429 or status_code >= 500):
+                    raise requests.HTTPError(u"Error in batch request {0}: {1}".format(url, batch_response))
+                instrumentation.count("http.batch_refetches")
+                responses.append(self.fetch_json(uri_path, query_params))
+        return responses
+
+    # Status code of a response of a /batch request: its only key (e.g. {"429": ...}) or its statusCode attribute
+    @staticmethod
+    def _get_batch_response_status_code(batch_response):
+        if not isinstance(batch_response, dict):
+            return None
+        status_code = batch_response.get("statusCode")
+        if status_code is None and len(batch_response) == 1:
+            status_code = list(batch_response.keys())[0]
+        try:
+            return int(status_code)
+        except (TypeError, ValueError):
+            return None
+
+    # Makes a GET request, retrying it on rate limit and server errors
+    def _get(self, url, params):
+        retry = 0
+        while True:
+            self.token_bucket.acquire()
+            request_start_time = time.time()
+            response = self.session.get(url, params=params, headers={"Accept": "application/json"},
+                                        timeout=self.timeout)
+            instrumentation.record_http_request(
+                response.status_code, len(response.content), time.time() - request_start_time
+            )
+            if not self._must_retry(response) or retry >= self.max_retries:
+                response.raise_for_status()
+                return response.json()
+            instrumentation.count("http.retries")
+            time.sleep(self._get_retry_wait_time(response, retry))
+            retry += 1
+
+    # Runs several fetching jobs concurrently
+    def fetch_all(self, jobs):
+        """
+        Runs fetching jobs concurrently with at most self.concurrency simultaneous jobs.
+        :param jobs: dict of callables without parameters indexed by a key.
+        :return: generator of tuples (key, result of the job) in the order the jobs are finished.
+        """
+        if not jobs:
+            return
+
+        def run_job(key):
+            return key, jobs[key]()
+
+        pool = ThreadPool(processes=min(self.concurrency, len(jobs)))
+        try:
+            for key, result in pool.imap_unordered(run_job, list(jobs.keys())):
+                yield key, result
+        finally:
+            pool.close()
+            pool.join()
+
+    # Informs if a request must be retried
+    @staticmethod
+    def _must_retry(response):
+        return response.status_code == 429 or response.status_code >= 500
+
+    # Time to wait before retrying a request
+    def _get_retry_wait_time(self, response, retry):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** retry)
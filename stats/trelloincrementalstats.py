@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import math
+import os
+
+from stats.trellocumulativeflow import CumulativeFlow, get_day
+from stats.trellolisttransitions import iso_dates_to_timestamps
+from stats.trelloquantiles import QuantileSketch
+from stats.trellothroughput import Throughput
+
+# Types of the actions that make incremental stats compute a card again from all its actions
+CARD_RECOMPUTING_ACTION_TYPES = ["createCard", "updateComment", "deleteComment"]
+
+
+# Count, sum and sum of squares of a set of values.
+# A value can be closed (a fixed number) or open (a fixed number plus the time elapsed since a timestamp, e.g. the
+# time a card has been in its current list). Mean and standard deviation can be computed at any moment without
+# keeping the values and values can be removed.
+class RunningMoments(object):
+
+    def __init__(self, moments=None):
+        if moments is None:
+            moments = {"count": 0, "sum": 0.0, "sum_of_squares": 0.0,
+                       "open_count": 0, "open_sum": 0.0, "open_sum_of_squares": 0.0}
+        self.moments = moments
+
+    # Adds (or removes if sign is -1) a value
+    def add(self, value, open_since=None, sign=1):
+        """
+        Adds a value.
+        :param value: closed part of the value.
+        :param open_since: if not None, the value grows with the time elapsed since this timestamp.
+        :param sign: 1 to add the value, -1 to remove it.
+        """
+        if open_since is None:
+            self.moments["count"] += sign
+            self.moments["sum"] += sign * value
+            self.moments["sum_of_squares"] += sign * value * value
+        else:
+            # value(now) = value - open_since + now
+            shifted_value = value - open_since
+            self.moments["open_count"] += sign
+            self.moments["open_sum"] += sign * shifted_value
+            self.moments["open_sum_of_squares"] += sign * shifted_value * shifted_value
+
+    def count(self):
+        return self.moments["count"] + self.moments["open_count"]
+
+    def mean(self, now):
+        count = self.count()
+        if count == 0:
+            return float("nan")
+        return self._sum(now) / count
+
+    def std(self, now):
+        count = self.count()
+        if count == 0:
+            return float("nan")
+        mean = self._sum(now) / count
+        return math.sqrt(max(0.0, self._sum_of_squares(now) / count - mean * mean))
+
+    def _sum(self, now):
+        return self.moments["sum"] + self.moments["open_sum"] + self.moments["open_count"] * now
+
+    def _sum_of_squares(self, now):
+        return self.moments["sum_of_squares"] + self.moments["open_sum_of_squares"] +\
+            2 * now * self.moments["open_sum"] + self.moments["open_count"] * now * now
+
+
+# Board stats that are updated only with the card actions that are new since the last run.
+# The state (aggregates, the summary of each card and the ids of the applied actions) is stored in a JSON file.
+# An action is new if it has not been applied, not if it is newer than the last applied one: each type of action is
+# fetched in its own requests, so an action can be fetched after newer actions of other types.
+# Timestamps are stored relative to the time of the first run to keep the sums of squares small.
+# Quantile sketches of the closed times (in hours) are stored too and updated as the moments. The open times (that
+# grow with the current time) are added to copies of them when they are read.
+# The number of cards that entered and left each list and that reached the done list each day are stored too, so the
+# cumulative flow and the throughput do not need the movements of all the cards.
+class IncrementalBoardStats(object):
+
+    STATE_FILE_NAME = u"incremental_stats.json"
+
+    # Changes in this version must invalidate stored states
+    STATE_VERSION = 7
+
+    def __init__(self, cache_dir, board_id):
+        self.state_file_path = os.path.join(cache_dir, board_id, self.__class__.STATE_FILE_NAME)
+        self.state = None
+        self.time_by_list_sketches = None
+        self.lead_time_sketch = None
+        self.cycle_time_sketch = None
+        self._sketches_by_timestamp = {}
+        if os.path.exists(self.state_file_path):
+            with io.open(self.state_file_path, "r", encoding="utf-8") as state_file:
+                self.state = json.loads(state_file.read())
+
+    # Saves the state
+    def save(self):
+        self.state["time_by_list_sketches"] = [sketch.to_dict() for sketch in self.time_by_list_sketches]
+        self.state["lead_time_sketch"] = self.lead_time_sketch.to_dict()
+        self.state["cycle_time_sketch"] = self.cycle_time_sketch.to_dict()
+        state_dir = os.path.dirname(self.state_file_path)
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        with io.open(self.state_file_path, "w", encoding="utf-8") as state_file:
+            state_file.write(json.dumps(self.state) + u"\n")
+
+    # Updates the stats with the actions that are new since the last update
+    def update(self, stat_extractor, now_timestamp):
+        """
+        Applies the new card actions of the board snapshot of stat_extractor and updates the aggregates of the
+        cards that have changed.
+        :param stat_extractor: TrelloStatsExtractor with the board data and the configuration.
+        :param now_timestamp: current UNIX timestamp.
+        """
+        self.stat_extractor = stat_extractor
+        snapshot = stat_extractor.snapshot
+        self.list_indices = {list_.id: list_index for list_index, list_ in enumerate(stat_extractor.lists)}
+        self.done_list_index = self.list_indices[stat_extractor.done_list.id]
+        self.cycle_list_indices = [self.list_indices[list_id] for list_id in stat_extractor.cycle_lists_dict]
+
+        # If the state is not compatible with the current configuration, all the stats must be computed again
+        state_settings = self._get_settings()
+        if self.state is None or self.state["settings"] != state_settings:
+            self.state = self._new_state(state_settings, now_timestamp)
+
+        self.time_by_list_sketches = [
+            QuantileSketch.from_dict(sketch_dict) for sketch_dict in self.state["time_by_list_sketches"]
+        ]
+        self.lead_time_sketch = QuantileSketch.from_dict(self.state["lead_time_sketch"])
+        self.cycle_time_sketch = QuantileSketch.from_dict(self.state["cycle_time_sketch"])
+        self._sketches_by_timestamp = {}
+
+        # New actions of each card in chronological order
+        applied_action_ids = set(self.state["applied_action_ids"])
+        new_actions_by_card = {}
+        for action in reversed(snapshot.actions_json):
+            card_data = action["data"].get("card")
+            if card_data is not None and action["id"] not in applied_action_ids:
+                new_actions_by_card.setdefault(card_data["id"], []).append(action)
+
+        card_is_active_function = stat_extractor.configuration.card_is_active_function
+        card_ids = set()
+        for card in snapshot.cards:
+            card_ids.add(card.id)
+            card_state = self.state["cards"].get(card.id)
+            card_is_active = bool(card_is_active_function(card))
+            card_new_actions = new_actions_by_card.get(card.id, [])
+
+            # Only cards with new actions or with changes in their attributes are updated
+            if card_state is not None and not card_new_actions and card_state["active"] == card_is_active and\
+                    card_state["idList"] == card.idList and card_state["members"] == card.member_ids:
+                continue
+
+            if card_state is not None:
+                self._add_card(card_state, sign=-1)
+                # Actions older than the last applied one, a creation action or the edition or deletion of a comment
+                # change what has already been computed, so the card is computed again
+                if card_new_actions and (
+                        card_new_actions[0]["date"] < card_state["last_action_date"] or
+                        any(action["type"] in CARD_RECOMPUTING_ACTION_TYPES for action in card_new_actions)):
+                    card_state = None
+
+            if card_state is None:
+                card_state = self._new_card_state(card)
+                self.state["cards"][card.id] = card_state
+                # All the actions of a new card must be applied
+                card_new_actions = card.movement_actions + card.comment_actions
+
+            self._apply_card_actions(card_state, card_new_actions)
+            card_state["active"] = card_is_active
+            card_state["idList"] = card.idList
+            card_state["members"] = card.member_ids
+            self._add_card(card_state, sign=1)
+
+        # Cards that are not in the board anymore
+        for card_id in list(self.state["cards"].keys()):
+            if card_id not in card_ids:
+                self._add_card(self.state["cards"][card_id], sign=-1)
+                del self.state["cards"][card_id]
+
+        self.state["applied_action_ids"] = [action["id"] for action in snapshot.actions_json]
+
+    # Settings that must not change between runs to use the stored state
+    def _get_settings(self):
+        configuration = self.stat_extractor.configuration
+        return {
+            "version": self.__class__.STATE_VERSION,
+            "lists": [list_.id for list_ in self.stat_extractor.lists],
+            "done_list": self.stat_extractor.done_list.id,
+            "cycle_lists": sorted(self.stat_extractor.cycle_lists_dict.keys()),
+            "card_action_filter": configuration.card_action_filter,
+            "card_is_active_function": configuration.card_is_active_function_code,
+            "spent_estimated_regex": configuration.spent_estimated_time_card_comment_regex
+        }
+
+    # Empty state
+    def _new_state(self, state_settings, now_timestamp):
+        num_lists = len(self.stat_extractor.lists)
+        return {
+            "settings": state_settings,
+            "reference_timestamp": now_timestamp,
+            "applied_action_ids": [],
+            "cards": {},
+            "time_by_list": [RunningMoments().moments for _list_index in range(num_lists)],
+            "forward_movements_by_list": [0] * num_lists,
+            "backward_movements_by_list": [0] * num_lists,
+            "lead_time": RunningMoments().moments,
+            "cycle_time": RunningMoments().moments,
+            "time_by_list_sketches": [QuantileSketch().to_dict() for _list_index in range(num_lists)],
+            "lead_time_sketch": QuantileSketch().to_dict(),
+            "cycle_time_sketch": QuantileSketch().to_dict(),
+            "list_events_by_day": {},
+            "done_by_day": {},
+            "movements_by_member": {},
+            "spent_month_time_by_user": {},
+            "estimated_month_time_by_user": {},
+            "spent_week_time_by_user": {},
+            "estimated_week_time_by_user": {}
+        }
+
+    # Summary of a card before applying its actions
+    def _new_card_state(self, card):
+        num_lists = len(self.stat_extractor.lists)
+        if card.creation_action:
+            creation_timestamp = iso_dates_to_timestamps([card.creation_action["date"]])[0]
+        else:
+            creation_timestamp = float(int(card.id[0:8], 16))
+        return {
+            "created": creation_timestamp - self.state["reference_timestamp"],
+            "list_times": [0.0] * num_lists,
+            "forward_moves": [0] * num_lists,
+            "backward_moves": [0] * num_lists,
+            "num_movements": 0,
+            "last_list": None,
+            "last_movement": None,
+            "closed_intervals": [],
+            "last_action_date": u"",
+            "spent_estimated": {"total": {"spent": None, "estimated": None}, "by_user": {}},
+            "active": False,
+            "idList": None,
+            "members": []
+        }
+
+    # Applies the movements and comments of a card in chronological order
+    def _apply_card_actions(self, card_state, actions):
+        card_action_filter = self.stat_extractor.configuration.card_action_filter
+        spent_estimated_regex = self.stat_extractor.configuration.spent_estimated_time_card_comment_regex
+        for action in actions:
+            card_state["last_action_date"] = max(card_state["last_action_date"], action["date"])
+            if card_action_filter and not _date_is_in_interval(action["date"][0:10], card_action_filter):
+                continue
+            if action["type"] == "updateCard":
+                self._apply_card_movement(card_state, action)
+            elif action["type"] == "commentCard" and spent_estimated_regex:
+                self.stat_extractor._add_comment_spent_estimated(card_state["spent_estimated"], action)
+
+    # Adds the interval the card has been in the source list of a movement
+    def _apply_card_movement(self, card_state, action):
+        movement_timestamp = iso_dates_to_timestamps([action["date"]])[0] - self.state["reference_timestamp"]
+        source_list_index = self.list_indices.get(action["data"]["listBefore"]["id"])
+        destination_list_index = self.list_indices.get(action["data"]["listAfter"]["id"])
+        interval_start = card_state["last_movement"] if card_state["num_movements"] else card_state["created"]
+        if source_list_index is not None:
+            card_state["list_times"][source_list_index] += movement_timestamp - interval_start
+            card_state["closed_intervals"].append([source_list_index, interval_start, movement_timestamp])
+            if destination_list_index is not None and destination_list_index > source_list_index:
+                card_state["forward_moves"][source_list_index] += 1
+            else:
+                card_state["backward_moves"][source_list_index] += 1
+        card_state["num_movements"] += 1
+        card_state["last_list"] = destination_list_index
+        card_state["last_movement"] = movement_timestamp
+
+    # Current list of the card and since when
+    def _get_card_last_list(self, card_state):
+        if card_state["num_movements"]:
+            return card_state["last_list"], card_state["last_movement"]
+        return self.list_indices.get(card_state["idList"]), card_state["created"]
+
+    # Open list of the card (the one where time is still being counted) and since when
+    def _get_card_open_list(self, card_state):
+        open_list_index, open_since = self._get_card_last_list(card_state)
+        if open_list_index is None or open_list_index == self.done_list_index:
+            return None, None
+        return open_list_index, open_since
+
+    # Adds (or removes if sign is -1) the contribution of a card to the aggregates
+    def _add_card(self, card_state, sign):
+        # Throughput counts all the cards in the done list, active or not
+        last_list_index, last_since = self._get_card_last_list(card_state)
+        if last_list_index == self.done_list_index:
+            done_day_key = str(self._day(last_since))
+            _add_to_period(self.state["done_by_day"], done_day_key, sign)
+            if self.state["done_by_day"][done_day_key] == 0:
+                del self.state["done_by_day"][done_day_key]
+
+        if not card_state["active"]:
+            return
+
+        open_list_index, open_since = self._get_card_open_list(card_state)
+        for list_index, list_time in enumerate(card_state["list_times"]):
+            RunningMoments(self.state["time_by_list"][list_index]).add(
+                list_time, open_since if list_index == open_list_index else None, sign
+            )
+            self.state["forward_movements_by_list"][list_index] += sign * card_state["forward_moves"][list_index]
+            self.state["backward_movements_by_list"][list_index] += sign * card_state["backward_moves"][list_index]
+            if list_index != open_list_index:
+                self.time_by_list_sketches[list_index].add(list_time / 3600.0, sign)
+
+        # Lead and cycle time of done cards
+        if card_state["idList"] == self.stat_extractor.done_list.id:
+            lead_time = sum(card_state["list_times"])
+            RunningMoments(self.state["lead_time"]).add(lead_time, open_since, sign)
+            cycle_time = sum(card_state["list_times"][list_index] for list_index in self.cycle_list_indices)
+            cycle_open_since = open_since if open_list_index in self.cycle_list_indices else None
+            RunningMoments(self.state["cycle_time"]).add(cycle_time, cycle_open_since, sign)
+            if open_since is None:
+                self.lead_time_sketch.add(lead_time / 3600.0, sign)
+            if cycle_open_since is None:
+                self.cycle_time_sketch.add(cycle_time / 3600.0, sign)
+
+        # Days the card entered and left each list
+        for list_index, interval_start, interval_end in card_state["closed_intervals"]:
+            entry_day = self._day(interval_start)
+            self._add_list_event(entry_day, list_index, sign)
+            self._add_list_event(max(entry_day, self._day(interval_end)), list_index, -sign)
+        if last_list_index is not None:
+            self._add_list_event(self._day(last_since), last_list_index, sign)
+
+        # Movements of the tasks of each member
+        for member_id in card_state["members"]:
+            member_movements = self.state["movements_by_member"].setdefault(member_id, {"forward": 0, "backward": 0})
+            member_movements["forward"] += sign * sum(card_state["forward_moves"])
+            member_movements["backward"] += sign * sum(card_state["backward_moves"])
+
+        # Spent and estimated times of each member
+        for member_id, user_times in card_state["spent_estimated"]["by_user"].items():
+            for period_key, times_key in (("month", "by_month"), ("week", "by_week")):
+                spent_times = self.state["spent_{0}_time_by_user".format(period_key)].setdefault(member_id, {})
+                estimated_times = self.state["estimated_{0}_time_by_user".format(period_key)].setdefault(member_id, {})
+                for period, period_times in user_times[times_key].items():
+                    _add_to_period(spent_times, period, sign * period_times["spent"])
+                    _add_to_period(estimated_times, period, sign * period_times["estimated"])
+
+    # Adds (or removes if sign is -1) a card that entered a list (or left it if sign is -1) in a day
+    def _add_list_event(self, day, list_index, sign):
+        day_key = str(day)
+        day_events = self.state["list_events_by_day"].setdefault(day_key, [0] * len(self.stat_extractor.lists))
+        day_events[list_index] += sign
+        if not any(day_events):
+            del self.state["list_events_by_day"][day_key]
+
+    # Time (in seconds) of a card in each list
+    def get_card_times_by_list(self, card_id, now_timestamp):
+        card_state = self.state["cards"][card_id]
+        open_list_index, open_since = self._get_card_open_list(card_state)
+        list_times = list(card_state["list_times"])
+        if open_list_index is not None:
+            list_times[open_list_index] += self._relative(now_timestamp) - open_since
+        return list_times
+
+    # Stats of a card in the format returned by SnapshotCard.get_stats_by_list
+    def get_card_stats_by_list(self, card_id, now_timestamp):
+        card_state = self.state["cards"][card_id]
+        list_times = self.get_card_times_by_list(card_id, now_timestamp)
+        return {
+            list_.id: {
+                "time": list_times[list_index] / 3600.0,
+                "forward_moves": card_state["forward_moves"][list_index],
+                "backward_moves": card_state["backward_moves"][list_index]
+            }
+            for list_index, list_ in enumerate(self.stat_extractor.lists)
+        }
+
+    # Spent and estimated times of a card in the format returned by TrelloStatsExtractor._get_spent_estimated_by_card
+    def get_card_spent_estimated(self, card_id):
+        return self.state["cards"][card_id]["spent_estimated"]
+
+    # Summary (avg, std_dev and percentiles in hours) of the time of the active cards in each list
+    def get_time_summary_by_list(self, now_timestamp):
+        relative_now = self._relative(now_timestamp)
+        time_by_list_sketches = self._get_sketches(now_timestamp)["time_by_list"]
+        return {
+            list_.id: self._get_summary(
+                self.state["time_by_list"][list_index], relative_now, time_by_list_sketches[list_index]
+            )
+            for list_index, list_ in enumerate(self.stat_extractor.lists)
+        }
+
+    # Summary (avg, std_dev and percentiles in hours) of the lead time of done cards
+    def get_lead_time_summary(self, now_timestamp):
+        return self._get_summary(
+            self.state["lead_time"], self._relative(now_timestamp), self._get_sketches(now_timestamp)["lead_time"]
+        )
+
+    # Summary (avg, std_dev and percentiles in hours) of the cycle time of done cards
+    def get_cycle_time_summary(self, now_timestamp):
+        return self._get_summary(
+            self.state["cycle_time"], self._relative(now_timestamp), self._get_sketches(now_timestamp)["cycle_time"]
+        )
+
+    # Quantile sketches with the closed times and the open times of the cards at a moment
+    def _get_sketches(self, now_timestamp):
+        sketches = self._sketches_by_timestamp.get(now_timestamp)
+        if sketches is not None:
+            return sketches
+
+        relative_now = self._relative(now_timestamp)
+        time_by_list_sketches = [sketch.copy() for sketch in self.time_by_list_sketches]
+        lead_time_sketch = self.lead_time_sketch.copy()
+        cycle_time_sketch = self.cycle_time_sketch.copy()
+        for card_state in self.state["cards"].values():
+            if not card_state["active"]:
+                continue
+            open_list_index, open_since = self._get_card_open_list(card_state)
+            if open_list_index is None:
+                continue
+            open_time = relative_now - open_since
+            time_by_list_sketches[open_list_index].add((card_state["list_times"][open_list_index] + open_time) / 3600.0)
+            if card_state["idList"] == self.stat_extractor.done_list.id:
+                lead_time_sketch.add((sum(card_state["list_times"]) + open_time) / 3600.0)
+                if open_list_index in self.cycle_list_indices:
+                    cycle_time = sum(card_state["list_times"][list_index] for list_index in self.cycle_list_indices)
+                    cycle_time_sketch.add((cycle_time + open_time) / 3600.0)
+
+        sketches = {"time_by_list": time_by_list_sketches, "lead_time": lead_time_sketch, "cycle_time": cycle_time_sketch}
+        self._sketches_by_timestamp = {now_timestamp: sketches}
+        return sketches
+
+    # Number of active cards in each list at the end of each day
+    def get_cumulative_flow(self, now_timestamp):
+        events_by_day = {int(day): day_events for day, day_events in self.state["list_events_by_day"].items()}
+        return CumulativeFlow.from_events_by_day(self.stat_extractor.lists, events_by_day, now_timestamp)
+
+    # Number of cards (active or not) that reached the done list each day since first_day
+    def get_throughput(self, first_day, now_timestamp):
+        done_by_day = {int(day): num_cards for day, num_cards in self.state["done_by_day"].items()}
+        return Throughput.from_done_by_day(done_by_day, first_day, now_timestamp)
+
+    # Forward and backward movements that have each list as source
+    def get_movements_by_list(self):
+        forward_movements_by_list = {}
+        backward_movements_by_list = {}
+        for list_index, list_ in enumerate(self.stat_extractor.lists):
+            forward_movements_by_list[list_.id] = self.state["forward_movements_by_list"][list_index]
+            backward_movements_by_list[list_.id] = self.state["backward_movements_by_list"][list_index]
+        return forward_movements_by_list, backward_movements_by_list
+
+    # Forward and backward movements of the cards of each member
+    def get_movements_by_member(self):
+        return self.state["movements_by_member"]
+
+    # Spent or estimated (measure) times of each member by month or week (period)
+    def get_times_by_user(self, measure, period):
+        return self.state["{0}_{1}_time_by_user".format(measure, period)]
+
+    @staticmethod
+    def _get_summary(moments, relative_now, sketch):
+        running_moments = RunningMoments(moments)
+        return {
+            "avg": running_moments.mean(relative_now) / 3600.0,
+            "std_dev": running_moments.std(relative_now) / 3600.0,
+            "percentiles": sketch.percentiles(),
+            "sketch": sketch
+        }
+
+    def _relative(self, timestamp):
+        return timestamp - self.state["reference_timestamp"]
+
+    # Day of a timestamp relative to the reference timestamp
+    def _day(self, relative_timestamp):
+        return get_day(relative_timestamp + self.state["reference_timestamp"])
+
+
+# Adds a value to the value of a period
+def _add_to_period(values_by_period, period, value):
+    values_by_period[period] = values_by_period.get(period, 0) + value
+
+
+# Checks if a date (YYYY-MM-DD) is in a date interval [since, before]
+def _date_is_in_interval(date, date_interval):
+    since, before = date_interval
+    if since and date < since:
+        return False
+    if before and date > before:
+        return False
+    return True
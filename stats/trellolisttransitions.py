@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+from stats.trellocardset import get_card_positions
+
+
+# Type of each one of the movements of a card between two lists
+TRANSITION_DTYPE = numpy.dtype([
+    ("card", numpy.int32),
+    ("from_list", numpy.int32),
+    ("to_list", numpy.int32),
+    ("timestamp", numpy.float64)
+])
+
+# Index of the lists that are not in the board (e.g. the card was moved from other board)
+UNKNOWN_LIST = -1
+
+# Trello dates are always in UTC with the format 2016-03-01T10:00:00.000Z
+_EPOCH = numpy.datetime64("1970-01-01T00:00:00.000", "ms")
+
+
+# Movements of a set of cards between the lists of a board stored in a NumPy structured array.
+# Time each card has been in each list and the forward and backward movements that have each list as source are
+# computed with vectorized operations for all the cards at once.
+class ListTransitions(object):
+
+    def __init__(self, cards, lists, done_list, card_movements_filter=None, transitions_builder=None,
+                 card_indices=None):
+        """
+        Loads the movements of the cards.
+        :param cards: board cards (SnapshotCard objects) whose movements are loaded.
+        :param lists: board lists. The position of each list is its order.
+        :param done_list: list that is considered the "done" list. Time in the done list is not taken in account.
+        :param card_movements_filter: list with two dates [since, before] (YYYY-MM-DD) that filter the movements.
+        :param transitions_builder: optional TransitionsBuilder with the movements of the cards already loaded (e.g.
+        while the board was streamed). If present, the movement actions of the cards are not read.
+        :param card_indices: ascending positions of the cards in the cards of transitions_builder. If None, the cards
+        of transitions_builder are these cards. Ignored if there is no transitions_builder.
+        """
+        self.cards = cards
+        self.lists = lists
+        self.num_cards = len(cards)
+        self.num_lists = len(lists)
+
+        self.list_indices = {list_.id: list_index for list_index, list_ in enumerate(lists)}
+        self.done_list_index = self.list_indices[done_list.id]
+
+        self.creation_timestamps = _cards_creation_timestamps(cards)
+        self.current_list_indices = numpy.array(
+            [self.list_indices.get(card.idList, UNKNOWN_LIST) for card in cards], dtype=numpy.int32
+        )
+
+        if transitions_builder is None:
+            transitions_builder = TransitionsBuilder(self.list_indices)
+            for card_index, card in enumerate(self.cards):
+                for action in card.movement_actions:
+                    transitions_builder.add(card_index, action)
+            card_indices = None
+        self.transitions = transitions_builder.build(card_movements_filter, card_indices)
+
+        # Results of compute
+        self.time_by_list = None
+        self.forward_moves_by_list = None
+        self.backward_moves_by_list = None
+
+    # Intervals the cards have been in each list
+    def get_list_intervals(self):
+        """
+        Each movement closes the interval the card has been in its source list and each card has an open interval in
+        its current list. Intervals start in the previous movement of the card or in the card creation.
+        :return: tuple of arrays (card indices, list indices, start timestamps, end timestamps). Closed intervals go
+        first, in the order of the movements, and then the open interval of each card, whose end is NaN.
+        """
+        card_indices = self.transitions["card"].astype(numpy.int64)
+        to_list_indices = self.transitions["to_list"]
+        timestamps = self.transitions["timestamp"]
+
+        is_first_transition = numpy.ones(len(self.transitions), dtype=bool)
+        is_first_transition[1:] = card_indices[1:] != card_indices[:-1]
+        interval_starts = numpy.empty(len(self.transitions), dtype=numpy.float64)
+        interval_starts[1:] = timestamps[:-1]
+        interval_starts[is_first_transition] = self.creation_timestamps[card_indices[is_first_transition]]
+
+        is_last_transition = numpy.ones(len(self.transitions), dtype=bool)
+        is_last_transition[:-1] = card_indices[:-1] != card_indices[1:]
+        last_list_indices = self.current_list_indices.copy()
+        last_list_indices[card_indices[is_last_transition]] = to_list_indices[is_last_transition]
+        last_interval_starts = self.creation_timestamps.copy()
+        last_interval_starts[card_indices[is_last_transition]] = timestamps[is_last_transition]
+
+        return (
+            numpy.concatenate([card_indices, numpy.arange(self.num_cards, dtype=numpy.int64)]),
+            numpy.concatenate([self.transitions["from_list"], last_list_indices]).astype(numpy.int64),
+            numpy.concatenate([interval_starts, last_interval_starts]),
+            numpy.concatenate([timestamps.astype(numpy.float64), numpy.full(self.num_cards, numpy.nan)])
+        )
+
+    # Computes the time each card has been in each list and its forward and backward movements
+    def compute(self, now_timestamp, time_unit="hours"):
+        """
+        Computes the matrices (cards x lists) self.time_by_list, self.forward_moves_by_list and
+        self.backward_moves_by_list.
+        :param now_timestamp: current UNIX timestamp. Time in the current list of each card is counted until it.
+        :param time_unit: seconds, minutes, hours or days.
+        """
+        num_cells = self.num_cards * self.num_lists
+        from_list_indices = self.transitions["from_list"]
+        to_list_indices = self.transitions["to_list"]
+
+        # Time in the done list is not counted while the card is still there
+        interval_card_indices, interval_list_indices, interval_starts, interval_ends = self.get_list_intervals()
+        is_open = numpy.isnan(interval_ends)
+        is_counted = (interval_list_indices != UNKNOWN_LIST) & \
+            ~(is_open & (interval_list_indices == self.done_list_index))
+        interval_cells = interval_card_indices[is_counted] * self.num_lists + interval_list_indices[is_counted]
+        interval_times = numpy.where(is_open, now_timestamp, interval_ends) - interval_starts
+        time_by_list = numpy.bincount(interval_cells, weights=interval_times[is_counted], minlength=num_cells)
+
+        known_source = from_list_indices != UNKNOWN_LIST
+        source_cells = self.transitions["card"].astype(numpy.int64)[known_source] * self.num_lists + \
+            from_list_indices[known_source]
+
+        # Movements are forward if the destination list is after the source list
+        moved_forward = (to_list_indices > from_list_indices)[known_source]
+        forward_moves_by_list = numpy.bincount(source_cells[moved_forward], minlength=num_cells)
+        backward_moves_by_list = numpy.bincount(source_cells[~moved_forward], minlength=num_cells)
+
+        seconds_by_time_unit = {"seconds": 1.0, "minutes": 60.0, "hours": 3600.0, "days": 86400.0}[time_unit]
+        self.time_by_list = time_by_list.reshape(self.num_cards, self.num_lists) / seconds_by_time_unit
+        self.forward_moves_by_list = forward_moves_by_list.reshape(self.num_cards, self.num_lists)
+        self.backward_moves_by_list = backward_moves_by_list.reshape(self.num_cards, self.num_lists)
+
+    # Stats of a card in the format returned by SnapshotCard.get_stats_by_list
+    def get_card_stats_by_list(self, card_index):
+        return {
+            list_.id: {
+                "time": float(self.time_by_list[card_index, list_index]),
+                "forward_moves": int(self.forward_moves_by_list[card_index, list_index]),
+                "backward_moves": int(self.backward_moves_by_list[card_index, list_index])
+            }
+            for list_index, list_ in enumerate(self.lists)
+        }
+
+
+# Movements of cards between lists, added one by one and stored as numbers, so the actions can be discarded as
+# soon as they are added.
+class TransitionsBuilder(object):
+
+    # Movements are converted to a structured array each time this number of them have been added
+    CHUNK_SIZE = 10000
+
+    def __init__(self, list_indices):
+        """
+        :param list_indices: dict with the position of each list id in the board lists.
+        """
+        self.list_indices = list_indices
+        self.chunks = []
+        self.num_transitions = 0
+        self._clear_pending()
+
+    # Adds a movement (updateCard:idList action) of the card with position card_index
+    def add(self, card_index, action):
+        self.card_indices.append(card_index)
+        self.from_list_indices.append(self.list_indices.get(action["data"]["listBefore"]["id"], UNKNOWN_LIST))
+        self.to_list_indices.append(self.list_indices.get(action["data"]["listAfter"]["id"], UNKNOWN_LIST))
+        self.dates.append(action["date"])
+        self.num_transitions += 1
+        if len(self.card_indices) >= self.__class__.CHUNK_SIZE:
+            self._flush()
+
+    def __len__(self):
+        return self.num_transitions
+
+    # Structured array with all the movements sorted by card and timestamp
+    def build(self, card_movements_filter=None, card_indices=None):
+        """
+        :param card_movements_filter: list with two dates [since, before] (YYYY-MM-DD) that filter the movements.
+        :param card_indices: optional ascending array of card indices. If present, only the movements of these cards
+        are kept and the card of each movement is the position of its card index in this array.
+        :return: structured array of TRANSITION_DTYPE.
+        """
+        self._flush()
+        transitions = numpy.concatenate(self.chunks) if self.chunks else numpy.empty(0, dtype=TRANSITION_DTYPE)
+
+        if card_indices is not None:
+            card_positions = get_card_positions(card_indices, transitions["card"])
+            transitions = transitions[card_positions >= 0]
+            transitions["card"] = card_positions[card_positions >= 0]
+
+        if card_movements_filter:
+            transitions = transitions[_date_interval_mask(transitions["timestamp"], card_movements_filter)]
+
+        return transitions[numpy.lexsort((transitions["timestamp"], transitions["card"]))]
+
+    # Converts the movements added since the last chunk to a new chunk
+    def _flush(self):
+        if not self.card_indices:
+            return
+        chunk = numpy.empty(len(self.card_indices), dtype=TRANSITION_DTYPE)
+        chunk["card"] = self.card_indices
+        chunk["from_list"] = self.from_list_indices
+        chunk["to_list"] = self.to_list_indices
+        chunk["timestamp"] = iso_dates_to_timestamps(self.dates)
+        self.chunks.append(chunk)
+        self._clear_pending()
+
+    def _clear_pending(self):
+        self.card_indices = []
+        self.from_list_indices = []
+        self.to_list_indices = []
+        self.dates = []
+
+
+# Converts Trello ISO dates (e.g. 2016-03-01T10:00:00.000Z) to UNIX timestamps
+def iso_dates_to_timestamps(iso_dates):
+    # NumPy does not accept the timezone designator, but all Trello dates are in UTC
+    datetimes = numpy.array([iso_date[0:23] for iso_date in iso_dates], dtype="datetime64[ms]")
+    return (datetimes - _EPOCH).astype(numpy.float64) / 1000.0
+
+
+# Mask of the timestamps whose date is in a date interval [since, before]
+def _date_interval_mask(timestamps, date_interval):
+    days = numpy.floor(timestamps / 86400.0)
+    mask = numpy.ones(len(timestamps), dtype=bool)
+    since, before = date_interval
+    if since:
+        mask &= days >= _date_to_day_number(since)
+    if before:
+        mask &= days <= _date_to_day_number(before)
+    return mask
+
+
+# Number of days since the UNIX epoch of a date (YYYY-MM-DD)
+def _date_to_day_number(date):
+    return (numpy.datetime64(date, "D") - numpy.datetime64("1970-01-01", "D")).astype(numpy.int64)
+
+
+# UNIX timestamps of the creation of the cards
+def _cards_creation_timestamps(cards):
+    # The first 8 hexadecimal digits of the card id are its creation timestamp.
+    # It is used when there is no createCard action (e.g. the card was copied or converted from a checklist item)
+    creation_timestamps = numpy.array([float(int(card.id[0:8], 16)) for card in cards], dtype=numpy.float64)
+    created_card_indices = [card_index for card_index, card in enumerate(cards) if card.creation_action]
+    creation_timestamps[created_card_indices] = iso_dates_to_timestamps(
+        [cards[card_index].creation_action["date"] for card_index in created_card_indices]
+    )
+    return creation_timestamps
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+from printer.printer import Printer
+from stats import instrumentation
+from stats import summary
+from stats.trelloboard import fetch_board_snapshot
+from stats.trelloquantiles import PERCENTILES, QuantileSketch
+
+
+# Configuration of a portfolio of boards
+class PortfolioConfiguration(object):
+
+    def __init__(self, output_dir, censored=False, report_quiet=False, report_gzip=False):
+        """
+        :param output_dir: directory where the portfolio report is written.
+        :param censored: if True, names of boards, members and labels are not shown. The report is also censored if
+        any of its boards is censored.
+        :param report_quiet: if True, the report is not printed in stdout.
+        :param report_gzip: if True, the report is compressed with gzip.
+        """
+        self.output_dir = output_dir
+        self.censored = censored
+        self.report_quiet = report_quiet
+        self.report_gzip = report_gzip
+
+
+# Index of the entities (members or labels) of several boards.
+# Each entity is stored once, so all the boards that have it share the same object.
+class SharedIndex(object):
+
+    def __init__(self, get_key):
+        """
+        :param get_key: function that returns the key of an entity. Entities with the same key are the same entity.
+        """
+        self.get_key = get_key
+        self.entities = []
+        self.entities_by_key = {}
+
+    # Returns the stored entity with the same key than an entity, storing it if it is new
+    def add(self, entity):
+        key = self.get_key(entity)
+        stored_entity = self.entities_by_key.get(key)
+        if stored_entity is None:
+            stored_entity = entity
+            self.entities_by_key[key] = entity
+            self.entities.append(entity)
+        return stored_entity
+
+    def __len__(self):
+        return len(self.entities)
+
+
+# Stats of several boards extracted in the same process.
+# Members and labels are shared by all boards.
+# Stats of each board are added to the aggregates of the portfolio as soon as the board is processed, so boards are
+# not kept in memory.
+class TrelloPortfolio(object):
+
+    def __init__(self, trello_connector, configuration):
+        """
+        :param trello_connector: TrelloConnector used to fetch the boards. None if boards are passed as snapshots.
+        :param configuration: PortfolioConfiguration.
+        """
+        self.trello_connector = trello_connector
+        self.configuration = configuration
+        self.censored = configuration.censored
+
+        self.fetcher = None
+
+        # Members are the same users in all the boards
+        self.members = SharedIndex(lambda member: member.id)
+
+        # Labels are defined in each board: labels with the same name and color in several boards are the same label
+        self.labels = SharedIndex(lambda label: (label.name, label.color))
+        self.labels_by_board_label_id = {}
+
+        # Number of cards of each board
+        self.boards = []
+
+        # Forward and backward movements of the cards of each member in all the boards
+        self.movements_by_member = {}
+
+        # Spent and estimated times by period of time by user in all the boards
+        self.spent_month_time_by_user = {}
+        self.spent_week_time_by_user = {}
+        self.estimated_month_time_by_user = {}
+        self.estimated_week_time_by_user = {}
+
+        # Number of active cards of each label in all the boards
+        self.cards_by_label = {}
+
+        # Quantile sketches of the lead and cycle times of the done cards of all the boards
+        self.lead_time_sketch = QuantileSketch()
+        self.cycle_time_sketch = QuantileSketch()
+
+    # Extracts the stats of a board and adds them to the portfolio
+    def add_board(self, board_configuration, snapshot=None):
+        """
+        Makes the summary of a board and adds its stats to the portfolio.
+        :param board_configuration: TrelloBoardConfiguration of the board.
+        :param snapshot: optional TrelloBoardSnapshot of the board. If not present, it is fetched from Trello API.
+        :return: SummaryCreator of the board.
+        """
+        if snapshot is None:
+            snapshot = self._fetch_snapshot(board_configuration)
+        self._share_entities(snapshot)
+        with instrumentation.timer("portfolio.board"):
+            summary_creator = summary.make(self.trello_connector, board_configuration, snapshot)
+        self._add_board_stats(board_configuration, summary_creator.stat_extractor, summary_creator.stats)
+        return summary_creator
+
+    # Fetches the snapshot of a board. The board index of the connector is shared by all the boards.
+    def _fetch_snapshot(self, board_configuration):
+        if self.fetcher is None:
+            self.fetcher = self.trello_connector.get_fetcher()
+        return fetch_board_snapshot(self.trello_connector, self.fetcher, board_configuration)
+
+    # Replaces the members of a board by the ones of the portfolio and indexes its labels
+    def _share_entities(self, snapshot):
+        snapshot.members = [self.members.add(member) for member in snapshot.members]
+        for label in snapshot.labels:
+            self.labels_by_board_label_id[label.id] = self.labels.add(label)
+
+    # Adds the stats of a board to the aggregates of the portfolio
+    def _add_board_stats(self, board_configuration, stat_extractor, stats):
+        self.censored = self.censored or board_configuration.censored
+
+        self.boards.append({
+            "name": board_configuration.board_name,
+            "cards": len(stats["cards"]),
+            "active_cards": len(stats["active_cards"]),
+            "done_cards": len(stats["done_cards"])
+        })
+
+        for member_id, movements in stats["movements_by_user"].items():
+            member_movements = self.movements_by_member.setdefault(member_id, {"forward": 0, "backward": 0})
+            member_movements["forward"] += movements["forward"]
+            member_movements["backward"] += movements["backward"]
+
+        times_by_user = [
+            (self.spent_month_time_by_user, stat_extractor.spent_month_time_by_user),
+            (self.spent_week_time_by_user, stat_extractor.spent_week_time_by_user),
+            (self.estimated_month_time_by_user, stat_extractor.estimated_month_time_by_user),
+            (self.estimated_week_time_by_user, stat_extractor.estimated_week_time_by_user)
+        ]
+        for portfolio_time_by_user, board_time_by_user in times_by_user:
+            for member_id, times_by_period in board_time_by_user.items():
+                member_times_by_period = portfolio_time_by_user.setdefault(member_id, {})
+                for period, time in times_by_period.items():
+                    member_times_by_period[period] = member_times_by_period.get(period, 0) + time
+
+        for card in stats["active_cards"]:
+            for label_id in card.label_ids:
+                label = self.labels_by_board_label_id.get(label_id)
+                if label is not None:
+                    self.cards_by_label[label.id] = self.cards_by_label.get(label.id, 0) + 1
+
+        self.lead_time_sketch.merge(stats["lead_time"]["sketch"])
+        self.cycle_time_sketch.merge(stats["cycle_time"]["sketch"])
+
+    # Summary of the lead time of the done cards of all the boards
+    def get_lead_time_distribution(self):
+        return _get_distribution(self.lead_time_sketch)
+
+    # Summary of the cycle time of the done cards of all the boards
+    def get_cycle_time_distribution(self):
+        return _get_distribution(self.cycle_time_sketch)
+
+    # Writes the report with the aggregated stats of all the boards
+    def make_report(self):
+        # The report file is removed if the report can not be completed
+        with Printer(
+            u"results_for_portfolio", self.configuration,
+            print_in_stdio=not self.configuration.report_quiet, gzip_output=self.configuration.report_gzip
+        ) as printer:
+            self._print_report(printer)
+        return printer.output_filename
+
+    # Writes the lines of the report of the portfolio
+    def _print_report(self, printer):
+        printer.newline()
+
+        printer.p(u"# Measurements for a portfolio of {0} boards".format(len(self.boards)))
+
+        printer.newline()
+
+        printer.p(u"## Boards")
+        for board_index, board in enumerate(self.boards):
+            printer.p(u"- {0}: {1} tasks ({2} active, {3} in 'done')".format(
+                self._get_board_name(board, board_index), board["cards"], board["active_cards"], board["done_cards"]
+            ))
+        printer.p(u"- {0} members and {1} labels shared by the boards".format(len(self.members), len(self.labels)))
+
+        printer.newline()
+
+        printer.p(u"## Forward/backward movements by username in all the boards")
+        for member in self.members.entities:
+            movements = self.movements_by_member.get(member.id)
+            if movements:
+                printer.p(u"  - Forward movements of {0}'s tasks: {1}".format(self._get_username(member), movements["forward"]))
+                printer.p(u"  - Backward movements of {0}'s tasks: {1}".format(self._get_username(member), movements["backward"]))
+
+        printer.newline()
+
+        self._show_distribution(u"Cycle", self.get_cycle_time_distribution(), printer)
+        self._show_distribution(u"Lead", self.get_lead_time_distribution(), printer)
+
+        periods = [
+            (u"MONTH", self.spent_month_time_by_user, self.estimated_month_time_by_user),
+            (u"WEEK", self.spent_week_time_by_user, self.estimated_week_time_by_user)
+        ]
+        for period_name, spent_time_by_user, estimated_time_by_user in periods:
+            printer.p(u"### Total spent/estimated times for each user per {0} in all the boards (in units given by plugin)".format(period_name))
+            for member in self.members.entities:
+                spent_times = spent_time_by_user.get(member.id, {})
+                estimated_times = estimated_time_by_user.get(member.id, {})
+                printer.p(u"- {0}".format(self._get_username(member)))
+                for period in sorted(spent_times.keys()):
+                    spent_time = spent_times[period]
+                    estimated_time = estimated_times.get(period, 0)
+                    printer.p(u"  - {0}: {1:.2f} / {2:.2f} (diff. {3:.2f})".format(period, spent_time, estimated_time, spent_time-estimated_time))
+            printer.newline()
+
+        printer.p(u"### Number of active cards for each label in all the boards")
+        for label in self.labels.entities:
+            if label.id in self.cards_by_label:
+                printer.p(u"- {0}: {1}".format(self._label_name(label), self.cards_by_label[label.id]))
+
+        printer.newline()
+
+        printer.p(u"--- END OF FILE ---")
+
+    # Shows the distribution of the lead or cycle time
+    @staticmethod
+    def _show_distribution(name, distribution, printer):
+        printer.p(u"## {0}".format(name))
+        if distribution is None:
+            printer.p(u"- There are no tasks in 'done'")
+        else:
+            printer.p(u"- {0} tasks in 'done'".format(distribution["count"]))
+            printer.p(u"- avg: {0:.2f} h, std_dev: {1:.2f}".format(distribution["avg"], distribution["std_dev"]))
+            for percentile in PERCENTILES:
+                printer.p(u"- p{0}: {1:.2f} h".format(percentile, distribution["percentiles"][percentile]))
+        printer.newline()
+
+    # Returns the name of a board
+    def _get_board_name(self, board, board_index):
+        if self.censored:
+            return u"Board {0}".format(board_index + 1)
+        board_name = board["name"]
+        return board_name.decode("utf-8") if isinstance(board_name, bytes) else board_name
+
+    # Returns the member username
+    def _get_username(self, member):
+        if self.censored:
+            return u"User {0}".format(member.id)
+        return member.username.decode("utf-8")
+
+    # Returns the name of a label
+    def _label_name(self, label):
+        if self.censored:
+            return u"Label {0}".format(label.id)
+        return label.name.decode("utf-8")
+
+
+# Count, mean, standard deviation and percentiles of the times of several boards
+def _get_distribution(sketch):
+    if len(sketch) == 0:
+        return None
+    return {
+        "count": len(sketch),
+        "avg": sketch.mean(),
+        "std_dev": sketch.std(),
+        "percentiles": sketch.percentiles()
+    }
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy
+
+
+# Percentiles shown in the reports
+PERCENTILES = [50, 85, 95]
+
+
+# Quantile sketch: histogram of values with logarithmic buckets.
+# Each bucket holds the values between two consecutive powers of gamma, so the value that represents a bucket is at
+# most relative_accuracy away from any value of the bucket. Memory depends on the range of the values (less than a
+# thousand buckets for times between a second and a century with the default accuracy), not on their number.
+# Count, sum and sum of squares are also kept, so mean and standard deviation are exact.
+# Sketches with the same accuracy can be merged (e.g. the sketches of several boards) and values can be removed
+# (e.g. when a card changes between two incremental runs).
+class QuantileSketch(object):
+
+    DEFAULT_RELATIVE_ACCURACY = 0.01
+
+    # Max number of buckets of each sign. If there are more, the ones of the smallest values are collapsed.
+    MAX_BUCKETS = 2048
+
+    # Values whose absolute value is lower than this one are considered zeros
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        """
+        :param relative_accuracy: max relative error of the quantiles (between 0 and 1).
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        # Number of values of each bucket of positive and negative values, indexed by bucket key
+        self.positive_counts = {}
+        self.negative_counts = {}
+        self.zero_count = 0
+
+        self.count = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+
+    # Sketch with some values
+    @staticmethod
+    def from_values(values, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        sketch = QuantileSketch(relative_accuracy)
+        sketch.add_values(values)
+        return sketch
+
+    # Adds (or removes if weight is negative) a value
+    def add(self, value, weight=1):
+        if abs(value) < self.__class__.MIN_VALUE:
+            self.zero_count += weight
+        elif value > 0:
+            self._add_to_bucket(self.positive_counts, self._key(value), weight)
+        else:
+            self._add_to_bucket(self.negative_counts, self._key(-value), weight)
+        self.count += weight
+        self.sum += weight * value
+        self.sum_of_squares += weight * value * value
+
+    # Adds an array of values at once. NaN values are ignored.
+    def add_values(self, values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        values = values[~numpy.isnan(values)]
+        is_zero = numpy.abs(values) < self.__class__.MIN_VALUE
+        self.zero_count += int(numpy.count_nonzero(is_zero))
+        for bucket_counts, bucket_values in ((self.positive_counts, values[~is_zero & (values > 0)]),
+                                             (self.negative_counts, -values[~is_zero & (values < 0)])):
+            keys, key_counts = numpy.unique(self._keys(bucket_values), return_counts=True)
+            for key, key_count in zip(keys, key_counts):
+                bucket_counts[int(key)] = bucket_counts.get(int(key), 0) + int(key_count)
+            self._collapse(bucket_counts)
+        self.count += len(values)
+        self.sum += float(numpy.sum(values))
+        self.sum_of_squares += float(numpy.sum(values * values))
+
+    # Adds the values of other sketch
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(u"Sketches with different accuracies can not be merged")
+        for bucket_counts, other_bucket_counts in ((self.positive_counts, other.positive_counts),
+                                                  (self.negative_counts, other.negative_counts)):
+            for key, key_count in other_bucket_counts.items():
+                self._add_to_bucket(bucket_counts, key, key_count)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        return self
+
+    def copy(self):
+        return QuantileSketch(self.relative_accuracy).merge(self)
+
+    def __len__(self):
+        return self.count
+
+    def mean(self):
+        if self.count == 0:
+            return float("nan")
+        return self.sum / self.count
+
+    def std(self):
+        if self.count == 0:
+            return float("nan")
+        mean = self.sum / self.count
+        return math.sqrt(max(0.0, self.sum_of_squares / self.count - mean * mean))
+
+    # Value of a quantile
+    def quantile(self, q):
+        """
+        :param q: quantile (between 0 and 1).
+        :return: value of the quantile, with a relative error lower than relative_accuracy. NaN if there are no
+        values.
+        """
+        if self.count <= 0:
+            return float("nan")
+        rank = q * (self.count - 1)
+        accumulated_count = 0
+        for key in sorted(self.negative_counts.keys(), reverse=True):
+            accumulated_count += self.negative_counts[key]
+            if accumulated_count > rank:
+                return -self._value(key)
+        accumulated_count += self.zero_count
+        if accumulated_count > rank:
+            return 0.0
+        for key in sorted(self.positive_counts.keys()):
+            accumulated_count += self.positive_counts[key]
+            if accumulated_count > rank:
+                return self._value(key)
+        return self._value(max(self.positive_counts.keys())) if self.positive_counts else 0.0
+
+    # Values of some percentiles
+    def percentiles(self, percentiles=None):
+        """
+        :param percentiles: list of percentiles (between 0 and 100). By default, PERCENTILES.
+        :return: dict with the value of each percentile.
+        """
+        if percentiles is None:
+            percentiles = PERCENTILES
+        return {percentile: self.quantile(percentile / 100.0) for percentile in percentiles}
+
+    # Summary with the mean, the standard deviation and the percentiles of the values
+    def get_summary(self):
+        return {"avg": self.mean(), "std_dev": self.std(), "percentiles": self.percentiles(), "sketch": self}
+
+    # JSON-serializable representation of this sketch
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive_counts": {str(key): key_count for key, key_count in self.positive_counts.items()},
+            "negative_counts": {str(key): key_count for key, key_count in self.negative_counts.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "sum_of_squares": self.sum_of_squares
+        }
+
+    # Sketch from its representation returned by to_dict
+    @staticmethod
+    def from_dict(sketch_dict):
+        sketch = QuantileSketch(sketch_dict["relative_accuracy"])
+        sketch.positive_counts = {int(key): key_count for key, key_count in sketch_dict["positive_counts"].items()}
+        sketch.negative_counts = {int(key): key_count for key, key_count in sketch_dict["negative_counts"].items()}
+        sketch.zero_count = sketch_dict["zero_count"]
+        sketch.count = sketch_dict["count"]
+        sketch.sum = sketch_dict["sum"]
+        sketch.sum_of_squares = sketch_dict["sum_of_squares"]
+        return sketch
+
+    # Key of the bucket of a positive value: values between gamma^(key - 1) and gamma^key
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _keys(self, values):
+        return numpy.ceil(numpy.log(values) / self.log_gamma).astype(numpy.int64)
+
+    # Value that represents a bucket, with the same relative error to both bounds of the bucket
+    def _value(self, key):
+        return 2.0 * math.pow(self.gamma, key) / (self.gamma + 1.0)
+
+    def _add_to_bucket(self, bucket_counts, key, weight):
+        key_count = bucket_counts.get(key, 0) + weight
+        if key_count == 0:
+            bucket_counts.pop(key, None)
+        else:
+            bucket_counts[key] = key_count
+            self._collapse(bucket_counts)
+
+    # Collapses the buckets of the smallest values if there are too many buckets
+    def _collapse(self, bucket_counts):
+        num_extra_buckets = len(bucket_counts) - self.__class__.MAX_BUCKETS
+        if num_extra_buckets <= 0:
+            return
+        keys = sorted(bucket_counts.keys())
+        collapsed_key = keys[num_extra_buckets]
+        for key in keys[0:num_extra_buckets]:
+            bucket_counts[collapsed_key] += bucket_counts.pop(key)
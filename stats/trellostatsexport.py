@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import numpy
+
+
+# Machine-readable exports of the stats of a board.
+# The stats are written as tables in two formats:
+# - JSON Lines (.jsonl): one JSON object for each row, with a "table" attribute with the name of its table. Rows are
+#   written as soon as they are generated.
+# - NumPy archive (.npz): one typed array for each column of each table, with the key <table>.<column>
+#   (e.g. numpy.load(path)["card_list_stats.time"]).
+# Times are in hours. Missing times are null in JSON Lines and NaN in the NumPy archive.
+
+# Size in bytes of the buffer of the JSON Lines file
+BUFFER_SIZE = 64 * 1024
+
+# Columns (name and type) of each table
+TABLES = [
+    ("lists", [("list_id", numpy.unicode_), ("position", numpy.int32), ("name", numpy.unicode_)]),
+    ("members", [("member_id", numpy.unicode_), ("username", numpy.unicode_)]),
+    ("labels", [("label_id", numpy.unicode_), ("name", numpy.unicode_)]),
+    ("card_list_stats", [("card_id", numpy.unicode_), ("list_id", numpy.unicode_), ("time", numpy.float64),
+                         ("forward_moves", numpy.int32), ("backward_moves", numpy.int32)]),
+    ("card_lead_cycle_times", [("card_id", numpy.unicode_), ("lead_time", numpy.float64),
+                               ("cycle_time", numpy.float64)]),
+    ("card_spent_estimated_times", [("card_id", numpy.unicode_), ("spent", numpy.float64),
+                                    ("estimated", numpy.float64)]),
+    ("list_movements", [("list_id", numpy.unicode_), ("forward", numpy.int32), ("backward", numpy.int32)]),
+    ("member_movements", [("member_id", numpy.unicode_), ("forward", numpy.int32), ("backward", numpy.int32)]),
+    ("member_spent_estimated_times", [("member_id", numpy.unicode_), ("period_type", numpy.unicode_),
+                                      ("period", numpy.unicode_), ("spent", numpy.float64),
+                                      ("estimated", numpy.float64)]),
+    ("label_cards_by_period", [("period_type", numpy.unicode_), ("period", numpy.unicode_),
+                               ("label_id", numpy.unicode_), ("cards", numpy.int32)]),
+    ("list_wip_by_day", [("day", numpy.unicode_), ("list_id", numpy.unicode_), ("cards", numpy.int32)]),
+    ("throughput_by_week", [("week", numpy.unicode_), ("cards", numpy.int32)])
+]
+
+
+# Exports the stats of a board
+def export(stat_extractor, stats, file_path_prefix, censored=False):
+    """
+    Writes the stats of a board in a JSON Lines file and in a NumPy archive.
+    :param stat_extractor: TrelloStatsExtractor whose stats are exported.
+    :param stats: stats returned by stat_extractor.get_stats().
+    :param file_path_prefix: path of the files without extension (.jsonl and .npz are added).
+    :param censored: if True, names of lists, members and labels are exported as empty strings.
+    :return: tuple with the paths of the JSON Lines file and the NumPy archive.
+    """
+    jsonl_file_path = u"{0}.jsonl".format(file_path_prefix)
+    npz_file_path = u"{0}.npz".format(file_path_prefix)
+
+    row_generators = _get_row_generators(stat_extractor, stats, censored)
+    columns = {}
+    with io.open(jsonl_file_path, "wb", buffering=BUFFER_SIZE) as jsonl_file:
+        for table_name, table_columns in TABLES:
+            column_values = [[] for _column in table_columns]
+            for row in row_generators[table_name]():
+                record = {"table": table_name}
+                for column_index, (column_name, _column_type) in enumerate(table_columns):
+                    record[column_name] = row[column_index]
+                    column_values[column_index].append(row[column_index])
+                jsonl_file.write((json.dumps(record, sort_keys=True) + u"\n").encode("utf-8"))
+            for column_index, (column_name, column_type) in enumerate(table_columns):
+                columns[u"{0}.{1}".format(table_name, column_name)] = _to_column_array(
+                    column_values[column_index], column_type
+                )
+
+    numpy.savez(npz_file_path, **columns)
+    return jsonl_file_path, npz_file_path
+
+
+# Functions that generate the rows of each table
+def _get_row_generators(stat_extractor, stats, censored):
+
+    def exported_name(name):
+        if censored:
+            return u""
+        return name.decode("utf-8") if isinstance(name, bytes) else name
+
+    def lists():
+        for list_index, list_ in enumerate(stats["lists"]):
+            yield list_.id, list_index, exported_name(list_.name)
+
+    def members():
+        for member in stat_extractor.members:
+            yield member.id, exported_name(member.username)
+
+    def labels():
+        for label in stat_extractor.labels:
+            yield label.id, exported_name(label.name)
+
+    def card_list_stats():
+        for card in stats["active_cards"]:
+            card_stats_by_list = stats["active_card_stats_by_list"][card.id]
+            for list_ in stats["lists"]:
+                list_stats = card_stats_by_list[list_.id]
+                yield card.id, list_.id, list_stats["time"], list_stats["forward_moves"], list_stats["backward_moves"]
+
+    def card_lead_cycle_times():
+        for card in stats["active_cards"]:
+            if card.id in stats["lead_time"]["values"]:
+                yield card.id, stats["lead_time"]["values"][card.id], stats["cycle_time"]["values"][card.id]
+
+    def card_spent_estimated_times():
+        for card in stats["active_cards"]:
+            card_times = stats["active_card_spent_estimated_times"][card.id]
+            # Cards have only the total times when there is a spent/estimated time regex
+            card_total_times = card_times.get("total", card_times)
+            yield card.id, card_total_times["spent"], card_total_times["estimated"]
+
+    def list_movements():
+        for list_ in stats["lists"]:
+            yield list_.id, stats["forward_movements_by_list"][list_.id], stats["backward_movements_by_list"][list_.id]
+
+    def member_movements():
+        for member_id, movements in stats["movements_by_user"].items():
+            yield member_id, movements["forward"], movements["backward"]
+
+    def member_spent_estimated_times():
+        periods = [
+            ("month", stat_extractor.spent_month_time_by_user, stat_extractor.estimated_month_time_by_user),
+            ("week", stat_extractor.spent_week_time_by_user, stat_extractor.estimated_week_time_by_user)
+        ]
+        for period_type, spent_time_by_user, estimated_time_by_user in periods:
+            for member_id in sorted(spent_time_by_user.keys()):
+                for period in sorted(spent_time_by_user[member_id].keys()):
+                    yield (member_id, period_type, period,
+                           spent_time_by_user[member_id][period],
+                           estimated_time_by_user[member_id].get(period, 0))
+
+    def label_cards_by_period():
+        periods = [
+            ("month", stat_extractor.cards_by_creation_month_by_label),
+            ("week", stat_extractor.cards_by_creation_week_by_label)
+        ]
+        for period_type, cards_by_period_by_label in periods:
+            for period in sorted(cards_by_period_by_label.keys()):
+                for label_id, cards in cards_by_period_by_label[period].items():
+                    yield period_type, period, label_id, len(cards)
+
+    def list_wip_by_day():
+        cumulative_flow = stats["cumulative_flow"]
+        for day_index in range(cumulative_flow.num_days):
+            day = cumulative_flow.get_day(day_index)
+            for list_index, list_ in enumerate(cumulative_flow.lists):
+                yield day, list_.id, int(cumulative_flow.wip[day_index, list_index])
+
+    def throughput_by_week():
+        throughput = stats["throughput"]
+        for week_index in range(throughput.num_weeks):
+            yield throughput.get_week(week_index), int(throughput.done_by_week[week_index])
+
+    return {
+        "lists": lists,
+        "members": members,
+        "labels": labels,
+        "card_list_stats": card_list_stats,
+        "card_lead_cycle_times": card_lead_cycle_times,
+        "card_spent_estimated_times": card_spent_estimated_times,
+        "list_movements": list_movements,
+        "member_movements": member_movements,
+        "member_spent_estimated_times": member_spent_estimated_times,
+        "label_cards_by_period": label_cards_by_period,
+        "list_wip_by_day": list_wip_by_day,
+        "throughput_by_week": throughput_by_week
+    }
+
+
+# Typed array of a column. Missing values are stored as NaN in float columns.
+def _to_column_array(values, column_type):
+    if column_type == numpy.float64:
+        values = [float("nan") if value is None else value for value in values]
+    return numpy.array(values, dtype=column_type)
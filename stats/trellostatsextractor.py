@@ -1,35 +1,60 @@
 # -*- coding: utf-8 -*-
+import calendar
 import datetime
 import numpy
-import re
-import dateutil.parser
 
 import settings
+from stats import instrumentation
 from stats.debug import print_card
 from stats.trelloboard import TrelloBoard
+from stats.trelloboardstream import StreamedBoardSnapshot
+from stats.trellocardset import CardSet, CardStats, CardValues, CountedCardSet
+from stats.trellocommenttimesheet import CommentTimesheetParser
+from stats.trellocumulativeflow import CumulativeFlow
+from stats.trelloincrementalstats import IncrementalBoardStats
+from stats.trellolisttransitions import ListTransitions
+from stats.trelloquantiles import QuantileSketch
+from stats.trellothroughput import DeliveryForecast, Throughput
 
 # Extract stats from a board
 class TrelloStatsExtractor(TrelloBoard):
 
-    def __init__(self, trello_connector, configuration):
+    def __init__(self, trello_connector, configuration, snapshot=None):
         self.configuration = configuration
-        super(TrelloStatsExtractor, self).__init__(trello_connector, configuration)
+        super(TrelloStatsExtractor, self).__init__(trello_connector, configuration, snapshot)
 
-        # Active cards by our definition given by the lambda function
-        self.active_cards = []
+        # Parser of the spent and estimated times of the card comments
+        self.comment_timesheet_parser = None
+        if self.configuration.spent_estimated_time_card_comment_regex:
+            self.comment_timesheet_parser = CommentTimesheetParser(
+                self.configuration.spent_estimated_time_card_comment_regex
+            )
+
+        # Sets of cards. Each one of them only stores the positions of its cards in self.cards
+        self.active_cards = CardSet(self.cards, [])
 
         # Cards that are not active
-        self.inactive_cards = []
-        self.done_inactive_cards = []
+        self.inactive_cards = CardSet(self.cards, [])
+        self.done_inactive_cards = CardSet(self.cards, [])
 
         # Closed cards
-        self.closed_cards = []
+        self.closed_cards = CardSet(self.cards, [])
 
         # Closed done cards
-        self.closed_done_cards = []
+        self.closed_done_cards = CardSet(self.cards, [])
 
         # Done cards
-        self.done_cards = []
+        self.done_cards = CardSet(self.cards, [])
+
+        # Position of each active card in self.active_cards. Stats of each active card are stored in this position
+        # of preallocated arrays.
+        self.active_card_positions = {}
+
+        # Whether each active card is in the done list
+        self.active_card_is_done = numpy.zeros(0, dtype=bool)
+
+        # Time (in hours) of each active card in each list (active cards x lists)
+        self.active_card_time_by_list = numpy.zeros((0, len(self.lists)))
 
         # Spent time by period of time by user
         self.spent_month_time_by_user = {member.id: {} for member in self.members}
@@ -52,8 +77,22 @@ class TrelloStatsExtractor(TrelloBoard):
         self.movements_by_member = {member.id: {"username": member.username, "forward": 0, "backward": 0} for member in self.members}
 
         # Cycle and lead times by card
-        self.cycle_time = {}
-        self.lead_time = {}
+        self.cycle_time = CardValues(self.active_card_positions, numpy.zeros(0))
+        self.lead_time = CardValues(self.active_card_positions, numpy.zeros(0))
+
+        # Movements of the active cards between lists
+        self.list_transitions = None
+
+        # Number of active cards in each list at the end of each day
+        self.cumulative_flow = None
+
+        # Done cards by day and by week and the forecast of the next ones (None if there is no complete week)
+        self.throughput = None
+        self.delivery_forecast = None
+
+        # Times of each custom workflow by card and their quantile sketches
+        self.custom_workflow_times = {}
+        self.custom_workflow_sketches = {}
 
         self.last_card_creation_datetime = None
         self.first_card_creation_datetime = None
@@ -74,63 +113,100 @@ class TrelloStatsExtractor(TrelloBoard):
         # Date filter to select only a part of card actions instead of the last 1000 actions as Trello does
         card_movements_filter = self.configuration.card_action_filter
 
-        # Utility function that check if a card is done
-        def card_is_done(_card):
-            return _card.idList == self.done_list.id
-
         # We store card_creation_datetimes to extract min datetime
         card_creation_datetimes = []
 
-        num_cards = len(self.cards)
-        i = 1
-        for card in self.cards:
+        now = datetime.datetime.now(settings.TIMEZONE)
+        now_timestamp = calendar.timegm(now.utctimetuple()) + now.microsecond / 1000000.0
 
-            # Test if the card is closed
-            if card.closed:
-                self.closed_cards.append(card)
-                # If the card is closed, test if was closed in the "done" list
-                if card_is_done(card):
-                    self.closed_done_cards.append(card)
+        is_done = numpy.array([card.idList == self.done_list.id for card in self.cards], dtype=bool)
+        is_closed = numpy.array([bool(card.closed) for card in self.cards], dtype=bool)
 
+        if self.is_streamed():
+            # Cards of a streamed board are its active cards, the rest of them have already been dropped
+            cards = self._init_streamed_card_sets(is_done, is_closed)
+        else:
             # Custom filter for only considering cards we want. By default it should be "not card.closed", but we
             # give programmers the option to customize this parameter
-            if card_is_active_function(card):
-                print_card(card, "{0} {i} of {num_cards}".format(card.name, i=i, num_cards=num_cards))
-                card.stats_by_list = card.get_stats_by_list(lists=self.lists, list_cmp=self.list_cmp, done_list=self.done_list,
-                                                            time_unit="hours", card_movements_filter=card_movements_filter)
-
-                # If the card is done, compute lead and cycle time
-                if card_is_done(card):
-                    #  Lead time (time between creation in board to reaching "Done" state)
-                    card.lead_time = sum([list_stats["time"] for list_id, list_stats in card.stats_by_list.items()])
-                    self.lead_time[card.id] = card.lead_time
-                    # Cycle time (time between development and reaching "Done" state)
-                    card.cycle_time = sum(
-                        [list_stats["time"] if list_id in self.cycle_lists_dict else 0 for list_id, list_stats in card.stats_by_list.items()]
-                    )
-                    self.cycle_time[card.id] = card.cycle_time
-                    self.done_cards.append(card)
-
-                # Add this card stats to each global stat
-                for list_ in self.lists:
-                    list_id = list_.id
-                    card_stats_by_list = card.stats_by_list[list_id]
-                    self.time_by_list[list_id].append(card_stats_by_list["time"])
-                    self.forward_movements_by_list[list_id] += card_stats_by_list["forward_moves"]
-                    self.backward_movements_by_list[list_id] += card_stats_by_list["backward_moves"]
-
-                # Forward and backward movements by member of the card
-                card_forward_movements = sum([list_stats["forward_moves"] for list_id, list_stats in card.stats_by_list.items()])
-                card_backward_movements = sum([list_stats["backward_moves"] for list_id, list_stats in card.stats_by_list.items()])
-                for idMember in card.member_ids:
-                    self.movements_by_member[idMember]["backward"] += card_backward_movements
-                    self.movements_by_member[idMember]["forward"] += card_forward_movements
-
-                # Comments S/E
-                card.s_e = self._get_spent_estimated(card)
-
-                # Categorizing the card according to its creation datetime and labels
-                self._categorize_card_by_label_period_of_time(card)
+            is_active = numpy.array([bool(card_is_active_function(card)) for card in self.cards], dtype=bool)
+
+            cards = self.cards
+            self.active_cards = CardSet.from_mask(self.cards, is_active)
+            self.inactive_cards = CardSet.from_mask(self.cards, ~is_active)
+            self.done_inactive_cards = CardSet.from_mask(self.cards, ~is_active & is_done)
+            self.closed_cards = CardSet.from_mask(self.cards, is_closed)
+            self.closed_done_cards = CardSet.from_mask(self.cards, is_closed & is_done)
+            self.done_cards = CardSet.from_mask(self.cards, is_active & is_done)
+
+        active_cards = self.active_cards
+        num_active_cards = len(active_cards)
+        self.active_card_positions = {card.id: card_position for card_position, card in enumerate(active_cards)}
+        self.active_card_is_done = is_done[active_cards.indices]
+
+        # Lead and cycle times are only defined for done cards (the rest of the cards have NaN)
+        self.lead_time = CardValues(self.active_card_positions, numpy.full(num_active_cards, numpy.nan))
+        self.cycle_time = CardValues(self.active_card_positions, numpy.full(num_active_cards, numpy.nan))
+
+        if self.configuration.incremental_stats:
+            # Only the card actions that are new since the last run are applied to the stored aggregates
+            self.incremental_stats = IncrementalBoardStats(self.configuration.cache_dir, self.board.id)
+            with instrumentation.timer("stats.incremental_stats"):
+                self.incremental_stats.update(self, now_timestamp)
+            self.incremental_stats.save()
+            self._add_incremental_stats(now_timestamp)
+            time_by_list_summary = self.incremental_stats.get_time_summary_by_list(now_timestamp)
+            lead_time_summary = self.incremental_stats.get_lead_time_summary(now_timestamp)
+            cycle_time_summary = self.incremental_stats.get_cycle_time_summary(now_timestamp)
+
+            def get_card_stats_by_list(_card_position):
+                return self.incremental_stats.get_card_stats_by_list(active_cards[_card_position].id, now_timestamp)
+
+            active_card_spent_estimated_times = {
+                card.id: self.incremental_stats.get_card_spent_estimated(card.id) for card in active_cards
+            }
+
+        else:
+            # Time and movements in each list of all active cards are computed at once
+            with instrumentation.timer("stats.list_transitions"):
+                self.list_transitions = ListTransitions(
+                    active_cards, self.lists, self.done_list, card_movements_filter,
+                    transitions_builder=self.snapshot.transitions_builder, card_indices=active_cards.indices
+                )
+                self.list_transitions.compute(now_timestamp, time_unit="hours")
+                self._add_list_transitions_stats()
+            time_by_list_summary = self._get_time_summary_by_list()
+            lead_time_summary = QuantileSketch.from_values(self.lead_time.values()).get_summary()
+            cycle_time_summary = QuantileSketch.from_values(self.cycle_time.values()).get_summary()
+
+            get_card_stats_by_list = self.list_transitions.get_card_stats_by_list
+
+            # Comments of all active cards are parsed at once
+            with instrumentation.timer("stats.spent_estimated"):
+                active_card_spent_estimated_times = self._get_spent_estimated_by_card(
+                    active_cards, self.snapshot.comment_timesheet_builder, active_cards.indices
+                )
+
+        # Incremental stats keep the list entries and exits and the done cards of each day
+        with instrumentation.timer("stats.cumulative_flow"):
+            if self.configuration.incremental_stats:
+                self.cumulative_flow = self.incremental_stats.get_cumulative_flow(now_timestamp)
+            else:
+                self.cumulative_flow = CumulativeFlow.from_list_transitions(self.list_transitions, now_timestamp)
+
+        with instrumentation.timer("stats.throughput"):
+            if self.configuration.incremental_stats:
+                self.throughput = self.incremental_stats.get_throughput(self.cumulative_flow.first_day, now_timestamp)
+            else:
+                self.throughput = self._get_throughput(card_movements_filter, now_timestamp)
+            self.delivery_forecast = DeliveryForecast.from_throughput(self.throughput)
+            delivery_forecast_summary = None
+            if self.delivery_forecast is not None:
+                delivery_forecast_summary = self.delivery_forecast.get_summary(num_active_cards - len(self.done_cards))
+
+        with instrumentation.timer("stats.cards"):
+            num_cards = len(self.cards)
+            for card_index, card in zip(active_cards.indices, active_cards):
+                print_card(card, "{0} {i} of {num_cards}".format(card.name, i=card_index + 1, num_cards=num_cards))
 
                 # Card creation datetime
                 card_creation_datetimes.append(card.create_date)
@@ -139,30 +215,21 @@ class TrelloStatsExtractor(TrelloBoard):
                 if self.board_last_activity is None or self.board_last_activity < card.date_last_activity:
                     self.board_last_activity = card.date_last_activity
 
-                # Compute custom workflows (if needed)
-                card.custom_workflow_times = self._get_custom_workflow_times(card)
-
-                # Add this card to active cards
-                self.active_cards.append(card)
-
-            # Inactive cards
-            else:
-                self.inactive_cards.append(card)
-                if card_is_done(card):
-                    self.done_inactive_cards.append(card)
+            # Categorizing the cards according to its creation datetime and labels
+            self._categorize_cards_by_label_period_of_time(card_creation_datetimes)
 
-            i += 1
+            # Compute custom workflows (if needed)
+            self._compute_custom_workflow_times()
 
-        now = datetime.datetime.now(settings.TIMEZONE)
         self.first_card_creation_datetime = min(card_creation_datetimes)
         self.last_card_creation_datetime = max(card_creation_datetimes)
         self.board_life_time = (self.board_last_activity - self.first_card_creation_datetime).total_seconds()
 
         stats = {
             "lists": self.lists,
-            "cards": self.cards,
-            "active_card_stats_by_list": {card.id: card.stats_by_list for card in self.active_cards},
-            "active_card_spent_estimated_times": {card.id: card.s_e for card in self.active_cards},
+            "cards": cards,
+            "active_card_stats_by_list": CardStats(self.active_card_positions, get_card_stats_by_list),
+            "active_card_spent_estimated_times": active_card_spent_estimated_times,
             "active_cards": self.active_cards,
             "done_inactive_cards": self.done_inactive_cards,
             "inactive_cards": self.inactive_cards,
@@ -175,65 +242,160 @@ class TrelloStatsExtractor(TrelloBoard):
             "board_last_activity": self.board_last_activity,
             "last_card_creation": self.last_card_creation_datetime,
             "last_card_creation_ago": (now - self.last_card_creation_datetime).total_seconds(),
-            "time_by_list": self._get_time_summary_by_list(),
+            "time_by_list": time_by_list_summary,
             "backward_movements_by_list": self.backward_movements_by_list,
             "movements_by_user": self.movements_by_member,
             "forward_movements_by_list": self.forward_movements_by_list,
-            "lead_time": {
-                "values": self.lead_time,
-                "avg": numpy.mean(self.lead_time.values()),
-                "std_dev": numpy.std(self.lead_time.values(), axis=0)
-            },
-            "cycle_time": {
-                "values": self.cycle_time,
-                "avg": numpy.mean(self.cycle_time.values()),
-                "std_dev": numpy.std(self.cycle_time.values(), axis=0)
-            },
+            "lead_time": dict(lead_time_summary, values=self.lead_time),
+            "cycle_time": dict(cycle_time_summary, values=self.cycle_time),
+            "cumulative_flow": self.cumulative_flow,
+            "wip_by_list": self.cumulative_flow.get_wip_summary(),
+            "throughput": self.throughput,
+            "delivery_forecast": delivery_forecast_summary,
         }
         return stats
 
-    # Get a summary of the time each task has been in each list
+    # Throughput of all the cards of the board (active or not)
+    def _get_throughput(self, card_movements_filter, now_timestamp):
+        first_day = self.cumulative_flow.first_day
+        if self.is_streamed():
+            # Dropped cards only keep when they entered their list
+            return Throughput.from_list_transitions(
+                self.list_transitions, first_day, now_timestamp,
+                self.snapshot.get_dropped_card_entry_timestamps(self.list_transitions.done_list_index)
+            )
+        with instrumentation.timer("stats.all_card_transitions"):
+            all_card_transitions = ListTransitions(
+                self.cards, self.lists, self.done_list, card_movements_filter,
+                transitions_builder=self.snapshot.transitions_builder
+            )
+        return Throughput.from_list_transitions(all_card_transitions, first_day, now_timestamp)
+
+    # Informs if the board has been streamed, so only its active cards are available
+    def is_streamed(self):
+        return isinstance(self.snapshot, StreamedBoardSnapshot)
+
+    # Initializes the sets of cards of a streamed board
+    def _init_streamed_card_sets(self, is_done, is_closed):
+        """
+        Cards of a streamed board are its active cards. Sets of cards that include dropped cards only know their size.
+        :param is_done: boolean mask of the active cards that are in the done list.
+        :param is_closed: boolean mask of the active cards that are closed.
+        :return: set with all the cards of the board.
+        """
+        done_list_index = [list_.id for list_ in self.lists].index(self.done_list.id)
+        dropped_is_done = self.snapshot.dropped_card_list_indices == done_list_index
+        dropped_is_closed = self.snapshot.dropped_card_is_closed
+
+        self.active_cards = CardSet(self.cards, numpy.arange(len(self.cards)))
+        self.done_cards = CardSet.from_mask(self.cards, is_done)
+        self.inactive_cards = CountedCardSet(len(dropped_is_done))
+        self.done_inactive_cards = CountedCardSet(int(numpy.count_nonzero(dropped_is_done)))
+        self.closed_cards = CountedCardSet(
+            int(numpy.count_nonzero(is_closed)) + int(numpy.count_nonzero(dropped_is_closed))
+        )
+        self.closed_done_cards = CountedCardSet(
+            int(numpy.count_nonzero(is_closed & is_done)) + int(numpy.count_nonzero(dropped_is_closed & dropped_is_done))
+        )
+        return CountedCardSet(self.snapshot.num_cards)
+
+    # Adds the time and movements in each list of the active cards to the global stats
+    def _add_list_transitions_stats(self):
+        active_cards = self.active_cards
+        time_by_list = self.list_transitions.time_by_list
+        forward_moves_by_list = self.list_transitions.forward_moves_by_list
+        backward_moves_by_list = self.list_transitions.backward_moves_by_list
+
+        self.active_card_time_by_list = time_by_list
+        for list_index, list_ in enumerate(self.lists):
+            self.time_by_list[list_.id] = time_by_list[:, list_index]
+            self.forward_movements_by_list[list_.id] = int(forward_moves_by_list[:, list_index].sum())
+            self.backward_movements_by_list[list_.id] = int(backward_moves_by_list[:, list_index].sum())
+
+        self._compute_lead_cycle_times()
+
+        # Forward and backward movements by member of the cards
+        member_indices = {member.id: member_index for member_index, member in enumerate(self.members)}
+        card_member_pairs = numpy.array(
+            [(card_position, member_indices[member_id])
+             for card_position, card in enumerate(active_cards)
+             for member_id in card.member_ids if member_id in member_indices],
+            dtype=numpy.int64
+        ).reshape(-1, 2)
+        card_forward_moves = forward_moves_by_list.sum(axis=1)[card_member_pairs[:, 0]]
+        card_backward_moves = backward_moves_by_list.sum(axis=1)[card_member_pairs[:, 0]]
+        forward_moves_by_member = numpy.bincount(card_member_pairs[:, 1], weights=card_forward_moves, minlength=len(self.members))
+        backward_moves_by_member = numpy.bincount(card_member_pairs[:, 1], weights=card_backward_moves, minlength=len(self.members))
+        for member_index, member in enumerate(self.members):
+            self.movements_by_member[member.id]["forward"] = int(forward_moves_by_member[member_index])
+            self.movements_by_member[member.id]["backward"] = int(backward_moves_by_member[member_index])
+
+    # Adds the stats stored in the incremental stats to the global stats
+    def _add_incremental_stats(self, now_timestamp):
+        self.forward_movements_by_list, self.backward_movements_by_list = self.incremental_stats.get_movements_by_list()
+
+        for member_id, movements in self.incremental_stats.get_movements_by_member().items():
+            if member_id in self.movements_by_member:
+                self.movements_by_member[member_id]["forward"] = movements["forward"]
+                self.movements_by_member[member_id]["backward"] = movements["backward"]
+
+        for member in self.members:
+            self.spent_month_time_by_user[member.id] = dict(self.incremental_stats.get_times_by_user("spent", "month").get(member.id, {}))
+            self.estimated_month_time_by_user[member.id] = dict(self.incremental_stats.get_times_by_user("estimated", "month").get(member.id, {}))
+            self.spent_week_time_by_user[member.id] = dict(self.incremental_stats.get_times_by_user("spent", "week").get(member.id, {}))
+            self.estimated_week_time_by_user[member.id] = dict(self.incremental_stats.get_times_by_user("estimated", "week").get(member.id, {}))
+
+        # Time (in hours) of each active card in each list
+        self.active_card_time_by_list = numpy.zeros((len(self.active_cards), len(self.lists)), dtype=numpy.float64)
+        for card_position, card in enumerate(self.active_cards):
+            self.active_card_time_by_list[card_position, :] = \
+                self.incremental_stats.get_card_times_by_list(card.id, now_timestamp)
+        self.active_card_time_by_list /= 3600.0
+
+        self._compute_lead_cycle_times()
+
+    # Lead time (time between creation in board to reaching "Done" state) and
+    # cycle time (time between development and reaching "Done" state) of done cards
+    def _compute_lead_cycle_times(self):
+        cycle_list_indices = [list_index for list_index, list_ in enumerate(self.lists) if list_.id in self.cycle_lists_dict]
+        time_by_list = self.active_card_time_by_list[self.active_card_is_done]
+        self.lead_time.array[self.active_card_is_done] = time_by_list.sum(axis=1)
+        self.cycle_time.array[self.active_card_is_done] = time_by_list[:, cycle_list_indices].sum(axis=1)
+
+    # Get a summary (avg, std_dev, percentiles and the quantile sketch) of the time each task has been in each list
     def _get_time_summary_by_list(self):
-        def add_statistic_summary(value_list):
-            return {"values": value_list, "avg": numpy.mean(value_list), "std_dev": numpy.std(value_list, axis=0)}
-
-        def statistic_summary_by_list(stat_by_list):
-            stats_summary_by_list = {}
-            for list_name_, list_times_ in stat_by_list.items():
-                stats_summary_by_list[list_name_] = add_statistic_summary(list_times_)
-
-            return stats_summary_by_list
-
-        return statistic_summary_by_list(self.time_by_list)
+        return {
+            list_id: QuantileSketch.from_values(list_times).get_summary()
+            for list_id, list_times in self.time_by_list.items()
+        }
 
-    # Get specific workflow times
-    def _get_custom_workflow_times(self, card):
+    # Computes the times of each custom workflow for all the active cards at once
+    def _compute_custom_workflow_times(self):
         # If there is no custom workflows or this board has no custom workflows, there is no custom workflow times
-        # for this card
+        self.custom_workflow_times = {}
+        self.custom_workflow_sketches = {}
         if not self.has_custom_workflows():
-            return None
+            return
 
-        workflows = self.get_custom_workflows()
+        list_indices = {list_.id: list_index for list_index, list_ in enumerate(self.lists)}
+        card_list_names = [self.lists_dict[card.idList].name.decode("utf-8") for card in self.active_cards]
 
-        card_times_by_workflow = {}
-        for custom_workflow in workflows:
-            custom_workflow_id = custom_workflow.name
-            card_times_by_workflow[custom_workflow_id] = 0
+        for custom_workflow in self.get_custom_workflows():
+            # Sum of the times of each custom workflow list this card has been
+            workflow_list_indices = [
+                list_indices[self.lists_dict_by_name[list_name].id] for list_name in custom_workflow.list_name_order
+            ]
+            workflow_times = self.active_card_time_by_list[:, workflow_list_indices].sum(axis=1)
 
-            # If this card is not in one of the lists that have the role of "done" lists, it is not possible to
+            # If a card is not in one of the lists that have the role of "done" lists, it is not possible to
             # compute this workflow time
-            card_list_name = self.lists_dict[card.idList].name.decode("utf-8")
-            if not card_list_name in custom_workflow.done_list_names:
-                card_times_by_workflow[custom_workflow_id] = None
-                continue
+            is_in_done_list = numpy.array(
+                [card_list_name in custom_workflow.done_list_names for card_list_name in card_list_names], dtype=bool
+            )
+            workflow_times[~is_in_done_list] = numpy.nan
 
-            # Sum of the times of each custom workflow list this card has been
-            for list_name in custom_workflow.list_name_order:
-                list_ = self.lists_dict_by_name[list_name]
-                card_times_by_workflow[custom_workflow_id] += card.stats_by_list[list_.id]["time"]
-
-        # Return all the custom workflow times
-        return card_times_by_workflow
+            self.custom_workflow_times[custom_workflow.name] = CardValues(self.active_card_positions, workflow_times)
+            self.custom_workflow_sketches[custom_workflow.name] = QuantileSketch.from_values(workflow_times)
 
     def has_custom_workflows(self):
         return len(self.configuration.custom_workflows) > 0
@@ -243,122 +405,126 @@ class TrelloStatsExtractor(TrelloBoard):
             return self.configuration.custom_workflows
         return False
 
-    # Gets the spent and estimated times for this card
+    # Gets the spent and estimated times of a set of cards
     # Plugins like Plus for Trello are able to store estimated duration of the task and actual spent time in comments.
     # This plugins has a format (plus! <spent>/<estimated> in case of Plus for Trello) and this format can be defined
     # in settings local by the use of a regular expression.
-    def _get_spent_estimated(self, card):
-
+    def _get_spent_estimated_by_card(self, cards, timesheet_builder=None, card_indices=None):
+        """
+        Parses the comments of all the cards at once and adds their times to the spent and estimated times by user.
+        :param cards: cards whose spent and estimated times are computed.
+        :param timesheet_builder: optional CommentTimesheetBuilder with the comments of the cards already parsed (e.g.
+        while the board was streamed or when its card actions were reduced).
+        :param card_indices: ascending positions of the cards in the cards of timesheet_builder. If None, the cards of
+        timesheet_builder are these cards. Ignored if there is no timesheet_builder.
+        :return: dict indexed by card id with the spent and estimated times of each card.
+        """
         # If there is no defined regex with the format of spent/estimated comment in cards, don't fetch comments
-        if not self.configuration.spent_estimated_time_card_comment_regex:
-            return {"spent": None, "estimated": None}
-
-        times = {"total": {"spent": None, "estimated": None}, "by_user": {}}
-
-        comments = card.get_comments()
-        total_spent = None
-        total_estimated = None
-        # For each comment, find the desired pattern and extract the spent and estimated times
-        for comment in comments:
-            comment_content = comment["data"]["text"]
-            matches = re.match(self.configuration.spent_estimated_time_card_comment_regex, comment_content)
-            if matches:
-                # Comment creator
-                comment_creator_id = comment["idMemberCreator"]
-                if comment_creator_id not in times["by_user"]:
-                    times["by_user"][comment_creator_id] = {
-                        "total": {"spent": 0, "estimated": 0},
-                        "by_month": {},
-                        "by_week": {},
-                        "by_day": {}
-                    }
-
-                # Add to total spent
-                if total_spent is None:
-                    total_spent = 0
-                spent = float(matches.group("spent"))
-                total_spent += spent
-
-                # Add to total estimated
-                if total_estimated is None:
-                    total_estimated = 0
-                estimated = float(matches.group("estimated"))
-                total_estimated += estimated
-
-                # Comment iso timestamp conversion to datetime
-                comment_creation_iso_timestamp = comment["date"]
-                comment_creation_datetime = dateutil.parser.parse(comment_creation_iso_timestamp)
-                comment_creation_date = comment_creation_datetime.date()
-
-                # Spent/Estimated by month
-                month = comment_creation_date.strftime("%Y-M%m")
-                if month not in times["by_user"][comment_creator_id]["by_month"]:
-                    times["by_user"][comment_creator_id]["by_month"][month] = {"spent": 0, "estimated": 0}
-
-                # Spent by month
-                times["by_user"][comment_creator_id]["by_month"][month]["spent"] += spent
-                if month not in self.spent_month_time_by_user[comment_creator_id]:
-                    self.spent_month_time_by_user[comment_creator_id][month] = 0
-                self.spent_month_time_by_user[comment_creator_id][month] += spent
-
-                # Estimated by month
-                times["by_user"][comment_creator_id]["by_month"][month]["estimated"] += estimated
-                if month not in self.estimated_month_time_by_user[comment_creator_id]:
-                    self.estimated_month_time_by_user[comment_creator_id][month] = 0
-                self.estimated_month_time_by_user[comment_creator_id][month] += estimated
-
-                # Spent/Estimated by week of year
-                week_number = "{0}-W{1}".format(comment_creation_date.year, comment_creation_date.isocalendar()[1])
-                if week_number not in times["by_user"][comment_creator_id]["by_week"]:
-                    date_week_starts = datetime.datetime.strptime(week_number + '-0', "%Y-W%W-%w")
-                    times["by_user"][comment_creator_id]["by_week"][week_number] = {"week_starts_at": date_week_starts.strftime("%Y-%m-%d"), "spent": 0, "estimated": 0}
-
-                # Spent by week of year
-                times["by_user"][comment_creator_id]["by_week"][week_number]["spent"] += spent
-                if week_number not in self.spent_week_time_by_user[comment_creator_id]:
-                    self.spent_week_time_by_user[comment_creator_id][week_number] = 0
-                self.spent_week_time_by_user[comment_creator_id][week_number] += spent
-
-                times["by_user"][comment_creator_id]["by_week"][week_number]["estimated"] += estimated
-                # Estimated by week of year
-                if week_number not in self.estimated_week_time_by_user[comment_creator_id]:
-                    self.estimated_week_time_by_user[comment_creator_id][week_number] = 0
-                self.estimated_week_time_by_user[comment_creator_id][week_number] += estimated
-
-                # Spent/Estimated by day of year
-                yyyymmdd = comment_creation_date.strftime("%Y-%m-%d")
-                if yyyymmdd not in times["by_user"][comment_creator_id]["by_day"]:
-                    times["by_user"][comment_creator_id]["by_day"][yyyymmdd] = {"spent": 0, "estimated": 0}
-                times["by_user"][comment_creator_id]["by_day"][yyyymmdd]["spent"] += spent
-                times["by_user"][comment_creator_id]["by_day"][yyyymmdd]["estimated"] += estimated
-
-        times["total"] = {"spent": total_spent, "estimated": total_estimated}
-
-        return times
-
-    # Categorize this card by period of creation time and each one of its labels
-    def _categorize_card_by_label_period_of_time(self, card):
-        creation_datetime = card.create_date
-        month = creation_datetime.strftime("%Y-M%m")
-        week_number = "{0}-W{1}".format(creation_datetime.year, creation_datetime.isocalendar()[1])
-
-        if month not in self.cards_by_creation_month_by_label:
-            self.cards_by_creation_month_by_label[month] = {}
-
-        if week_number not in self.cards_by_creation_week_by_label:
-            self.cards_by_creation_week_by_label[week_number] = {}
-
-        # For each label we categorize this card in each one of its label and month and week number
-        for label_id in card.label_ids:
-
-            # Categorizing the card to its label and month
-            if label_id not in self.cards_by_creation_month_by_label[month]:
-                self.cards_by_creation_month_by_label[month][label_id] = []
-            self.cards_by_creation_month_by_label[month][label_id].append(card)
-
-            # Categorizing the card to its label and week number
-            if label_id not in self.cards_by_creation_week_by_label[week_number]:
-                self.cards_by_creation_week_by_label[week_number][label_id] = []
-            self.cards_by_creation_week_by_label[week_number][label_id].append(card)
-
-
+        if not self.comment_timesheet_parser:
+            return {card.id: {"spent": None, "estimated": None} for card in cards}
+
+        if timesheet_builder is None:
+            timesheet = self.comment_timesheet_parser.parse(cards)
+        else:
+            timesheet = timesheet_builder.build(cards, card_indices)
+        instrumentation.count("comments", timesheet.num_comments)
+
+        periods = [
+            ("month", self.spent_month_time_by_user, self.estimated_month_time_by_user),
+            ("week", self.spent_week_time_by_user, self.estimated_week_time_by_user)
+        ]
+        for period, spent_time_by_user, estimated_time_by_user in periods:
+            spent_times_by_member, estimated_times_by_member = timesheet.get_times_by_member(period)
+            for member_id, spent_times in spent_times_by_member.items():
+                for period_key, spent in spent_times.items():
+                    spent_time_by_user[member_id][period_key] = spent_time_by_user[member_id].get(period_key, 0) + spent
+            for member_id, estimated_times in estimated_times_by_member.items():
+                for period_key, estimated in estimated_times.items():
+                    estimated_time_by_user[member_id][period_key] = \
+                        estimated_time_by_user[member_id].get(period_key, 0) + estimated
+
+        return {card.id: card_times for card, card_times in zip(cards, timesheet.get_times_by_card())}
+
+    # Adds the spent and estimated times of a comment to the spent and estimated times of its card
+    def _add_comment_spent_estimated(self, times, comment):
+        """
+        Extracts the spent and estimated times of a comment and adds them to the times of its card.
+        :param times: dict with the spent and estimated times of the card (see _get_spent_estimated_by_card).
+        :param comment: commentCard action.
+        :return: tuple (comment creator id, month, week, spent, estimated) if the comment has spent and estimated
+        times, None otherwise.
+        """
+        comment_times = self.comment_timesheet_parser.parse_comment(comment)
+        if not comment_times:
+            return None
+        comment_creator_id, day, spent, estimated = comment_times
+        month, week_number, week_starts_at = self.comment_timesheet_parser.get_day_keys(day)
+
+        # Comment creator
+        if comment_creator_id not in times["by_user"]:
+            times["by_user"][comment_creator_id] = {
+                "total": {"spent": 0, "estimated": 0},
+                "by_month": {},
+                "by_week": {},
+                "by_day": {}
+            }
+        user_times = times["by_user"][comment_creator_id]
+
+        # Add to total spent
+        if times["total"]["spent"] is None:
+            times["total"]["spent"] = 0
+        times["total"]["spent"] += spent
+
+        # Add to total estimated
+        if times["total"]["estimated"] is None:
+            times["total"]["estimated"] = 0
+        times["total"]["estimated"] += estimated
+
+        # Spent/Estimated by month
+        if month not in user_times["by_month"]:
+            user_times["by_month"][month] = {"spent": 0, "estimated": 0}
+        user_times["by_month"][month]["spent"] += spent
+        user_times["by_month"][month]["estimated"] += estimated
+
+        # Spent/Estimated by week of year
+        if week_number not in user_times["by_week"]:
+            user_times["by_week"][week_number] = {"week_starts_at": week_starts_at, "spent": 0, "estimated": 0}
+        user_times["by_week"][week_number]["spent"] += spent
+        user_times["by_week"][week_number]["estimated"] += estimated
+
+        # Spent/Estimated by day of year
+        if day not in user_times["by_day"]:
+            user_times["by_day"][day] = {"spent": 0, "estimated": 0}
+        user_times["by_day"][day]["spent"] += spent
+        user_times["by_day"][day]["estimated"] += estimated
+
+        return comment_creator_id, month, week_number, spent, estimated
+
+    # Categorize the active cards by period of creation time and each one of its labels
+    def _categorize_cards_by_label_period_of_time(self, card_creation_datetimes):
+        """
+        Stores the set of active cards created in each month and week with each label.
+        :param card_creation_datetimes: creation datetime of each active card.
+        """
+        card_indices_by_month_by_label = {}
+        card_indices_by_week_by_label = {}
+        for card_index, card, creation_datetime in zip(self.active_cards.indices, self.active_cards, card_creation_datetimes):
+            month = creation_datetime.strftime("%Y-M%m")
+            week_number = "{0}-W{1}".format(creation_datetime.year, creation_datetime.isocalendar()[1])
+
+            month_card_indices_by_label = card_indices_by_month_by_label.setdefault(month, {})
+            week_card_indices_by_label = card_indices_by_week_by_label.setdefault(week_number, {})
+
+            # For each label we categorize this card in each one of its label and month and week number
+            for label_id in card.label_ids:
+                month_card_indices_by_label.setdefault(label_id, []).append(card_index)
+                week_card_indices_by_label.setdefault(label_id, []).append(card_index)
+
+        self.cards_by_creation_month_by_label = {
+            month: {label_id: CardSet(self.cards, card_indices) for label_id, card_indices in card_indices_by_label.items()}
+            for month, card_indices_by_label in card_indices_by_month_by_label.items()
+        }
+        self.cards_by_creation_week_by_label = {
+            week: {label_id: CardSet(self.cards, card_indices) for label_id, card_indices in card_indices_by_label.items()}
+            for week, card_indices_by_label in card_indices_by_week_by_label.items()
+        }
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import os
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy
+from slugify import slugify
+
+from charts import trellochart
+from stats import instrumentation
+from stats.trelloboard import fetch_board_snapshot
+from stats.trellostatsextractor import TrelloStatsExtractor
+
+
+# Stats of a board computed in a refresh. Once built, it is never modified, so requests can read it while the
+# next refresh is being computed.
+class BoardState(object):
+
+    def __init__(self, stat_extractor, stats, chart_paths, refreshed_at, refresh_time):
+        """
+        :param stat_extractor: TrelloStatsExtractor of the board.
+        :param stats: stats returned by stat_extractor.get_stats().
+        :param chart_paths: dict with the path of the file of each chart, indexed by chart name.
+        :param refreshed_at: UNIX timestamp of the end of the refresh.
+        :param refresh_time: time in seconds the refresh took.
+        """
+        self.stat_extractor = stat_extractor
+        self.stats = stats
+        self.chart_paths = chart_paths
+        self.refreshed_at = refreshed_at
+        self.refresh_time = refresh_time
+        # Stats are serialized once, so requests only have to send them
+        self.stats_json = dumps_json(serialize_stats(stat_extractor, stats))
+
+
+# Board kept in memory by the service
+class WarmBoard(object):
+
+    def __init__(self, key, configuration):
+        self.key = key
+        self.configuration = configuration
+        # Last computed stats. None until the first refresh ends.
+        self.state = None
+        # Traceback of the last refresh if it failed
+        self.error = None
+        self.refresh_lock = threading.Lock()
+
+    def get_status(self):
+        state = self.state
+        return {
+            "key": self.key,
+            "ready": state is not None,
+            "refreshed_at": state.refreshed_at if state else None,
+            "refresh_time": state.refresh_time if state else None,
+            "error": self.error
+        }
+
+
+# Keeps the stats of several boards in memory and refreshes them in a background thread, periodically and each
+# time a refresh is requested (e.g. by a webhook).
+class TrelloStatsService(object):
+
+    # Element of the refresh queue that stops the refresh thread
+    _STOP = object()
+
+    def __init__(self, trello_connector, configurations, refresh_interval=None):
+        """
+        :param trello_connector: TrelloConnector used to fetch the boards.
+        :param configurations: TrelloBoardConfiguration of each board.
+        :param refresh_interval: seconds between two refreshes of all the boards. If None, boards are only refreshed
+        when it is requested.
+        """
+        self.trello_connector = trello_connector
+        self.refresh_interval = refresh_interval
+        self.boards = {}
+        for configuration in configurations:
+            board_key = get_board_key(configuration)
+            # Two configurations of the same board would replace each other
+            if board_key in self.boards:
+                raise ValueError(u"There are two configurations of boards whose key is {0}".format(board_key))
+            self.boards[board_key] = WarmBoard(board_key, configuration)
+
+        self.fetcher = None
+
+        self.refresh_queue = queue.Queue()
+        self.pending_refreshes = set()
+        self.pending_refreshes_lock = threading.Lock()
+        self.refresh_thread = None
+
+    # Starts the refresh thread. All the boards are refreshed at once.
+    def start(self):
+        self.refresh_thread = threading.Thread(target=self._run_refreshes, name=u"refresh")
+        self.refresh_thread.daemon = True
+        self.refresh_thread.start()
+        for board_key in sorted(self.boards.keys()):
+            self.request_refresh(board_key)
+
+    # Stops the refresh thread after the current refresh
+    def stop(self):
+        self.refresh_queue.put(self.__class__._STOP)
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+
+    # Queues the refresh of a board. A board is not queued twice.
+    def request_refresh(self, board_key):
+        """
+        :param board_key: key of the board.
+        :return: False if the board does not exist, True otherwise.
+        """
+        if board_key not in self.boards:
+            return False
+        with self.pending_refreshes_lock:
+            if board_key in self.pending_refreshes:
+                return True
+            self.pending_refreshes.add(board_key)
+        self.refresh_queue.put(board_key)
+        return True
+
+    def get_board(self, board_key):
+        return self.boards.get(board_key)
+
+    # Refreshes the queued boards, and all the boards each refresh interval
+    def _run_refreshes(self):
+        next_refresh_time = None
+        if self.refresh_interval:
+            next_refresh_time = time.time() + self.refresh_interval
+        while True:
+            timeout = None
+            if next_refresh_time is not None:
+                timeout = max(0.0, next_refresh_time - time.time())
+            try:
+                board_key = self.refresh_queue.get(timeout=timeout)
+            except queue.Empty:
+                for board_key in sorted(self.boards.keys()):
+                    self.request_refresh(board_key)
+                next_refresh_time = time.time() + self.refresh_interval
+                continue
+            if board_key is self.__class__._STOP:
+                return
+            with self.pending_refreshes_lock:
+                self.pending_refreshes.discard(board_key)
+            self.refresh(board_key)
+
+    # Fetches a board and computes its stats again
+    def refresh(self, board_key):
+        """
+        Computes the stats and the charts of a board. Requests keep reading the previous stats until the new ones
+        are ready.
+        :param board_key: key of the board.
+        :return: True if the board was refreshed, False if there was an error.
+        """
+        board = self.boards[board_key]
+        with board.refresh_lock:
+            start_time = time.time()
+            try:
+                with instrumentation.timer("service.refresh", board=board_key):
+                    snapshot = self._fetch_snapshot(board.configuration)
+                    stat_extractor = TrelloStatsExtractor(self.trello_connector, board.configuration, snapshot)
+                    stats = stat_extractor.get_stats()
+                    if not os.path.exists(board.configuration.output_dir):
+                        os.makedirs(board.configuration.output_dir)
+                    graphics = trellochart.get_graphics(stats, stat_extractor)
+                    state = BoardState(
+                        stat_extractor, stats, graphics["chart_paths"], time.time(), time.time() - start_time
+                    )
+            except Exception:
+                board.error = traceback.format_exc()
+                return False
+            previous_state = board.state
+            board.state = state
+            board.error = None
+            if previous_state is not None:
+                _remove_old_charts(previous_state.chart_paths, state.chart_paths)
+            return True
+
+    # Fetches the snapshot of a board
+    def _fetch_snapshot(self, configuration):
+        if self.fetcher is None:
+            self.fetcher = self.trello_connector.get_fetcher()
+        return fetch_board_snapshot(self.trello_connector, self.fetcher, configuration)
+
+
+# Key of a board in the service: its slugified name
+def get_board_key(configuration):
+    board_name = configuration.board_name
+    return slugify(board_name.decode("utf-8") if isinstance(board_name, bytes) else board_name)
+
+
+# Stats of a board as JSON-serializable objects
+def serialize_stats(stat_extractor, stats):
+    """
+    :param stat_extractor: TrelloStatsExtractor of the board.
+    :param stats: stats returned by stat_extractor.get_stats().
+    :return: dict with the stats. Times are in hours. Cards are only referenced by their ids.
+    """
+    censored = stat_extractor.configuration.censored
+    throughput = stats["throughput"]
+
+    def exported_name(name):
+        if censored:
+            return u""
+        return name.decode("utf-8") if isinstance(name, bytes) else name
+
+    return {
+        "board": {"id": stat_extractor.board.id, "name": exported_name(stat_extractor.configuration.board_name)},
+        "lists": [{"id": list_.id, "name": exported_name(list_.name)} for list_ in stats["lists"]],
+        "num_cards": {
+            card_set: len(stats[card_set])
+            for card_set in ["cards", "active_cards", "inactive_cards", "done_cards", "done_inactive_cards",
+                             "closed_cards", "closed_done_cards"]
+        },
+        "done_cards_per_hour": stats["done_cards_per_hour"],
+        "done_cards_per_day": stats["done_cards_per_day"],
+        "board_life_time": stats["board_life_time"],
+        "board_last_activity": stats["board_last_activity"].isoformat(),
+        "last_card_creation": stats["last_card_creation"].isoformat(),
+        "last_card_creation_ago": stats["last_card_creation_ago"],
+        "time_by_list": {
+            list_id: _serialize_summary(list_time) for list_id, list_time in stats["time_by_list"].items()
+        },
+        "forward_movements_by_list": stats["forward_movements_by_list"],
+        "backward_movements_by_list": stats["backward_movements_by_list"],
+        "movements_by_user": {
+            member_id: {"forward": movements["forward"], "backward": movements["backward"]}
+            for member_id, movements in stats["movements_by_user"].items()
+        },
+        "lead_time": _serialize_card_times(stats["lead_time"]),
+        "cycle_time": _serialize_card_times(stats["cycle_time"]),
+        "wip_by_list": stats["wip_by_list"],
+        "throughput_by_week": {
+            throughput.get_week(week_index): throughput.done_by_week[week_index]
+            for week_index in range(throughput.num_weeks)
+        },
+        "delivery_forecast": _serialize_delivery_forecast(stats["delivery_forecast"])
+    }
+
+
+# Stats of a card as JSON-serializable objects
+def serialize_card_stats(stat_extractor, stats, card_id):
+    """
+    :param stat_extractor: TrelloStatsExtractor of the board.
+    :param stats: stats returned by stat_extractor.get_stats().
+    :param card_id: identifier of an active card.
+    :return: dict with the stats of the card. None if there is no active card with that id.
+    """
+    if card_id not in stats["active_card_stats_by_list"]:
+        return None
+    card = stats["active_cards"][stat_extractor.active_card_positions[card_id]]
+    card_name = u"" if stat_extractor.configuration.censored else card.name.decode("utf-8")
+    return {
+        "id": card.id,
+        "name": card_name,
+        "list_id": card.idList,
+        "stats_by_list": stats["active_card_stats_by_list"][card_id],
+        "spent_estimated": stats["active_card_spent_estimated_times"][card_id],
+        "lead_time": stats["lead_time"]["values"].get(card_id),
+        "cycle_time": stats["cycle_time"]["values"].get(card_id)
+    }
+
+
+def _serialize_card_times(card_times):
+    return dict(_serialize_summary(card_times), values=dict(card_times["values"].items()))
+
+
+# Mean, standard deviation and percentiles of some times. Percentiles are indexed by their name (e.g. p50).
+def _serialize_summary(summary):
+    return {
+        "avg": summary["avg"],
+        "std_dev": summary["std_dev"],
+        "percentiles": {
+            u"p{0}".format(percentile): value for percentile, value in summary["percentiles"].items()
+        }
+    }
+
+
+# Forecast of the done cards. Likelihoods and weeks are indexed by strings (e.g. "85"), as JSON keys.
+def _serialize_delivery_forecast(delivery_forecast):
+    if delivery_forecast is None:
+        return None
+    return dict(
+        delivery_forecast,
+        cards_by_weeks={
+            str(num_weeks): {str(likelihood): cards for likelihood, cards in cards_by_likelihood.items()}
+            for num_weeks, cards_by_likelihood in delivery_forecast["cards_by_weeks"].items()
+        },
+        weeks_to_finish={
+            str(likelihood): weeks for likelihood, weeks in delivery_forecast["weeks_to_finish"].items()
+        }
+    )
+
+
+# Strict JSON of some JSON-serializable objects, encoded in UTF-8.
+# NaN and infinite numbers (e.g. the mean of an empty sketch) are not valid JSON, so they are null.
+def dumps_json(data):
+    return json.dumps(_replace_non_finite(data), sort_keys=True, allow_nan=False).encode("utf-8")
+
+
+# Objects with NumPy numbers as Python numbers and with None instead of NaN and infinite numbers
+def _replace_non_finite(value):
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    # NumPy numbers are not serializable by json
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+
+# Removes the chart files of a previous refresh that are not used anymore
+def _remove_old_charts(old_chart_paths, chart_paths):
+    current_chart_paths = set(chart_paths.values())
+    for chart_path in old_chart_paths.values():
+        if chart_path not in current_chart_paths and os.path.exists(chart_path):
+            os.remove(chart_path)
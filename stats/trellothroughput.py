@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy
+
+from stats.trellocumulativeflow import SECONDS_PER_DAY, get_day
+
+# Likelihoods (in %) of the forecasts shown in the reports
+LIKELIHOODS = [50, 85, 95]
+
+# Horizons (in weeks) of the forecasts of the number of done cards
+FORECAST_WEEKS = [4, 8, 12]
+
+
+# Number of cards that reached the done list by day and by week (throughput).
+# A card is done since it entered the done list for the last time, that is, since the start of its current interval
+# in the done list. All the cards that are still in the done list are counted, active or not (done cards are usually
+# archived), but not the ones that were moved out of it.
+# Days are UTC days and weeks start on Monday.
+class Throughput(object):
+
+    def __init__(self, first_day, done_by_day):
+        """
+        :param first_day: first day (days since 1970-01-01).
+        :param done_by_day: array with the number of cards that reached the done list each day since first_day.
+        Its last position is the current day.
+        """
+        self.first_day = first_day
+        self.num_days = len(done_by_day)
+        self.done_by_day = done_by_day
+
+        done_days = numpy.arange(first_day, first_day + self.num_days)
+        self.first_week = _week(first_day)
+        self.num_weeks = _week(first_day + self.num_days - 1) - self.first_week + 1
+        self.done_by_week = numpy.bincount(
+            _week(done_days) - self.first_week, weights=done_by_day, minlength=self.num_weeks
+        ).astype(numpy.int64)
+
+        # The first week is only complete if the board started on Monday. The current week is never complete.
+        self.first_complete_week_index = 0 if first_day == _week_first_day(self.first_week) else 1
+
+    # Throughput of some cards
+    @staticmethod
+    def from_list_transitions(list_transitions, first_day, now_timestamp, other_done_timestamps=None):
+        """
+        :param list_transitions: ListTransitions with the movements of the cards. It does not need to be computed.
+        :param first_day: first day (days since 1970-01-01), the one of the CumulativeFlow of the cards. It is moved
+        back to the first day a card reached the done list if it is before it.
+        :param now_timestamp: current UNIX timestamp. It is in the last day.
+        :param other_done_timestamps: optional array with the UNIX timestamps when other cards that are not in
+        list_transitions (e.g. the dropped cards of a streamed board) reached the done list.
+        :return: Throughput.
+        """
+        _card_indices, list_indices, interval_starts, interval_ends = list_transitions.get_list_intervals()
+        is_done = numpy.isnan(interval_ends) & (list_indices == list_transitions.done_list_index)
+        done_timestamps = interval_starts[is_done]
+        if other_done_timestamps is not None:
+            done_timestamps = numpy.concatenate([done_timestamps, other_done_timestamps])
+        done_days = numpy.floor(done_timestamps / SECONDS_PER_DAY).astype(numpy.int64)
+        if len(done_days) > 0:
+            first_day = min(first_day, int(done_days.min()))
+        num_days = get_day(now_timestamp) - first_day + 1
+        return Throughput(first_day, numpy.bincount(done_days - first_day, minlength=num_days))
+
+    # Throughput of the done cards of each day (e.g. the ones kept by incremental stats)
+    @staticmethod
+    def from_done_by_day(done_by_day, first_day, now_timestamp):
+        """
+        :param done_by_day: dict with the number of cards that reached the done list for each day (days since
+        1970-01-01) with done cards.
+        :param first_day: first day (days since 1970-01-01), the one of the CumulativeFlow of the cards. It is moved
+        back to the first day a card reached the done list if it is before it.
+        :param now_timestamp: current UNIX timestamp. It is in the last day.
+        :return: Throughput.
+        """
+        if done_by_day:
+            first_day = min(first_day, min(done_by_day.keys()))
+        done_by_day_array = numpy.zeros(get_day(now_timestamp) - first_day + 1, dtype=numpy.int64)
+        for day, num_cards in done_by_day.items():
+            done_by_day_array[day - first_day] += num_cards
+        return Throughput(first_day, done_by_day_array)
+
+    # Day of a position of self.done_by_day (YYYY-MM-DD)
+    def get_day(self, day_index):
+        return str(numpy.datetime64(self.first_day + day_index, "D"))
+
+    # First day (Monday) of a week of self.done_by_week (YYYY-MM-DD)
+    def get_week(self, week_index):
+        return str(numpy.datetime64(_week_first_day(self.first_week + week_index), "D"))
+
+    # Done cards of the last complete weeks
+    def get_complete_weeks(self, max_weeks=None):
+        """
+        :param max_weeks: max number of weeks. By default, all the complete weeks.
+        :return: array with the number of done cards of each one of the last complete weeks (from the oldest one).
+        """
+        complete_weeks = self.done_by_week[self.first_complete_week_index:-1]
+        if max_weeks is not None:
+            complete_weeks = complete_weeks[-max_weeks:]
+        return complete_weeks
+
+
+# Monte-Carlo forecast of the cards that will be done in the next weeks, based on the throughput of some past weeks.
+# Each trial is a sequence of future weeks whose throughputs are drawn at random from the past ones. All the trials
+# are sampled at once as NumPy matrices (trials x weeks).
+class DeliveryForecast(object):
+
+    NUM_TRIALS = 10000
+
+    # Number of past complete weeks whose throughput is sampled
+    HISTORY_WEEKS = 26
+
+    # Max number of weeks simulated to finish a number of cards. Trials that need more are never finished.
+    MAX_WEEKS = 520
+
+    # Number of weeks sampled at a time for the trials that have not finished yet
+    BATCH_WEEKS = 52
+
+    def __init__(self, weekly_throughput, num_trials=NUM_TRIALS, seed=0):
+        """
+        :param weekly_throughput: number of done cards of each one of the sampled weeks. Must not be empty.
+        :param num_trials: number of trials of each forecast.
+        :param seed: seed of the random number generator, so the same throughput gives the same forecast.
+        """
+        self.weekly_throughput = numpy.asarray(weekly_throughput, dtype=numpy.int64)
+        if len(self.weekly_throughput) == 0:
+            raise ValueError(u"A forecast needs the throughput of at least one week")
+        self.num_trials = num_trials
+        self.random = numpy.random.RandomState(seed)
+
+    # Forecast of the throughput of a board
+    @staticmethod
+    def from_throughput(throughput, history_weeks=HISTORY_WEEKS):
+        """
+        :param throughput: Throughput of the board.
+        :param history_weeks: number of past complete weeks that are sampled.
+        :return: DeliveryForecast. None if the board has no complete week.
+        """
+        weekly_throughput = throughput.get_complete_weeks(history_weeks)
+        if len(weekly_throughput) == 0:
+            return None
+        return DeliveryForecast(weekly_throughput)
+
+    # Sampled throughputs of some future weeks
+    def _sample(self, num_trials, num_weeks):
+        week_indices = self.random.randint(0, len(self.weekly_throughput), size=(num_trials, num_weeks))
+        return self.weekly_throughput[week_indices]
+
+    # Number of done cards in each trial after some weeks
+    def cards_done_in(self, num_weeks):
+        return self._sample(self.num_trials, num_weeks).sum(axis=1)
+
+    # Number of weeks each trial needs to finish some cards (infinite if it needs more than MAX_WEEKS)
+    def weeks_to_finish(self, num_cards):
+        weeks = numpy.full(self.num_trials, numpy.inf)
+        if num_cards <= 0:
+            weeks[:] = 0
+            return weeks
+
+        # Weeks are sampled in batches only for the trials that have not finished yet
+        remaining_cards = numpy.full(self.num_trials, num_cards, dtype=numpy.int64)
+        pending_trials = numpy.arange(self.num_trials)
+        simulated_weeks = 0
+        while len(pending_trials) > 0 and simulated_weeks < self.__class__.MAX_WEEKS:
+            batch_weeks = min(self.__class__.BATCH_WEEKS, self.__class__.MAX_WEEKS - simulated_weeks)
+            done_cards = numpy.cumsum(self._sample(len(pending_trials), batch_weeks), axis=1)
+            is_finished_by_week = done_cards >= remaining_cards[pending_trials][:, numpy.newaxis]
+            is_finished = is_finished_by_week[:, -1]
+            weeks[pending_trials[is_finished]] = \
+                simulated_weeks + numpy.argmax(is_finished_by_week[is_finished], axis=1) + 1
+            remaining_cards[pending_trials[~is_finished]] -= done_cards[~is_finished, -1]
+            pending_trials = pending_trials[~is_finished]
+            simulated_weeks += batch_weeks
+        return weeks
+
+    # Number of cards that will be done in some weeks with each likelihood
+    def get_cards_forecast(self, num_weeks, likelihoods=None):
+        """
+        :param num_weeks: number of weeks.
+        :param likelihoods: list of likelihoods (between 0 and 100). By default, LIKELIHOODS.
+        :return: dict with the number of cards that will be done at least in that number of weeks with each
+        likelihood.
+        """
+        if likelihoods is None:
+            likelihoods = LIKELIHOODS
+        cards = self.cards_done_in(num_weeks)
+        return {
+            likelihood: int(numpy.percentile(cards, 100 - likelihood, interpolation="lower"))
+            for likelihood in likelihoods
+        }
+
+    # Number of weeks some cards will need to be done with each likelihood
+    def get_weeks_forecast(self, num_cards, likelihoods=None):
+        """
+        :param num_cards: number of cards.
+        :param likelihoods: list of likelihoods (between 0 and 100). By default, LIKELIHOODS.
+        :return: dict with the number of weeks the cards will need at most with each likelihood. None if they will
+        need more than MAX_WEEKS.
+        """
+        if likelihoods is None:
+            likelihoods = LIKELIHOODS
+        weeks = numpy.sort(self.weeks_to_finish(num_cards))
+        weeks_forecast = {}
+        for likelihood in likelihoods:
+            likelihood_weeks = weeks[int(math.ceil(likelihood / 100.0 * len(weeks))) - 1]
+            weeks_forecast[likelihood] = int(likelihood_weeks) if numpy.isfinite(likelihood_weeks) else None
+        return weeks_forecast
+
+    # Forecasts of the cards done in the next FORECAST_WEEKS weeks and of the weeks needed to finish some cards
+    def get_summary(self, num_cards):
+        return {
+            "history_weeks": len(self.weekly_throughput),
+            "num_trials": self.num_trials,
+            "avg_weekly_throughput": float(self.weekly_throughput.mean()),
+            "cards_by_weeks": {num_weeks: self.get_cards_forecast(num_weeks) for num_weeks in FORECAST_WEEKS},
+            "remaining_cards": num_cards,
+            "weeks_to_finish": self.get_weeks_forecast(num_cards)
+        }
+
+
+# Week of a day (number of days since 1970-01-01, a Thursday). Weeks start on Monday.
+def _week(day):
+    return (day + 3) // 7
+
+
+def _week_first_day(week):
+    return week * 7 - 3
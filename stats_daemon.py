@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import mimetypes
+import os
+import re
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import settings
+from auth.connector import TrelloConnector
+from stats import trellostatsservice
+from stats.trelloboardconfiguration import TrelloBoardConfiguration
+from stats.trellostatsservice import TrelloStatsService
+from stats_extractor import get_configuration_file_paths
+
+
+# Local HTTP API of the stats service:
+# - GET /boards: status of each board.
+# - GET /boards/<board>/stats: stats of the board.
+# - GET /boards/<board>/cards/<card id>: stats of an active card.
+# - GET /boards/<board>/charts: names of the charts of the board.
+# - GET /boards/<board>/charts/<chart>: image of a chart.
+# - POST /boards/<board>/refresh: queues a refresh of the board (e.g. from a Trello webhook or a cron job).
+# Boards are identified by their slugified name.
+class StatsRequestHandler(BaseHTTPRequestHandler):
+
+    # TrelloStatsService whose boards are served. It is set by serve.
+    service = None
+
+    GET_ROUTES = [
+        (re.compile(r"^/boards/?$"), "_get_boards"),
+        (re.compile(r"^/boards/(?P<board_key>[^/]+)/stats/?$"), "_get_board_stats"),
+        (re.compile(r"^/boards/(?P<board_key>[^/]+)/cards/(?P<card_id>[^/]+)/?$"), "_get_card_stats"),
+        (re.compile(r"^/boards/(?P<board_key>[^/]+)/charts/?$"), "_get_charts"),
+        (re.compile(r"^/boards/(?P<board_key>[^/]+)/charts/(?P<chart_name>[^/]+)/?$"), "_get_chart")
+    ]
+
+    POST_ROUTES = [
+        (re.compile(r"^/boards/(?P<board_key>[^/]+)/refresh/?$"), "_post_refresh")
+    ]
+
+    def do_GET(self):
+        self._dispatch(self.__class__.GET_ROUTES)
+
+    def do_POST(self):
+        self._dispatch(self.__class__.POST_ROUTES)
+
+    def _dispatch(self, routes):
+        path = self.path.split("?", 1)[0]
+        for route_regex, handler_name in routes:
+            matches = route_regex.match(path)
+            if matches:
+                return getattr(self, handler_name)(**matches.groupdict())
+        return self._send_json(404, {"error": u"Not found"})
+
+    def _get_boards(self):
+        boards = self.__class__.service.boards
+        return self._send_json(200, [boards[board_key].get_status() for board_key in sorted(boards.keys())])
+
+    def _get_board_stats(self, board_key):
+        state = self._get_board_state(board_key)
+        if state is None:
+            return None
+        return self._send(200, "application/json", state.stats_json)
+
+    def _get_card_stats(self, board_key, card_id):
+        state = self._get_board_state(board_key)
+        if state is None:
+            return None
+        card_stats = trellostatsservice.serialize_card_stats(state.stat_extractor, state.stats, card_id)
+        if card_stats is None:
+            return self._send_json(404, {"error": u"Card {0} is not an active card".format(card_id)})
+        return self._send_json(200, card_stats)
+
+    def _get_charts(self, board_key):
+        state = self._get_board_state(board_key)
+        if state is None:
+            return None
+        return self._send_json(200, sorted(state.chart_paths.keys()))
+
+    def _get_chart(self, board_key, chart_name):
+        state = self._get_board_state(board_key)
+        if state is None:
+            return None
+        chart_path = state.chart_paths.get(chart_name)
+        if chart_path is None or not os.path.exists(chart_path):
+            return self._send_json(404, {"error": u"Chart {0} not found".format(chart_name)})
+        with io.open(chart_path, "rb") as chart_file:
+            chart = chart_file.read()
+        return self._send(200, mimetypes.guess_type(chart_path)[0] or "application/octet-stream", chart)
+
+    def _post_refresh(self, board_key):
+        if not self.__class__.service.request_refresh(board_key):
+            return self._send_json(404, {"error": u"Board {0} not found".format(board_key)})
+        return self._send_json(202, {"board": board_key, "queued": True})
+
+    # Last computed stats of a board. If they are not available, an error response is sent and None is returned.
+    def _get_board_state(self, board_key):
+        board = self.__class__.service.get_board(board_key)
+        if board is None:
+            self._send_json(404, {"error": u"Board {0} not found".format(board_key)})
+            return None
+        state = board.state
+        if state is None:
+            self._send_json(503, board.get_status())
+            return None
+        return state
+
+    def _send_json(self, status_code, data):
+        return self._send(status_code, "application/json", trellostatsservice.dumps_json(data))
+
+    def _send(self, status_code, content_type, body):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# HTTP server that answers each request in its own thread, so slow clients do not block the rest
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(service, host, port):
+    """
+    Starts the service and answers HTTP requests until the process is interrupted.
+    :param service: TrelloStatsService.
+    :param host: address where the HTTP server listens.
+    :param port: port where the HTTP server listens.
+    """
+    StatsRequestHandler.service = service
+    server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    service.start()
+    print(u"Serving stats of {0} boards in http://{1}:{2}/boards".format(len(service.boards), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=u"Serve the stats of Trello boards kept in memory")
+    parser.add_argument("configuration_path", help=u"configuration file or directory of configuration files")
+    parser.add_argument("--host", default=u"127.0.0.1", help=u"address where the HTTP server listens")
+    parser.add_argument("--port", type=int, default=8080, help=u"port where the HTTP server listens")
+    parser.add_argument("--refresh-interval", dest="refresh_interval", type=float, default=900.0,
+                        help=u"seconds between two refreshes of all the boards (0 to only refresh them on request)")
+    args = parser.parse_args()
+
+    settings.assert_credentials()
+
+    if os.path.isdir(args.configuration_path):
+        configuration_file_paths = get_configuration_file_paths(args.configuration_path)
+    else:
+        configuration_file_paths = [args.configuration_path]
+
+    configurations = [
+        TrelloBoardConfiguration.load_from_file(configuration_file_path)
+        for configuration_file_path in configuration_file_paths
+    ]
+
+    trello_connector = TrelloConnector(
+        settings.TRELLO_API_KEY, settings.TRELLO_API_SECRET, settings.TRELLO_TOKEN, settings.TRELLO_TOKEN_SECRET
+    )
+    try:
+        service = TrelloStatsService(trello_connector, configurations, refresh_interval=args.refresh_interval or None)
+    except ValueError as error:
+        parser.error(error)
+    serve(service, args.host, args.port)
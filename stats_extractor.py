@@ -1,52 +1,291 @@
 # -*- coding: utf-8 -*-
+import argparse
+import datetime
+import io
+import multiprocessing
 import os
 import sys
+import traceback
 
 import re
 
-import settings
-from auth.connector import TrelloConnector
-from stats import summary
+from stats import instrumentation
 from stats.trelloboardconfiguration import TrelloBoardConfiguration
 
+# Modules that depend on NumPy, pygal, dateutil, requests, py-trello or settings_local are imported in the functions
+# that use them, so --help and --validate-config start without loading them.
 
-def extract_stats(configuration_file_path):
+
+# TrelloConnector of each one of the worker processes
+worker_trello_connector = None
+
+
+def extract_stats(configuration_file_path, trello_connector, dump_file_path=None, record_file_path=None, chart_jobs=1):
     """
     Extract stats for a given configuration file that defines a trello board and other settings.
     :param configuration_file_path: file path where the configuration file is.
+    :param trello_connector: TrelloConnector used to get information.
+    :param dump_file_path: if present, the board is loaded from this dump file instead of Trello API.
+    :param record_file_path: if present, a dump of the board is written in this file.
+    :param chart_jobs: number of processes that render the charts.
     """
+    from stats import summary
+    from stats import trelloboarddump
+
     configuration = TrelloBoardConfiguration.load_from_file(configuration_file_path)
-    summary.make(trello_connector, configuration)
+    configuration.chart_jobs = chart_jobs
+    configuration.keep_board_json = bool(record_file_path)
+    if record_file_path and configuration.streaming_stats:
+        raise ValueError(u"Streamed boards can not be recorded, disable STREAMING_STATS to record them")
+    snapshot = None
+    if dump_file_path:
+        with instrumentation.timer("dump.load"):
+            snapshot = trelloboarddump.load(dump_file_path)
+    summary_creator = summary.make(trello_connector, configuration, snapshot)
+    if record_file_path:
+        with instrumentation.timer("dump.save"):
+            trelloboarddump.save(summary_creator.stat_extractor.snapshot, record_file_path)
 
 
 def file_is_configuration_file(_file_name):
     return re.match(r"^[^\.]+\.conf\.txt", _file_name)
 
+
+# Paths of the configuration files of a directory
+def get_configuration_file_paths(configuration_directory_path):
+    return [
+        u"{0}/{1}".format(configuration_directory_path, file_name)
+        for file_name in sorted(os.listdir(configuration_directory_path)) if file_is_configuration_file(file_name)
+    ]
+
+
+# Initializes the worker process with its own TrelloConnector.
+# All the workers use the same token, so each one of them gets an equal share of the rate limit of the token.
+def init_worker(api_key, api_secret, token, token_secret, jobs=1):
+    from auth.connector import TrelloConnector
+    from stats.trellofetcher import TrelloFetcher
+
+    global worker_trello_connector
+    worker_trello_connector = TrelloConnector(
+        api_key, api_secret, token, token_secret, rate_limit=max(1, TrelloFetcher.DEFAULT_RATE_LIMIT // max(1, jobs))
+    )
+
+
+def extract_stats_in_worker(configuration_file_path, chart_jobs=1):
+    """
+    Extract stats for a configuration file in a worker process.
+    Errors are isolated: they don't stop the extraction of the stats of other boards.
+    :param configuration_file_path: file path where the configuration file is.
+    :param chart_jobs: number of processes that render the charts.
+    :return: tuple with the configuration file path and the error traceback (None if there was no error).
+    """
+    try:
+        extract_stats(configuration_file_path, worker_trello_connector, chart_jobs=chart_jobs)
+        return configuration_file_path, None
+    except Exception:
+        error = traceback.format_exc()
+        _write_error_file(configuration_file_path, error)
+        return configuration_file_path, error
+
+
+# Writes the error of the extraction of the stats of a board in its output directory
+def _write_error_file(configuration_file_path, error):
+    import settings
+
+    try:
+        configuration = TrelloBoardConfiguration.load_from_file(configuration_file_path)
+    except Exception:
+        # If the configuration file is not right, there is no output directory to write the error
+        return False
+    if not os.path.exists(configuration.output_dir):
+        os.makedirs(configuration.output_dir)
+    now_str = datetime.datetime.now(settings.TIMEZONE).strftime("%Y_%m_%d_%H_%M_%S")
+    error_file_path = u"{0}/errors-{1}.txt".format(configuration.output_dir, now_str)
+    with io.open(error_file_path, "w", encoding="utf-8") as error_file:
+        error_file.write(error.decode("utf-8") if isinstance(error, bytes) else error)
+    return True
+
+
+def extract_stats_from_directory(configuration_directory_path, jobs, credentials, chart_jobs=1):
+    """
+    Extract stats for each one of the configuration files of a directory.
+    :param configuration_directory_path: directory where the configuration files are.
+    :param jobs: number of boards processed concurrently.
+    :param credentials: tuple with the api key, api secret, token and token secret.
+    :param chart_jobs: number of processes that render the charts of each board. Only used if boards are
+    processed one by one (jobs <= 1).
+    :return: list of tuples with the configuration file path and its error (None if there was no error).
+    """
+    configuration_file_paths = get_configuration_file_paths(configuration_directory_path)
+
+    if jobs <= 1:
+        init_worker(*credentials)
+        results = []
+        for configuration_file_path in configuration_file_paths:
+            print(u"Processing {0}".format(configuration_file_path))
+            results.append(extract_stats_in_worker(configuration_file_path, chart_jobs))
+        return results
+
+    pool = multiprocessing.Pool(processes=jobs, initializer=init_worker, initargs=tuple(credentials) + (jobs,))
+    try:
+        results = []
+        for result in pool.imap_unordered(extract_stats_in_worker, configuration_file_paths):
+            print(u"Processed {0}".format(result[0]))
+            results.append(result)
+        return results
+    finally:
+        pool.close()
+        pool.join()
+
+
+def extract_portfolio_stats_from_directory(configuration_directory_path, portfolio_output_dir, trello_connector,
+                                           chart_jobs=1):
+    """
+    Extract stats for each one of the configuration files of a directory in this process, aggregating them in a
+    portfolio report.
+    :param configuration_directory_path: directory where the configuration files are.
+    :param portfolio_output_dir: directory where the portfolio report is written.
+    :param trello_connector: TrelloConnector used to get information.
+    :param chart_jobs: number of processes that render the charts of each board.
+    :return: list of tuples with the configuration file path and its error (None if there was no error).
+    """
+    from stats.trelloportfolio import PortfolioConfiguration, TrelloPortfolio
+
+    portfolio = TrelloPortfolio(trello_connector, PortfolioConfiguration(portfolio_output_dir))
+    results = []
+    for configuration_file_path in get_configuration_file_paths(configuration_directory_path):
+        print(u"Processing {0}".format(configuration_file_path))
+        try:
+            configuration = TrelloBoardConfiguration.load_from_file(configuration_file_path)
+            configuration.chart_jobs = chart_jobs
+            portfolio.add_board(configuration)
+            results.append((configuration_file_path, None))
+        except Exception:
+            error = traceback.format_exc()
+            _write_error_file(configuration_file_path, error)
+            results.append((configuration_file_path, error))
+    portfolio.make_report()
+    return results
+
+
+# Checks the configuration files without connecting to Trello API
+def validate_configuration_files(configuration_file_paths):
+    """
+    Loads each configuration file, printing if it is right or its error.
+    :param configuration_file_paths: paths of the configuration files.
+    :return: list of tuples with the configuration file path and its error (None if there was no error).
+    """
+    results = []
+    for configuration_file_path in configuration_file_paths:
+        try:
+            TrelloBoardConfiguration.load_from_file(configuration_file_path)
+        except Exception as e:
+            error = u"{0}: {1}".format(type(e).__name__, e)
+            print(u"- {0}: {1}".format(configuration_file_path, error))
+            results.append((configuration_file_path, error))
+        else:
+            print(u"- {0}: OK".format(configuration_file_path))
+            results.append((configuration_file_path, None))
+    return results
+
+
+# Prints the report of the extraction of the stats of a directory of configuration files
+def print_report(results):
+    failed_results = [(configuration_file_path, error) for configuration_file_path, error in results if error]
+    print(u"{0} boards processed: {1} ok, {2} with errors".format(
+        len(results), len(results) - len(failed_results), len(failed_results))
+    )
+    for configuration_file_path, error in failed_results:
+        print(u"- Error in {0}:".format(configuration_file_path))
+        print(error)
+
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description=u"Extract stats of Trello boards")
+    parser.add_argument("configuration_path", help=u"configuration file or directory of configuration files")
+    parser.add_argument("--jobs", type=int, default=1, help=u"number of boards processed concurrently")
+    parser.add_argument("--chart-jobs", dest="chart_jobs", type=int, default=1,
+                        help=u"number of processes that render the charts of each board")
+    parser.add_argument("--from-dump", dest="dump_file_path",
+                        help=u"board dump (.json or .json.gz) used instead of Trello API")
+    parser.add_argument("--record", dest="record_file_path",
+                        help=u"file (.json or .json.gz) where the dump of the board will be written")
+    parser.add_argument("--portfolio", dest="portfolio_output_dir",
+                        help=u"directory where the report with the aggregated stats of all the boards of a directory "
+                             u"of configuration files will be written (boards are processed one by one)")
+    parser.add_argument("--validate-config", dest="validate_config", action="store_true",
+                        help=u"only check the configuration files, without connecting to Trello API")
+    parser.add_argument("--trace", dest="trace_file_path",
+                        help=u"JSON file where the time of each phase, the counters and the HTTP stats will be written")
+    parser.add_argument("--chrome-trace", dest="chrome_trace_file_path",
+                        help=u"file where the trace will be written in Chrome trace event format")
+    args = parser.parse_args()
+
+    if (args.dump_file_path or args.record_file_path) and not os.path.isfile(args.configuration_path):
+        parser.error(u"--from-dump and --record need a configuration file, not a directory")
+
+    if args.portfolio_output_dir and not os.path.isdir(args.configuration_path):
+        parser.error(u"--portfolio needs a directory of configuration files")
+
+    if (args.trace_file_path or args.chrome_trace_file_path) and not os.path.isfile(args.configuration_path):
+        parser.error(u"--trace and --chrome-trace need a configuration file, not a directory")
+
+    if args.validate_config:
+        if os.path.isdir(args.configuration_path):
+            validation_results = validate_configuration_files(get_configuration_file_paths(args.configuration_path))
+        else:
+            validation_results = validate_configuration_files([args.configuration_path])
+        if any(error for configuration_file_path, error in validation_results):
+            sys.exit(1)
+        sys.exit(0)
+
+    import settings
+    from auth.connector import TrelloConnector
+
+    # Trello API credentials are not needed when the board is loaded from a dump
+    if not args.dump_file_path:
+        settings.assert_credentials()
+
     api_key = settings.TRELLO_API_KEY
     api_secret = settings.TRELLO_API_SECRET
     token = settings.TRELLO_TOKEN
     token_secret = settings.TRELLO_TOKEN_SECRET
 
-    trello_connector = TrelloConnector(api_key, api_secret, token, token_secret)
-
-    if len(sys.argv) < 2:
-        raise ValueError(u"Error. Use python stats_extractor.py <configuration_file_path>")
-
     # Configuration file path
-    configuration_path = sys.argv[1]
+    configuration_path = args.configuration_path
 
     # If configuration path is a file, extract stats of the board written in this file
     if os.path.isfile(configuration_path):
-        extract_stats(configuration_path)
+        trello_connector = None
+        if not args.dump_file_path:
+            trello_connector = TrelloConnector(api_key, api_secret, token, token_secret)
+        if args.trace_file_path or args.chrome_trace_file_path:
+            instrumentation.enable()
+        extract_stats(configuration_path, trello_connector, args.dump_file_path, args.record_file_path,
+                      args.chart_jobs)
+        if instrumentation.is_enabled():
+            instrumentation.print_report()
+            if args.trace_file_path:
+                instrumentation.write_trace(args.trace_file_path)
+            if args.chrome_trace_file_path:
+                instrumentation.write_chrome_trace(args.chrome_trace_file_path)
 
     # Otherwise, if configuration path is a directory, loop through directory files and extract stats
     # for each of these files
     elif os.path.isdir(configuration_path):
-        for file_name in os.listdir(configuration_path):
-            if file_is_configuration_file(file_name):
-                print(u"Processing {0}".format(file_name))
-                extract_stats(u"{0}/{1}".format(configuration_path, file_name))
-
+        if args.portfolio_output_dir:
+            directory_results = extract_portfolio_stats_from_directory(
+                configuration_path, args.portfolio_output_dir,
+                TrelloConnector(api_key, api_secret, token, token_secret), args.chart_jobs
+            )
+        else:
+            directory_results = extract_stats_from_directory(
+                configuration_path, args.jobs, (api_key, api_secret, token, token_secret), args.chart_jobs
+            )
+        print_report(directory_results)
+        if any(error for configuration_file_path, error in directory_results):
+            sys.exit(1)
 
+    else:
+        raise ValueError(u"Error. Use python stats_extractor.py <configuration_file_path> [--jobs N]")
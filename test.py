@@ -10,6 +10,8 @@ from stats.trelloboardconfiguration import TrelloBoardConfiguration
 
 if __name__ == "__main__":
 
+    settings.assert_credentials()
+
     api_key = settings.TRELLO_API_KEY
     api_secret = settings.TRELLO_API_SECRET
     token = settings.TRELLO_TOKEN
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import copy
+import re
+
+import requests
+
+# Types of the actions of each action filter
+ACTION_FILTER_TYPES = {
+    u"updateCard:idList": u"updateCard",
+    u"createCard": u"createCard",
+    u"commentCard": u"commentCard",
+    u"updateComment": u"updateComment",
+    u"deleteComment": u"deleteComment"
+}
+
+
+# Fetcher that answers the requests of the board snapshots from a board in memory, paginated as Trello API does.
+# The board is the only board of the user.
+# Actions can be hidden to simulate the ones that did not exist yet when a page was read.
+class FakeFetcher(object):
+
+    def __init__(self, board_json, actions_json):
+        """
+        :param board_json: board with its lists, members, labels and cards.
+        :param actions_json: card actions of the board, from the newest to the oldest one.
+        """
+        self.board_json = board_json
+        self.actions_json = actions_json
+        self.hidden_action_ids = set()
+        self.requests = []
+
+    def fetch_json(self, uri_path, query_params=None):
+        query_params = query_params or {}
+        self.requests.append((uri_path, dict(query_params)))
+        if uri_path == u"/members/me/boards":
+            return [{"id": self.board_json["id"], "name": self.board_json["name"]}]
+        if uri_path.split(u"/")[2] != self.board_json["id"]:
+            # Trello answers 404 to the requests of boards that do not exist
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError(u"404 Client Error: Not Found", response=response)
+        if re.match(r"^/boards/\w+$", uri_path):
+            board_json = {key: value for key, value in self.board_json.items() if key != "cards"}
+            if query_params.get("cards"):
+                board_json["cards"] = self.board_json["cards"]
+            return copy.deepcopy(board_json)
+        if uri_path.endswith(u"/cards"):
+            cards_json = sorted(self.board_json["cards"], key=lambda card_json: card_json["id"], reverse=True)
+            cards_json = [card_json for card_json in cards_json
+                          if not query_params.get("before") or card_json["id"] < query_params["before"]]
+            return copy.deepcopy(cards_json[0:query_params["limit"]])
+        if uri_path.endswith(u"/actions"):
+            action_type = ACTION_FILTER_TYPES[query_params["filter"]]
+            actions_json = [
+                action for action in self.actions_json
+                if action["type"] == action_type and action["id"] not in self.hidden_action_ids and
+                _is_after(action, query_params.get("since")) and _is_before(action, query_params.get("before"))
+            ]
+            return copy.deepcopy(actions_json[0:query_params["limit"]])
+        raise ValueError(u"Unknown path {0}".format(uri_path))
+
+    def fetch_batch(self, requests_):
+        return [self.fetch_json(uri_path, query_params) for uri_path, query_params in requests_]
+
+    def fetch_all(self, jobs):
+        for key in sorted(jobs.keys()):
+            yield key, jobs[key]()
+
+    # Number of requests of a path
+    def count_requests(self, uri_path):
+        return len([request for request in self.requests if request[0] == uri_path])
+
+
+# Trello bounds are action ids (exclusive) or dates (since is inclusive and before is exclusive)
+def _is_after(action, since):
+    if not since:
+        return True
+    if len(since) == 24:
+        return action["id"] > since
+    return action["date"][0:10] >= since
+
+
+def _is_before(action, before):
+    if not before:
+        return True
+    if len(before) == 24:
+        return action["id"] < before
+    return action["date"][0:10] < before
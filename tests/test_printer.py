@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import syntheticboard
+from printer.printer import Printer
+
+
+class PrinterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.configuration = syntheticboard.get_configuration(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_complete_report_gets_its_name(self):
+        with Printer(u"report", self.configuration, print_in_stdio=False) as printer:
+            printer.p(u"Line")
+            # While the report is being written, it only has a temporary name
+            self.assertEqual(os.listdir(self.output_dir), [os.path.basename(printer.temporary_output_filename)])
+        self.assertEqual(os.listdir(self.output_dir), [os.path.basename(printer.output_filename)])
+        with open(printer.output_filename, "rb") as output_file:
+            self.assertEqual(output_file.read(), b"Line\n")
+
+    def test_failed_report_is_removed(self):
+        with self.assertRaises(ValueError):
+            with Printer(u"report", self.configuration, print_in_stdio=False, gzip_output=True) as printer:
+                printer.p(u"Line")
+                raise ValueError(u"Stats could not be computed")
+        self.assertTrue(printer.output_file.closed)
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_compressed_report(self):
+        with Printer(u"report", self.configuration, print_in_stdio=False, gzip_output=True) as printer:
+            printer.p(u"Línea")
+        self.assertTrue(printer.output_filename.endswith(u".txt.gz"))
+        with gzip.open(printer.output_filename, "rb") as output_file:
+            self.assertEqual(output_file.read().decode("utf-8"), u"Línea\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import copy
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import syntheticboard
+from stats.trelloactioncache import TrelloActionCache
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+from tests.fakefetcher import FakeFetcher
+
+
+# Copy of an action of a type with another id and date
+def _copy_action(actions_json, action_type, action_id, action_date):
+    action = copy.deepcopy([action for action in actions_json if action["type"] == action_type][0])
+    action["id"] = action_id
+    action["date"] = action_date
+    return action
+
+
+class TrelloActionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        snapshot = syntheticboard.generate(num_cards=50)
+        self.board_json = snapshot.board_json
+        self.actions_json = snapshot.actions_json
+        self.board_id = snapshot.id
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _fetch(self, fetcher):
+        action_cache = TrelloActionCache(self.cache_dir, self.board_id)
+        return TrelloBoardSnapshot.fetch(fetcher, self.board_id, action_cache)
+
+    def test_actions_fetched_after_newer_actions_of_other_type_are_not_missed(self):
+        # A comment is made while the movements are being fetched: it is not in the first page of comments, but it
+        # is older than a movement that was fetched
+        late_comment = _copy_action(
+            self.actions_json, u"commentCard", u"6000000000000000000000a1", u"2021-01-01T10:00:00.000Z"
+        )
+        movement = _copy_action(
+            self.actions_json, u"updateCard", u"6000000000000000000000a2", u"2021-01-01T11:00:00.000Z"
+        )
+        fetcher = FakeFetcher(self.board_json, [movement, late_comment] + self.actions_json)
+        fetcher.hidden_action_ids.add(late_comment["id"])
+
+        first_snapshot = self._fetch(fetcher)
+        self.assertNotIn(late_comment["id"], [action["id"] for action in first_snapshot.actions_json])
+
+        fetcher.hidden_action_ids.clear()
+        fetcher.requests = []
+        second_snapshot = self._fetch(fetcher)
+        self.assertEqual(
+            [action["id"] for action in second_snapshot.actions_json],
+            [action["id"] for action in fetcher.actions_json]
+        )
+        # Only the actions newer than the newest cached action of each type are fetched again
+        comment_requests = [
+            query_params for uri_path, query_params in fetcher.requests if query_params.get("filter") == u"commentCard"
+        ]
+        self.assertNotEqual(comment_requests[0]["since"], movement["id"])
+
+    def test_cached_actions_are_not_fetched_again(self):
+        fetcher = FakeFetcher(self.board_json, self.actions_json)
+        self._fetch(fetcher)
+        fetcher.requests = []
+        snapshot = self._fetch(fetcher)
+        self.assertEqual(
+            [action["id"] for action in snapshot.actions_json], [action["id"] for action in self.actions_json]
+        )
+        self.assertEqual(len(TrelloActionCache(self.cache_dir, self.board_id).load()), len(self.actions_json))
+
+    def test_cached_comments_have_the_text_of_their_last_edit(self):
+        fetcher = FakeFetcher(self.board_json, self.actions_json)
+        self._fetch(fetcher)
+
+        comments = [action for action in self.actions_json if action["type"] == "commentCard"]
+        edited_comment, deleted_comment = comments[0:2]
+        edits = [
+            _copy_action(self.actions_json, u"commentCard", u"6000000000000000000000b3", u"2021-01-01T12:00:00.000Z"),
+            _copy_action(self.actions_json, u"commentCard", u"6000000000000000000000b2", u"2021-01-01T11:00:00.000Z"),
+            _copy_action(self.actions_json, u"commentCard", u"6000000000000000000000b1", u"2021-01-01T10:00:00.000Z")
+        ]
+        for edit, (edit_type, comment, text) in zip(edits, [
+            (u"deleteComment", deleted_comment, None),
+            (u"updateComment", edited_comment, u"plus! 3/5"),
+            (u"updateComment", edited_comment, u"plus! 1/1")
+        ]):
+            edit["type"] = edit_type
+            edit["data"] = {"action": {"id": comment["id"], "text": text}, "card": comment["data"]["card"]}
+        # Trello returns the edited text of the comments and does not return the deleted ones
+        fetcher.actions_json = edits + [
+            dict(action, data=dict(action["data"], text=u"plus! 3/5"))
+            if action["id"] == edited_comment["id"] else action
+            for action in self.actions_json if action["id"] != deleted_comment["id"]
+        ]
+
+        snapshot = self._fetch(fetcher)
+        comments_by_id = {comment["id"]: comment for card in snapshot.cards for comment in card.comment_actions}
+        self.assertEqual(comments_by_id[edited_comment["id"]]["data"]["text"], u"plus! 3/5")
+        self.assertNotIn(deleted_comment["id"], comments_by_id)
+
+    def test_cache_with_a_single_high_water_mark_is_emptied(self):
+        action_cache = TrelloActionCache(self.cache_dir, self.board_id)
+        action_cache.append(self.actions_json, {u"createCard": self.actions_json[0]})
+        with open(action_cache.state_file_path, "w") as state_file:
+            state_file.write('{"last_action_id": "%s", "date_interval": null}\n' % self.actions_json[0]["id"])
+        self.assertEqual(TrelloActionCache(self.cache_dir, self.board_id).load(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
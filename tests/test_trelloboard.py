@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import syntheticboard
+from stats.trelloboard import fetch_board_snapshot
+from stats.trelloboardindex import TrelloBoardIndex
+from tests.fakefetcher import FakeFetcher
+
+
+# Connector that only has a board index
+class FakeConnector(object):
+
+    def __init__(self, board_index):
+        self.board_index = board_index
+
+    def get_board_index(self):
+        return self.board_index
+
+
+class FetchBoardSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        snapshot = syntheticboard.generate(num_cards=20)
+        self.fetcher = FakeFetcher(snapshot.board_json, snapshot.actions_json)
+        self.board_id = snapshot.id
+        self.board_index = TrelloBoardIndex(os.path.join(self.output_dir, u"board_index.json"))
+        self.configuration = syntheticboard.get_configuration(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _fetch(self, indexed_board_id):
+        self.board_index.board_ids_by_name = {self.configuration.board_name: indexed_board_id}
+        return fetch_board_snapshot(FakeConnector(self.board_index), self.fetcher, self.configuration)
+
+    # Requests of the actions of a board
+    def _count_action_requests(self, board_id):
+        return self.fetcher.count_requests(u"/boards/{0}/actions".format(board_id))
+
+    def test_indexed_board_is_fetched_without_listing_the_boards(self):
+        snapshot = self._fetch(self.board_id)
+        self.assertEqual(snapshot.id, self.board_id)
+        self.assertEqual(self.fetcher.count_requests(u"/members/me/boards"), 0)
+
+    def test_stale_board_is_only_checked_by_its_name(self):
+        stale_board_id = u"0" * 24
+        snapshot = self._fetch(stale_board_id)
+        self.assertEqual(snapshot.id, self.board_id)
+        self.assertEqual(self.board_index.board_ids_by_name[self.configuration.board_name], self.board_id)
+        self.assertEqual(self.fetcher.count_requests(u"/members/me/boards"), 1)
+        self.assertEqual(self.fetcher.requests[0], (u"/boards/{0}".format(stale_board_id), {"fields": "name"}))
+        self.assertEqual(self._count_action_requests(stale_board_id), 0)
+
+    def test_board_that_is_not_indexed_is_not_checked(self):
+        self.board_index.board_ids_by_name = {}
+        snapshot = fetch_board_snapshot(FakeConnector(self.board_index), self.fetcher, self.configuration)
+        self.assertEqual(snapshot.id, self.board_id)
+        self.assertEqual(self.fetcher.requests[0][0], u"/members/me/boards")
+        self.assertNotIn((u"/boards/{0}".format(self.board_id), {"fields": "name"}), self.fetcher.requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
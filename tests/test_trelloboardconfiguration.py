@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from stats.trelloboardconfiguration import TrelloBoardConfiguration
+
+# Lines of a configuration file with all its parameters, except the custom workflows, that span several lines
+PARAMETER_LINES = [
+    u"BOARD_NAME: My Tasks\n",
+    u"BOARD_ID: 0123456789abcdef01234567\n",
+    u"DEVELOPMENT_LIST: Development\n",
+    u"DONE_LIST: Done\n",
+    u"CARD_ACTION_FILTER: [2016-03-01, 2016-04-01]\n",
+    u"CARD_IS_ACTIVE_FUNCTION: not card.closed\n",
+    u"COMMENT_SPENT_ESTIMATED_TIME_REGEX: PLUS_FOR_TRELLO_REGEX\n",
+    u"OUTPUT_DIR: ./results/my-tasks\n"
+]
+
+WORKFLOW_LINES = [
+    u"CUSTOM_WORKFLOWS:\n",
+    u"- Deployment\n",
+    u"  - LISTS: Pending deployment\n",
+    u"  - DONE_LISTS: Done\n"
+]
+
+
+class TrelloBoardConfigurationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, u"board.conf.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _load(self, lines):
+        with open(self.file_path, "w") as configuration_file:
+            configuration_file.write(u"".join(lines).encode("utf-8"))
+        return TrelloBoardConfiguration.load_from_file(self.file_path)
+
+    def _assert_parameters(self, configuration):
+        self.assertEqual(configuration.board_name, "My Tasks")
+        self.assertEqual(configuration.board_id, "0123456789abcdef01234567")
+        self.assertEqual(configuration.development_list_name, u"Development")
+        self.assertEqual(configuration.done_list_name, u"Done")
+        self.assertEqual(configuration.card_action_filter, ["2016-03-01", "2016-04-01"])
+        self.assertEqual(configuration.card_is_active_function_code, "not card.closed")
+        self.assertEqual(configuration.output_dir, "./results/my-tasks")
+
+    def test_options_are_read_in_any_order(self):
+        # Streaming stats can not be used with the action cache nor incremental stats
+        option_names = [
+            option_name for option_name in TrelloBoardConfiguration.BOOLEAN_OPTIONS.keys()
+            if option_name != u"STREAMING_STATS"
+        ]
+        random_ = random.Random(0)
+        for _shuffle_index in range(20):
+            lines = PARAMETER_LINES + [u"{0}: TRUE\n".format(option_name) for option_name in option_names]
+            random_.shuffle(lines)
+            # Workflows and blank lines between some parameters
+            lines.insert(random_.randint(0, len(lines)), u"".join(WORKFLOW_LINES))
+            lines.insert(random_.randint(0, len(lines)), u"\n")
+            configuration = self._load(lines)
+            self._assert_parameters(configuration)
+            for option_name in option_names:
+                parameter_name = TrelloBoardConfiguration.BOOLEAN_OPTIONS[option_name]
+                self.assertTrue(getattr(configuration, parameter_name), u"{0} in {1}".format(option_name, lines))
+            self.assertFalse(configuration.streaming_stats)
+            self.assertEqual([workflow.name for workflow in configuration.custom_workflows], ["Deployment"])
+
+    def test_consecutive_options_are_not_skipped(self):
+        configuration = self._load(PARAMETER_LINES + [
+            u"INCREMENTAL_STATS: TRUE\n", u"ACTION_CACHE: TRUE\n", u"CHART_CACHE: TRUE\n", u"REPORT_QUIET: TRUE\n"
+        ])
+        self._assert_parameters(configuration)
+        self.assertTrue(configuration.incremental_stats)
+        self.assertTrue(configuration.action_cache)
+        self.assertTrue(configuration.chart_cache)
+        self.assertTrue(configuration.report_quiet)
+        self.assertFalse(configuration.censored)
+        self.assertFalse(configuration.report_gzip)
+
+    def test_streaming_stats_can_not_be_used_with_the_action_cache(self):
+        with self.assertRaises(ValueError):
+            self._load(PARAMETER_LINES + [u"STREAMING_STATS: TRUE\n", u"ACTION_CACHE: TRUE\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+
+from benchmark import silenced_stdout
+from benchmarks import syntheticboard
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+from stats.trelloboardstream import StreamedBoardSnapshot
+from stats.trellostatsextractor import TrelloStatsExtractor
+from tests.fakefetcher import FakeFetcher
+
+NUM_CARDS = 150
+
+# Max difference (in hours) between the times of two stats, as each one counts the open times until its own now
+MAX_TIME_DELTA = 1e-3
+
+
+class StreamedBoardSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        board = syntheticboard.generate(num_cards=NUM_CARDS)
+        self.board_id = board.id
+        self.board_json = board.board_json
+        self.fetcher = FakeFetcher(board.board_json, board.actions_json)
+        # Small pages, so every type of card action and the cards have several pages
+        self.cards_page_size = StreamedBoardSnapshot.CARDS_PAGE_SIZE
+        self.actions_page_size = TrelloBoardSnapshot.ACTIONS_PAGE_SIZE
+        StreamedBoardSnapshot.CARDS_PAGE_SIZE = 20
+        TrelloBoardSnapshot.ACTIONS_PAGE_SIZE = 50
+
+    def tearDown(self):
+        StreamedBoardSnapshot.CARDS_PAGE_SIZE = self.cards_page_size
+        TrelloBoardSnapshot.ACTIONS_PAGE_SIZE = self.actions_page_size
+        shutil.rmtree(self.output_dir)
+
+    def _stream(self, **configuration_parameters):
+        configuration = syntheticboard.get_configuration(
+            self.output_dir, streaming_stats=True, **configuration_parameters
+        )
+        return StreamedBoardSnapshot.fetch(self.fetcher, self.board_id, configuration), configuration
+
+    def _get_stats(self, configuration, snapshot):
+        stat_extractor = TrelloStatsExtractor(None, configuration, snapshot)
+        with silenced_stdout():
+            return stat_extractor, stat_extractor.get_stats()
+
+    def test_cards_and_actions_are_fetched_page_by_page(self):
+        snapshot, _configuration = self._stream()
+        # The last page is the first one with less cards than the page size
+        self.assertEqual(
+            self.fetcher.count_requests(u"/boards/{0}/cards".format(self.board_id)), NUM_CARDS // 20 + 1
+        )
+        actions_path = u"/boards/{0}/actions".format(self.board_id)
+        for action_filter, action_type in ((u"createCard", u"createCard"), (u"updateCard:idList", u"updateCard"),
+                                           (u"commentCard", u"commentCard")):
+            num_actions = len([action for action in self.fetcher.actions_json if action["type"] == action_type])
+            action_requests = [request for request in self.fetcher.requests
+                               if request[0] == actions_path and request[1]["filter"] == action_filter]
+            self.assertGreater(len(action_requests), 1)
+            self.assertEqual(len(action_requests), num_actions // 50 + 1)
+        self.assertEqual(snapshot.num_actions, len(self.fetcher.actions_json))
+
+    def test_inactive_cards_are_dropped_and_counted(self):
+        snapshot, _configuration = self._stream()
+        cards_json = self.board_json["cards"]
+        active_card_ids = sorted(card_json["id"] for card_json in cards_json if not card_json["closed"])
+        self.assertEqual([card.id for card in snapshot.cards], active_card_ids)
+        self.assertEqual(snapshot.num_cards, NUM_CARDS)
+        self.assertEqual(len(snapshot.dropped_card_list_indices), NUM_CARDS - len(active_card_ids))
+        self.assertTrue(snapshot.dropped_card_is_closed.all())
+        list_indices = {list_json["id"]: list_index for list_index, list_json in enumerate(self.board_json["lists"])}
+        self.assertEqual(
+            sorted(snapshot.dropped_card_list_indices.tolist()),
+            sorted(list_indices[card_json["idList"]] for card_json in cards_json if card_json["closed"])
+        )
+
+    def _assert_streamed_stats_are_the_bulk_ones(self, card_action_filter=None):
+        snapshot, configuration = self._stream(card_action_filter=card_action_filter)
+        streamed_stat_extractor, streamed_stats = self._get_stats(configuration, snapshot)
+        bulk_stat_extractor, bulk_stats = self._get_stats(
+            syntheticboard.get_configuration(self.output_dir, card_action_filter=card_action_filter),
+            syntheticboard.generate(num_cards=NUM_CARDS)
+        )
+
+        for card_set_name in ("cards", "active_cards", "inactive_cards", "done_inactive_cards", "closed_cards",
+                              "closed_done_cards", "done_cards"):
+            self.assertEqual(len(streamed_stats[card_set_name]), len(bulk_stats[card_set_name]))
+        for card in bulk_stats["active_cards"]:
+            streamed_card_stats = streamed_stats["active_card_stats_by_list"][card.id]
+            for list_id, list_stats in bulk_stats["active_card_stats_by_list"][card.id].items():
+                self.assertAlmostEqual(streamed_card_stats[list_id]["time"], list_stats["time"], delta=MAX_TIME_DELTA)
+                self.assertEqual(streamed_card_stats[list_id]["forward_moves"], list_stats["forward_moves"])
+                self.assertEqual(streamed_card_stats[list_id]["backward_moves"], list_stats["backward_moves"])
+            self.assertEqual(
+                streamed_stats["active_card_spent_estimated_times"][card.id],
+                bulk_stats["active_card_spent_estimated_times"][card.id]
+            )
+        for time_name in ("lead_time", "cycle_time"):
+            self.assertAlmostEqual(streamed_stats[time_name]["avg"], bulk_stats[time_name]["avg"], delta=MAX_TIME_DELTA)
+        for stat_name in ("forward_movements_by_list", "backward_movements_by_list", "movements_by_user"):
+            self.assertEqual(streamed_stats[stat_name], bulk_stats[stat_name])
+        self.assertEqual(streamed_stat_extractor.spent_week_time_by_user, bulk_stat_extractor.spent_week_time_by_user)
+        self.assertEqual(streamed_stats["cumulative_flow"].wip.tolist(), bulk_stats["cumulative_flow"].wip.tolist())
+        self.assertEqual(
+            streamed_stats["throughput"].done_by_day.tolist(), bulk_stats["throughput"].done_by_day.tolist()
+        )
+
+    def test_streamed_stats_are_the_bulk_ones(self):
+        self._assert_streamed_stats_are_the_bulk_ones()
+
+    def test_streamed_stats_with_card_action_filter_are_the_bulk_ones(self):
+        self._assert_streamed_stats_are_the_bulk_ones([u"2016-03-01", u"2016-12-31"])
+
+
+if __name__ == "__main__":
+    unittest.main()
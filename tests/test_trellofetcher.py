@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from stats.trellofetcher import TokenBucket, TrelloFetcher
+
+
+# Local HTTP server that answers each path with a sequence of responses (status, headers, JSON body).
+# The last response of a path is repeated once the sequence is exhausted.
+class StubServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.responses_by_path = {}
+        self.requested_paths = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    def get_api_url(self):
+        return u"http://127.0.0.1:{0}/1".format(self.server_address[1])
+
+    def respond(self, path, query):
+        with self.lock:
+            self.requested_paths.append(path)
+            if path == "/1/batch":
+                # Each URL of the batch is answered with the response of its path
+                return 200, {}, [self._inner_response(url.split("?")[0]) for url in query["urls"][0].split(",")]
+            responses = self.responses_by_path.get(path, [(404, {}, {})])
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def _inner_response(self, path):
+        responses = self.responses_by_path[u"/1{0}".format(path)]
+        status, _headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        return {str(status): body}
+
+    def count_requests(self, path):
+        with self.lock:
+            return len([requested_path for requested_path in self.requested_paths if requested_path == path])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        status, headers, body = self.server.respond(parsed_url.path, parse_qs(parsed_url.query))
+        headers = dict(headers)
+        # Delay asked by the test to change the order in which concurrent requests finish
+        time.sleep(headers.pop("X-Delay", 0))
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for header_name, header_value in headers.items():
+            self.send_header(header_name, header_value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TrelloFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.server.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _fetcher(self, **kwargs):
+        return TrelloFetcher(u"key", u"token", api_url=self.server.get_api_url(), **kwargs)
+
+    def test_rate_limited_request_is_retried_after_retry_after(self):
+        self.server.responses_by_path["/1/boards/a"] = [(429, {"Retry-After": "1"}, {}), (200, {}, {"id": "a"})]
+        fetcher = self._fetcher(backoff=0.0)
+        start_time = time.time()
+        self.assertEqual(fetcher.fetch_json(u"/boards/a"), {"id": "a"})
+        self.assertGreaterEqual(time.time() - start_time, 1.0)
+        self.assertEqual(self.server.count_requests("/1/boards/a"), 2)
+
+    def test_server_error_is_retried_with_backoff(self):
+        self.server.responses_by_path["/1/boards/a"] = [(500, {}, {}), (503, {}, {}), (200, {}, {"id": "a"})]
+        fetcher = self._fetcher(backoff=0.1)
+        start_time = time.time()
+        self.assertEqual(fetcher.fetch_json(u"/boards/a"), {"id": "a"})
+        # Waits of 0.1 and 0.2 seconds
+        self.assertGreaterEqual(time.time() - start_time, 0.3)
+        self.assertEqual(self.server.count_requests("/1/boards/a"), 3)
+
+    def test_request_gives_up_after_max_retries(self):
+        self.server.responses_by_path["/1/boards/a"] = [(502, {}, {})]
+        fetcher = self._fetcher(max_retries=2, backoff=0.01)
+        with self.assertRaises(requests.HTTPError):
+            fetcher.fetch_json(u"/boards/a")
+        self.assertEqual(self.server.count_requests("/1/boards/a"), 3)
+
+    def test_client_error_is_not_retried(self):
+        self.server.responses_by_path["/1/boards/a"] = [(404, {}, {})]
+        fetcher = self._fetcher(backoff=0.01)
+        with self.assertRaises(requests.HTTPError):
+            fetcher.fetch_json(u"/boards/a")
+        self.assertEqual(self.server.count_requests("/1/boards/a"), 1)
+
+    def test_token_bucket_paces_requests(self):
+        # Bursts of 5 requests and 10 requests per second: 15 requests need at least 1 second
+        token_bucket = TokenBucket(5, 0.5)
+        start_time = time.time()
+        for _request_index in range(15):
+            token_bucket.acquire()
+        self.assertGreaterEqual(time.time() - start_time, 0.95)
+
+    def test_fetcher_is_paced_by_its_rate_limit(self):
+        self.server.responses_by_path["/1/boards/a"] = [(200, {}, {"id": "a"})]
+        fetcher = self._fetcher(rate_limit=2, rate_limit_period=0.5)
+        start_time = time.time()
+        for _request_index in range(6):
+            fetcher.fetch_json(u"/boards/a")
+        # 2 requests at once and then 4 requests at 4 requests per second
+        self.assertGreaterEqual(time.time() - start_time, 0.95)
+
+    def test_fetch_all_returns_the_result_of_each_key(self):
+        for card_index in range(6):
+            self.server.responses_by_path["/1/cards/{0}".format(card_index)] = [
+                (200, {"X-Delay": 0.05 * (6 - card_index)}, {"id": card_index})
+            ]
+        fetcher = self._fetcher(concurrency=6)
+        jobs = {
+            card_index: (lambda _card_index=card_index: fetcher.fetch_json(u"/cards/{0}".format(_card_index)))
+            for card_index in range(6)
+        }
+        results = dict(fetcher.fetch_all(jobs))
+        self.assertEqual(results, {card_index: {"id": card_index} for card_index in range(6)})
+
+    def test_fetch_batch_returns_results_in_request_order(self):
+        for card_index in range(25):
+            self.server.responses_by_path["/1/cards/{0}".format(card_index)] = [
+                (200, {"X-Delay": 0.01 * (card_index % 5)}, {"id": card_index})
+            ]
+        requests_ = [(u"/cards/{0}".format(card_index), {"fields": "name"}) for card_index in range(25)]
+        expected_results = [{"id": card_index} for card_index in range(25)]
+        self.assertEqual(self._fetcher(concurrency=8).fetch_batch(requests_), expected_results)
+        self.assertEqual(self._fetcher(batch=True).fetch_batch(requests_), expected_results)
+        # 25 requests in groups of 10
+        self.assertEqual(self.server.count_requests("/1/batch"), 3)
+
+    def test_fetch_batch_fetches_again_failed_batch_responses(self):
+        self.server.responses_by_path["/1/cards/0"] = [(200, {}, {"id": 0})]
+        self.server.responses_by_path["/1/cards/1"] = [(429, {}, {}), (503, {}, {}), (200, {}, {"id": 1})]
+        requests_ = [(u"/cards/0", None), (u"/cards/1", None)]
+        fetcher = self._fetcher(batch=True, backoff=0.01)
+        self.assertEqual(fetcher.fetch_batch(requests_), [{"id": 0}, {"id": 1}])
+        # The failed response is fetched alone and retried
+        self.assertEqual(self.server.count_requests("/1/cards/1"), 2)
+
+    def test_fetch_batch_raises_client_errors_of_batch_responses(self):
+        self.server.responses_by_path["/1/cards/0"] = [(404, {}, {})]
+        fetcher = self._fetcher(batch=True, backoff=0.01)
+        with self.assertRaises(requests.HTTPError):
+            fetcher.fetch_batch([(u"/cards/0", None)])
+        self.assertEqual(self.server.count_requests("/1/cards/0"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
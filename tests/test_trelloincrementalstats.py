@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import copy
+import shutil
+import tempfile
+import unittest
+
+from benchmark import silenced_stdout
+from benchmarks import syntheticboard
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+from stats.trellostatsextractor import TrelloStatsExtractor
+
+# Actions made after this date are new in the second run
+CUT_DATE = u"2016-09-01"
+
+# Max difference (in hours) between the times of two runs, as each run counts the open times until its own now
+MAX_TIME_DELTA = 1e-3
+
+
+# Snapshot of a board as it was before a date: cards created after it are not in the board yet and the rest of the
+# cards are in the list they were then
+def _get_snapshot_before(snapshot, date, late_action_ids=()):
+    """
+    :param snapshot: TrelloBoardSnapshot with its raw JSON.
+    :param date: date (YYYY-MM-DD).
+    :param late_action_ids: ids of actions made before date that had not been fetched yet (e.g. because they were
+    fetched after the page of newer actions of other types).
+    :return: TrelloBoardSnapshot.
+    """
+    actions_json = [action for action in snapshot.actions_json
+                    if action["date"][0:10] < date and action["id"] not in late_action_ids]
+    board_json = copy.deepcopy(snapshot.board_json)
+    cards_json = []
+    for card_json in board_json["cards"]:
+        card_actions = [action for action in actions_json if action["data"]["card"]["id"] == card_json["id"]]
+        if not card_actions:
+            continue
+        # Actions are sorted from the newest to the oldest one
+        movements = [action for action in card_actions if action["type"] == u"updateCard"]
+        if movements:
+            card_json["idList"] = movements[0]["data"]["listAfter"]["id"]
+        else:
+            card_json["idList"] = board_json["lists"][0]["id"]
+        card_json["dateLastActivity"] = card_actions[0]["date"]
+        cards_json.append(card_json)
+    board_json["cards"] = cards_json
+    return TrelloBoardSnapshot(board_json, copy.deepcopy(actions_json))
+
+
+class IncrementalBoardStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _get_stats(self, snapshot, **configuration_parameters):
+        configuration = syntheticboard.get_configuration(self.output_dir, **configuration_parameters)
+        stat_extractor = TrelloStatsExtractor(None, configuration, snapshot)
+        with silenced_stdout():
+            return stat_extractor, stat_extractor.get_stats()
+
+    def _assert_incremental_stats_are_the_full_ones(self, card_action_filter=None):
+        board = syntheticboard.generate(num_cards=200)
+        # Some actions made before the first run are only fetched in the second one
+        late_action_ids = {action["id"] for action in board.actions_json[0:600:7]}
+        self._get_stats(
+            _get_snapshot_before(board, CUT_DATE, late_action_ids),
+            incremental_stats=True, card_action_filter=card_action_filter
+        )
+        incremental_stat_extractor, incremental_stats = self._get_stats(
+            board, incremental_stats=True, card_action_filter=card_action_filter
+        )
+        full_stat_extractor, full_stats = self._get_stats(
+            syntheticboard.generate(num_cards=200), card_action_filter=card_action_filter
+        )
+
+        self.assertEqual(len(incremental_stats["active_cards"]), len(full_stats["active_cards"]))
+        for card in full_stats["active_cards"]:
+            incremental_card_stats = incremental_stats["active_card_stats_by_list"][card.id]
+            for list_id, list_stats in full_stats["active_card_stats_by_list"][card.id].items():
+                self.assertAlmostEqual(
+                    incremental_card_stats[list_id]["time"], list_stats["time"], delta=MAX_TIME_DELTA
+                )
+                self.assertEqual(incremental_card_stats[list_id]["forward_moves"], list_stats["forward_moves"])
+                self.assertEqual(incremental_card_stats[list_id]["backward_moves"], list_stats["backward_moves"])
+            self.assertEqual(
+                incremental_stats["active_card_spent_estimated_times"][card.id],
+                full_stats["active_card_spent_estimated_times"][card.id]
+            )
+
+        for list_id, time_summary in full_stats["time_by_list"].items():
+            self.assertAlmostEqual(
+                incremental_stats["time_by_list"][list_id]["avg"], time_summary["avg"], delta=MAX_TIME_DELTA
+            )
+        for time_name in ("lead_time", "cycle_time"):
+            self.assertAlmostEqual(
+                incremental_stats[time_name]["avg"], full_stats[time_name]["avg"], delta=MAX_TIME_DELTA
+            )
+        for stat_name in ("forward_movements_by_list", "backward_movements_by_list", "movements_by_user"):
+            self.assertEqual(incremental_stats[stat_name], full_stats[stat_name])
+        for times_name in ("spent_month_time_by_user", "estimated_month_time_by_user",
+                           "spent_week_time_by_user", "estimated_week_time_by_user"):
+            self.assertEqual(
+                _without_zeros(getattr(incremental_stat_extractor, times_name)),
+                _without_zeros(getattr(full_stat_extractor, times_name))
+            )
+        self.assertEqual(
+            incremental_stats["cumulative_flow"].wip.tolist(), full_stats["cumulative_flow"].wip.tolist()
+        )
+        self.assertEqual(
+            incremental_stats["throughput"].done_by_day.tolist(), full_stats["throughput"].done_by_day.tolist()
+        )
+
+    def test_incremental_stats_are_the_full_ones(self):
+        self._assert_incremental_stats_are_the_full_ones()
+
+    def test_incremental_stats_with_card_action_filter_are_the_full_ones(self):
+        self._assert_incremental_stats_are_the_full_ones([u"2016-03-01", u"2016-12-31"])
+
+
+# Times by user and period without the periods whose times have been removed
+def _without_zeros(times_by_user):
+    return {
+        member_id: {period: time for period, time in times.items() if time != 0}
+        for member_id, times in times_by_user.items()
+    }
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from benchmarks import syntheticboard
+from stats.trelloboardsnapshot import TrelloBoardSnapshot
+from stats.trellolisttransitions import ListTransitions
+
+# Lists that are not in the board (e.g. lists of other boards)
+UNKNOWN_LIST = {"id": u"5685c18000000000000000ff", "name": u"List of other board"}
+
+# Max difference (in hours) between the list times of both implementations
+MAX_TIME_DELTA = 4e-5
+
+
+class ListTransitionsTest(unittest.TestCase):
+
+    def setUp(self):
+        board = syntheticboard.generate(num_cards=200)
+        actions_json = board.actions_json
+        movements_by_card = {}
+        for action in reversed(actions_json):
+            if action["type"] == u"updateCard":
+                movements_by_card.setdefault(action["data"]["card"]["id"], []).append(action)
+        cards_json = {card_json["id"]: card_json for card_json in board.board_json["cards"]}
+        for card_index, (card_id, movements) in enumerate(sorted(movements_by_card.items())):
+            # Some cards come from other boards and some cards have been moved to other boards
+            if card_index % 5 == 0:
+                movements[0]["data"]["listBefore"] = dict(UNKNOWN_LIST)
+            elif card_index % 5 == 1:
+                movements[-1]["data"]["listAfter"] = dict(UNKNOWN_LIST)
+                cards_json[card_id]["idList"] = UNKNOWN_LIST["id"]
+        self.snapshot = TrelloBoardSnapshot(board.board_json, actions_json)
+        self.lists = self.snapshot.lists
+        self.done_list = self.lists[-1]
+        list_indices = {list_.id: list_index for list_index, list_ in enumerate(self.lists)}
+
+        # Unknown lists go before the board lists, as UNKNOWN_LIST does in ListTransitions
+        def list_cmp(list_a_id, list_b_id):
+            return list_indices.get(list_b_id, -1) - list_indices.get(list_a_id, -1)
+
+        self.list_cmp = list_cmp
+
+    def _assert_transitions_are_the_card_stats(self, card_movements_filter=None):
+        cards = self.snapshot.cards
+        list_transitions_before = ListTransitions(cards, self.lists, self.done_list, card_movements_filter)
+        list_transitions_before.compute(time.time(), time_unit="hours")
+        cards_stats_by_list = [
+            card.get_stats_by_list(self.lists, self.list_cmp, self.done_list, "hours", card_movements_filter)
+            for card in cards
+        ]
+        # Each card counts its open time until its own now, that is between the ones of both transitions
+        list_transitions_after = ListTransitions(cards, self.lists, self.done_list, card_movements_filter)
+        list_transitions_after.compute(time.time(), time_unit="hours")
+
+        for card_index, card_stats_by_list in enumerate(cards_stats_by_list):
+            stats_before = list_transitions_before.get_card_stats_by_list(card_index)
+            stats_after = list_transitions_after.get_card_stats_by_list(card_index)
+            for list_id, list_stats in card_stats_by_list.items():
+                self.assertGreaterEqual(list_stats["time"], stats_before[list_id]["time"] - MAX_TIME_DELTA)
+                self.assertLessEqual(list_stats["time"], stats_after[list_id]["time"] + MAX_TIME_DELTA)
+                self.assertEqual(list_stats["forward_moves"], stats_before[list_id]["forward_moves"])
+                self.assertEqual(list_stats["backward_moves"], stats_before[list_id]["backward_moves"])
+
+        # Cards have been in the done list and left it, and moved from and to unknown lists
+        done_list_index = len(self.lists) - 1
+        self.assertTrue((list_transitions_before.time_by_list[:, done_list_index] > 0).any())
+        self.assertTrue((list_transitions_before.transitions["from_list"] == -1).any())
+        self.assertTrue((list_transitions_before.transitions["to_list"] == -1).any())
+
+    def test_transitions_are_the_card_stats(self):
+        self._assert_transitions_are_the_card_stats()
+
+    def test_filtered_transitions_are_the_filtered_card_stats(self):
+        self._assert_transitions_are_the_card_stats([u"2016-03-01", u"2016-12-31"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import numpy
+
+from benchmarks import syntheticboard
+from stats.trellostatsservice import TrelloStatsService, dumps_json
+
+
+class TrelloStatsServiceTest(unittest.TestCase):
+
+    def test_dumps_json_replaces_non_finite_numbers_with_null(self):
+        data = {
+            "avg": float("nan"),
+            "std_dev": numpy.float64("nan"),
+            "max": float("inf"),
+            "percentiles": {"p50": numpy.float64(1.5), "p95": numpy.nan},
+            "values": [numpy.int64(3), -numpy.inf]
+        }
+        self.assertEqual(json.loads(dumps_json(data).decode("utf-8")), {
+            "avg": None,
+            "std_dev": None,
+            "max": None,
+            "percentiles": {"p50": 1.5, "p95": None},
+            "values": [3, None]
+        })
+
+    def test_two_configurations_of_the_same_board_are_rejected(self):
+        configurations = [syntheticboard.get_configuration(u"/tmp"), syntheticboard.get_configuration(u"/tmp")]
+        with self.assertRaises(ValueError):
+            TrelloStatsService(None, configurations)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+
+from benchmark import silenced_stdout
+from benchmarks import syntheticboard
+from stats.trellostatsextractor import TrelloStatsExtractor
+
+
+class ThroughputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _get_stats(self, **configuration_parameters):
+        configuration = syntheticboard.get_configuration(self.output_dir, **configuration_parameters)
+        stat_extractor = TrelloStatsExtractor(None, configuration, syntheticboard.generate(num_cards=300))
+        with silenced_stdout():
+            return stat_extractor, stat_extractor.get_stats()
+
+    def _assert_all_done_cards_are_counted(self, stat_extractor, stats):
+        done_card_ids = [card.id for card in stat_extractor.cards if card.idList == stat_extractor.done_list.id]
+        self.assertGreater(len(done_card_ids), len(stats["done_cards"]))
+        self.assertEqual(int(stats["throughput"].done_by_week.sum()), len(done_card_ids))
+        self.assertEqual(int(stats["throughput"].done_by_day.sum()), len(done_card_ids))
+
+    def test_closed_cards_in_the_done_list_are_counted(self):
+        self._assert_all_done_cards_are_counted(*self._get_stats())
+
+    def test_incremental_throughput_counts_closed_cards(self):
+        stat_extractor, stats = self._get_stats(incremental_stats=True)
+        self._assert_all_done_cards_are_counted(stat_extractor, stats)
+        _full_stat_extractor, full_stats = self._get_stats()
+        self.assertEqual(list(stats["throughput"].done_by_week), list(full_stats["throughput"].done_by_week))
+
+
+if __name__ == "__main__":
+    unittest.main()